@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark ponta a ponta do /analyze com réplicas locais de OpenAI, SerpApi, Bing, Nominatim e OSRM
+(bench/fakes.py, em um subprocesso).
+
+Cargas:
+- text   consulta digitada, sem localização
+- image  foto (como o navegador envia), sem texto
+- geo    consulta digitada + localização (mapa + rotas)
+- mixed  foto + localização
+
+Relata p50/p95/p99, vazão, CPU por etapa (tempos do pipeline), CPU do processo por requisição e
+memória (RSS de pico). Com --save-baseline grava bench/baselines/e2e.json; com --compare falha
+(código 1) se p95 subir ou a vazão cair além de --tolerance. O baseline depende da máquina e fica fora
+do git: grave-o na mesma máquina (e com os mesmos parâmetros) antes da mudança a comparar.
+
+Uso:
+    python bench/bench_e2e.py                                   # todas as cargas, perfil realistic
+    python bench/bench_e2e.py --workload geo -n 300 -c 32 --profile fast
+    python bench/bench_e2e.py --latency openai=1200 --errors serpapi=0.05
+    python bench/bench_e2e.py --save-baseline | --compare
+    python bench/bench_e2e.py --server-cmd "gunicorn -c gunicorn.conf.py compras:app" --port 11001
+    python bench/bench_e2e.py --server-cmd "..." --server-cpus 0-3 --fakes-cpus 4-5 --client-cpus 6-7
+"""
+
+import argparse, base64, io, json, os, random, resource, shlex, statistics, subprocess, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path[:0] = [HERE, ROOT]
+BASELINE = os.path.join(HERE, "baselines", "e2e.json")
+
+import fakes
+
+QUERIES = ["arroz", "dipirona", "alicate", "caderno", "fone bluetooth", "feijão carioca", "paracetamol",
+           "furadeira", "cabeleireiro", "troca de óleo", "leite integral", "caneta azul"]
+CENTER = (-23.5505, -46.6333)   # São Paulo
+
+def pct(xs: List[float], p: float) -> float:
+    if not xs: return float("nan")
+    xs = sorted(xs)
+    k = (len(xs) - 1) * p
+    lo, hi = int(k), min(int(k) + 1, len(xs) - 1)
+    return xs[lo] + (xs[hi] - xs[lo]) * (k - lo)
+
+def start_fakes(args) -> (subprocess.Popen, Dict[str, str]):
+    cmd = [sys.executable, os.path.join(HERE, "fakes.py"), "--profile", args.profile]
+    for x in args.latency or []: cmd += ["--latency", x]
+    for x in args.errors or []: cmd += ["--errors", x]
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True, preexec_fn=pin(args.fakes_cpus))
+    env = json.loads(p.stdout.readline())
+    return p, env
+
+def parse_cpus(spec: Optional[str]) -> Optional[set]:
+    """ "0-1,4" → {0, 1, 4}; None/vazio = sem fixar."""
+    if not spec: return None
+    out = set()
+    for part in spec.split(","):
+        a, _, b = part.partition("-")
+        out.update(range(int(a), int(b or a) + 1))
+    return out
+
+def pin(spec: Optional[str]):
+    """preexec_fn que fixa o subprocesso nos núcleos de spec (Linux)."""
+    cpus = parse_cpus(spec)
+    return (lambda: os.sched_setaffinity(0, cpus)) if cpus else None
+
+def app_env(fake_env: Dict[str, str], args) -> Dict[str, str]:
+    env = dict(fake_env)
+    # caches compartilhados num diretório novo a cada execução: nada aquecido de rodadas anteriores
+    env.update(fakes.app_env("bench-e2e-", WEB_ACCESS_LOG="", POI_DB=args.poi_db))
+    if args.no_cache: env.update({"MAPS_CACHE_TTL_S": "0", "SHOP_CACHE_TTL": "serpapi=0,bing=0"})
+    return env
+
+def synthetic_images(k: int, upload: str, max_side: int = 1280) -> List[Any]:
+    """binary: JPEG já reduzido como o navegador faz (campo "image"); base64: data URL do quadro cheio."""
+    from bench_images import synthetic_photo
+    from PIL import Image
+    out = []
+    for i in range(k):
+        raw = synthetic_photo(1600 + 40 * i, 1200, quality=88)
+        if upload == "base64":
+            out.append("data:image/jpeg;base64," + base64.b64encode(raw).decode("ascii")); continue
+        im = Image.open(io.BytesIO(raw)); im.thumbnail((max_side, max_side))
+        buf = io.BytesIO(); im.save(buf, format="JPEG", quality=85); out.append(buf.getvalue())
+    return out
+
+def make_request(workload: str, rnd: random.Random, images: List[Any], locations: List[tuple]):
+    form: Dict[str, str] = {}; files = None
+    if workload in ("text", "geo"): form["q"] = rnd.choice(QUERIES)
+    if workload in ("image", "mixed"):
+        img = rnd.choice(images)
+        if isinstance(img, bytes): files = {"image": ("foto.jpg", img, "image/jpeg")}
+        else: form["image_base64"] = img
+    if workload in ("geo", "mixed"):
+        lat, lng = rnd.choice(locations)
+        form["lat"], form["lng"] = f"{lat:.6f}", f"{lng:.6f}"
+    return form, files
+
+def parse_server_timing(h: str) -> Dict[str, float]:
+    out = {}
+    for part in (h or "").split(","):
+        bits = [b.strip() for b in part.split(";")]
+        if not bits[0]: continue
+        for b in bits[1:]:
+            if b.startswith("dur="):
+                try: out[bits[0]] = float(b[4:])
+                except ValueError: pass
+    return out
+
+def tree_rss_mb(pid: int) -> float:
+    """RSS (MB) do processo e de todos os descendentes (Linux /proc)."""
+    kids: Dict[int, List[int]] = {}
+    for d in os.listdir("/proc"):
+        if not d.isdigit(): continue
+        try:
+            ppid = int(open(f"/proc/{d}/stat").read().rsplit(")", 1)[1].split()[1])
+            kids.setdefault(ppid, []).append(int(d))
+        except Exception:
+            continue
+    total, stack = 0, [pid]
+    while stack:
+        p = stack.pop(); stack += kids.get(p, [])
+        try:
+            for line in open(f"/proc/{p}/status"):
+                if line.startswith("VmRSS:"): total += int(line.split()[1])
+        except Exception:
+            pass
+    return total / 1024
+
+def run_workload(base_url: str, workload: str, args, images, locations, timings_sink: Optional[list], server_pid: Optional[int]):
+    import requests
+    rnd = random.Random(f"{args.seed}-{workload}")
+    reqs = [make_request(workload, rnd, images, locations) for _ in range(args.n)]
+    local = threading.local()
+    lat_ms: List[float] = []; errors = [0]; header_stages: Dict[str, List[float]] = {}
+    lock = threading.Lock()
+
+    def one(req):
+        form, files = req
+        s = getattr(local, "s", None)
+        if s is None: s = local.s = requests.Session()
+        t0 = time.perf_counter()
+        try:
+            r = s.post(base_url + "/analyze", data=form, files=files, timeout=args.timeout)
+            ok = r.status_code == 200
+            st = parse_server_timing(r.headers.get("Server-Timing", ""))
+        except Exception:
+            ok, st = False, {}
+        dt = (time.perf_counter() - t0) * 1000
+        with lock:
+            lat_ms.append(dt)
+            if not ok: errors[0] += 1
+            for k, v in st.items(): header_stages.setdefault(k, []).append(v)
+
+    if timings_sink is not None: timings_sink.clear()
+    cpu0 = time.process_time()
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.c) as ex:
+        list(ex.map(one, reqs))
+    wall = time.perf_counter() - t0
+    cpu = time.process_time() - cpu0
+
+    res: Dict[str, Any] = {
+        "n": args.n, "concurrency": args.c, "errors": errors[0],
+        "p50_ms": round(pct(lat_ms, 0.50), 1), "p95_ms": round(pct(lat_ms, 0.95), 1), "p99_ms": round(pct(lat_ms, 0.99), 1),
+        "throughput_rps": round(args.n / wall, 2),
+    }
+    if timings_sink is not None:
+        stages: Dict[str, Dict[str, List[float]]] = {}
+        for t in list(timings_sink):
+            for name, s in t["stages"].items():
+                d = stages.setdefault(name, {"dur": [], "cpu": []})
+                d["dur"].append(s["dur_ms"]); d["cpu"].append(s.get("cpu_ms", 0.0))
+        res["stages"] = {k: {"dur_ms_p50": round(pct(v["dur"], 0.5), 1), "cpu_ms_mean": round(statistics.mean(v["cpu"]), 2)}
+                         for k, v in sorted(stages.items())}
+        res["cpu_ms_per_request"] = round(cpu * 1000 / args.n, 2)   # inclui o gerador de carga
+        res["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    else:
+        res["stages"] = {k: {"dur_ms_p50": round(pct(v, 0.5), 1)} for k, v in sorted(header_stages.items())}
+        if server_pid: res["server_rss_mb"] = round(tree_rss_mb(server_pid), 1)
+    return res
+
+def print_result(workload: str, r: Dict[str, Any]):
+    print(f"\n== {workload}: n={r['n']} c={r['concurrency']} erros={r['errors']}")
+    print(f"   p50 {r['p50_ms']:.0f} ms · p95 {r['p95_ms']:.0f} ms · p99 {r['p99_ms']:.0f} ms · {r['throughput_rps']:.1f} req/s")
+    if "cpu_ms_per_request" in r:
+        print(f"   CPU/req {r['cpu_ms_per_request']:.1f} ms · RSS pico {r['peak_rss_mb']:.0f} MB")
+    if "server_rss_mb" in r:
+        print(f"   RSS do servidor {r['server_rss_mb']:.0f} MB")
+    for k, v in r.get("stages", {}).items():
+        extra = f" · CPU {v['cpu_ms_mean']:.1f} ms" if "cpu_ms_mean" in v else ""
+        print(f"   {k:10} p50 {v['dur_ms_p50']:8.1f} ms{extra}")
+
+def compare(results: Dict[str, Any], tol: float, meta: Dict[str, Any]) -> bool:
+    if not os.path.exists(BASELINE):
+        print(f"\nsem baseline em {BASELINE} (grave antes com --save-baseline)"); return True
+    base = json.load(open(BASELINE))
+    diff = [k for k in ("profile", "latency", "errors", "n", "c", "upload", "server_cmd") if base.get("meta", {}).get(k) != meta.get(k)]
+    if diff: print(f"\natenção: parâmetros diferentes do baseline ({', '.join(diff)}) — comparação pouco significativa")
+    ok = True
+    print(f"\nComparação com baseline (tolerância {tol:.0%}):")
+    for w, r in results.items():
+        b = base.get("workloads", {}).get(w)
+        if not b: continue
+        p95_ok = r["p95_ms"] <= b["p95_ms"] * (1 + tol)
+        rps_ok = r["throughput_rps"] >= b["throughput_rps"] * (1 - tol)
+        ok &= p95_ok and rps_ok
+        print(f"   {w:6} p95 {b['p95_ms']:.0f} → {r['p95_ms']:.0f} ms {'ok' if p95_ok else 'REGRESSÃO'} · "
+              f"vazão {b['throughput_rps']:.1f} → {r['throughput_rps']:.1f} req/s {'ok' if rps_ok else 'REGRESSÃO'}")
+    return ok
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workload", default="all", choices=["all", "text", "image", "geo", "mixed"])
+    ap.add_argument("-n", type=int, default=100, help="requisições por carga")
+    ap.add_argument("-c", type=int, default=16, help="concorrência")
+    ap.add_argument("--profile", default="realistic", help="perfil de latência das réplicas (fast, realistic)")
+    ap.add_argument("--latency", action="append", help="serviço=mediana_ms[:sigma]")
+    ap.add_argument("--errors", action="append", help="serviço=taxa de erro")
+    ap.add_argument("--locations", type=int, default=40, help="pontos distintos de localização")
+    ap.add_argument("--images", type=int, default=6, help="fotos distintas")
+    ap.add_argument("--upload", default="binary", choices=["binary", "base64"], help="como a foto é enviada")
+    ap.add_argument("--poi-db", default="", help="índice local de lojas (vazio = desativado)")
+    ap.add_argument("--no-cache", action="store_true", help="desliga os caches do mapa e das lojas online")
+    ap.add_argument("--timeout", type=float, default=120)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--server-cmd", help="sobe o servidor com este comando (ex.: gunicorn) em vez de rodar em processo")
+    ap.add_argument("--port", type=int, default=11001)
+    ap.add_argument("--server-cpus", help="núcleos do servidor (ex.: 0-3), p/ medir a escala por worker")
+    ap.add_argument("--fakes-cpus", help="núcleos das réplicas (ex.: 4-5), fora dos do servidor")
+    ap.add_argument("--client-cpus", help="núcleos do gerador de carga (ex.: 6-7)")
+    ap.add_argument("--save-baseline", action="store_true")
+    ap.add_argument("--compare", action="store_true")
+    ap.add_argument("--tolerance", type=float, default=0.2)
+    ap.add_argument("--json", help="grava o resultado neste arquivo")
+    args = ap.parse_args()
+
+    if parse_cpus(args.client_cpus): os.sched_setaffinity(0, parse_cpus(args.client_cpus))
+    fakes_proc, fake_env = start_fakes(args)
+    server_proc = None
+    try:
+        env = app_env(fake_env, args)
+        timings: Optional[list] = None
+        if args.server_cmd:
+            server_proc = subprocess.Popen(shlex.split(args.server_cmd), cwd=ROOT,
+                                           env={**os.environ, **env, "PORT": str(args.port)},
+                                           preexec_fn=pin(args.server_cpus))
+            base_url = f"http://127.0.0.1:{args.port}"
+            import requests
+            for _ in range(200):
+                try:
+                    requests.get(base_url + "/", timeout=1); break
+                except Exception:
+                    time.sleep(0.1)
+        else:
+            os.environ.update(env)
+            import compras
+            from werkzeug.serving import make_server
+            import logging
+            logging.getLogger("werkzeug").setLevel(logging.ERROR)
+            timings = []
+            orig = compras.run_analyze_pipeline
+            def traced(*a, **k):
+                out = orig(*a, **k); timings.append(out["timings"]); return out
+            compras.run_analyze_pipeline = traced
+            srv = make_server("127.0.0.1", 0, compras.app, threaded=True)
+            threading.Thread(target=srv.serve_forever, daemon=True).start()
+            base_url = f"http://127.0.0.1:{srv.server_port}"
+
+        rnd = random.Random(args.seed)
+        locations = [(CENTER[0] + rnd.uniform(-0.08, 0.08), CENTER[1] + rnd.uniform(-0.08, 0.08)) for _ in range(args.locations)]
+        workloads = ["text", "image", "geo", "mixed"] if args.workload == "all" else [args.workload]
+        images = synthetic_images(args.images, args.upload) if any(w in ("image", "mixed") for w in workloads) else []
+
+        results = {}
+        for w in workloads:
+            results[w] = run_workload(base_url, w, args, images, locations, timings, server_proc.pid if server_proc else None)
+            print_result(w, results[w])
+
+        doc = {"meta": {"profile": args.profile, "latency": args.latency, "errors": args.errors, "n": args.n, "c": args.c, "upload": args.upload,
+                        "server_cmd": args.server_cmd, "when": time.strftime("%Y-%m-%d %H:%M:%S")},
+               "workloads": results}
+        if args.json:
+            json.dump(doc, open(args.json, "w"), indent=2, ensure_ascii=False)
+        if args.save_baseline:
+            os.makedirs(os.path.dirname(BASELINE), exist_ok=True)
+            json.dump(doc, open(BASELINE, "w"), indent=2, ensure_ascii=False)
+            print(f"\nbaseline gravado em {BASELINE}")
+        if args.compare and not compare(results, args.tolerance, doc["meta"]):
+            sys.exit(1)
+    finally:
+        if server_proc:
+            server_proc.terminate()
+            try: server_proc.wait(timeout=30)
+            except Exception: server_proc.kill()
+        fakes_proc.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark do preparo de imagem do /analyze.
+
+Compara o caminho antigo (pil_compress_to_jpeg duas vezes: 1280px e 360px, cada uma
+decodificando o original) com prepare_upload (uma decodificação com draft + miniatura
+derivada da imagem intermediária).
+
+Uso:
+    python bench/bench_images.py                 # fotos sintéticas 12 MP / 3 MP
+    python bench/bench_images.py foto1.jpg ...   # fotos reais
+    python bench/bench_images.py -n 20
+"""
+
+import argparse, io, os, statistics, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("PIPELINE_LOG_TIMINGS", "0")
+
+from PIL import Image, ImageDraw, ImageFilter
+
+import compras
+
+def synthetic_photo(w: int, h: int, quality: int = 92) -> bytes:
+    """Foto "de celular" sintética: gradiente + formas + ruído de sensor (comprime como foto real)."""
+    base = Image.linear_gradient("L").resize((w, h)).convert("RGB")
+    d = ImageDraw.Draw(base)
+    for k in range(12):
+        x0, y0 = (k * 337) % w, (k * 211) % h
+        d.rectangle((x0, y0, x0 + w // 5, y0 + h // 4), fill=((k * 40) % 255, (k * 90) % 255, (k * 150) % 255))
+    noise = Image.effect_noise((w, h), 18).convert("RGB")
+    im = Image.blend(base, noise, 0.15).filter(ImageFilter.SMOOTH)
+    out = io.BytesIO(); im.save(out, format="JPEG", quality=quality)
+    return out.getvalue()
+
+def old_path(raw: bytes):
+    jpeg = compras.pil_compress_to_jpeg(io.BytesIO(raw), max_side=1280, quality=82)
+    thumb = compras.pil_compress_to_jpeg(io.BytesIO(raw), max_side=360, quality=70)
+    return jpeg, thumb
+
+def new_path(raw: bytes):
+    img = compras.prepare_upload(io.BytesIO(raw), max_side=1280, quality=82, thumb_side=360, thumb_quality=70)
+    return img["jpeg"], img["thumb"]
+
+def measure(fn, raw: bytes, n: int):
+    fn(raw)  # aquecimento
+    wall, cpu = [], []
+    for _ in range(n):
+        t0, c0 = time.perf_counter(), time.process_time()
+        jpeg, thumb = fn(raw)
+        wall.append((time.perf_counter() - t0) * 1000); cpu.append((time.process_time() - c0) * 1000)
+    return {"wall_ms_p50": statistics.median(wall), "wall_ms_mean": statistics.mean(wall),
+            "cpu_ms_mean": statistics.mean(cpu), "jpeg_kb": len(jpeg) / 1024, "thumb_kb": len(thumb) / 1024}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("photos", nargs="*")
+    ap.add_argument("-n", type=int, default=10)
+    args = ap.parse_args()
+
+    samples = [(os.path.basename(p), open(p, "rb").read()) for p in args.photos]
+    if not samples:
+        samples = [("sintética 4000x3000 (12 MP)", synthetic_photo(4000, 3000)),
+                   ("sintética 2000x1500 (3 MP)", synthetic_photo(2000, 1500))]
+
+    for name, raw in samples:
+        old, new = measure(old_path, raw, args.n), measure(new_path, raw, args.n)
+        print(f"\n{name} — {len(raw)/1024:.0f} KB")
+        print(f"  {'':8} {'p50 ms':>9} {'média ms':>9} {'CPU ms':>9} {'jpeg KB':>8} {'thumb KB':>9}")
+        for label, r in (("antigo", old), ("novo", new)):
+            print(f"  {label:8} {r['wall_ms_p50']:9.1f} {r['wall_ms_mean']:9.1f} {r['cpu_ms_mean']:9.1f} {r['jpeg_kb']:8.1f} {r['thumb_kb']:9.1f}")
+        print(f"  ganho: {old['wall_ms_p50']/new['wall_ms_p50']:.1f}x no p50, {old['cpu_ms_mean']/new['cpu_ms_mean']:.1f}x em CPU")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Página HTML: bytes transferidos e tempo de template.
+
+Mede, pelo cliente de teste do Flask (réplicas locais no perfil "fast"):
+- tamanho do HTML de GET / e do resultado de POST /analyze, sem compressão, gzip e br;
+- CSS/JS locais referenciados pela página (tamanho por codificação, Cache-Control, revalidação com ETag);
+- tempo de render (Server-Timing "render") e o custo de compilar o template do zero, que
+  render_template_string pagava a cada requisição.
+
+Uso:
+    python bench/bench_page.py
+    python bench/bench_page.py -n 50
+"""
+
+import argparse, os, re, statistics, sys, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import fakes
+
+_svcs, _env = fakes.isolated_env("fast", prefix="bench-page-")
+
+import compras
+
+ENCODINGS = ("identity", "gzip", "br")
+FORM = {"q": "arroz tio joão 5kg", "lat": "-23.5505", "lng": "-46.6333"}
+
+def fetch(client, page: str, encoding: str, headers=None):
+    h = {"Accept-Encoding": encoding}; h.update(headers or {})
+    if page == "resultado": return client.post("/analyze", data=FORM, headers=h)
+    return client.get(page, headers=h)
+
+def render_ms(resp) -> float:
+    m = re.search(r"render;dur=([\d.]+)", resp.headers.get("Server-Timing", ""))
+    return float(m.group(1)) if m else float("nan")
+
+def template_source() -> str:
+    if hasattr(compras, "PAGE"): return compras.PAGE
+    return compras.app.jinja_loader.get_source(compras.app.jinja_env, "page.html")[0]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", type=int, default=30)
+    args = ap.parse_args()
+    client = compras.app.test_client()
+
+    best = {}
+    for page in ("/", "resultado"):
+        fetch(client, page, "identity")   # aquecimento (caches do pipeline)
+        sizes = {enc: fetch(client, page, enc) for enc in ENCODINGS}
+        renders = [render_ms(fetch(client, page, "gzip, br")) for _ in range(args.n)]
+        print(f"\n== {page}")
+        for enc, r in sizes.items():
+            print(f"   HTML {enc:8} {len(r.data)/1024:7.1f} KB   (Content-Encoding: {r.headers.get('Content-Encoding', '-')})")
+        print(f"   render p50 {statistics.median(renders):.2f} ms   p95 {sorted(renders)[int(0.95*(len(renders)-1))]:.2f} ms")
+        best[page] = min(len(r.data) for r in sizes.values())
+
+    html = fetch(client, "/", "identity").get_data(as_text=True)
+    local = [u for u in re.findall(r'(?:href|src)="(/[^"]+)"', html)]
+    assets_best = 0
+    print("\n== assets locais" + ("" if local else ": nenhum (CSS/JS embutidos no HTML)"))
+    for url in local:
+        sizes = {enc: fetch(client, url, enc) for enc in ENCODINGS}
+        r = sizes["gzip"]
+        again = fetch(client, url, "gzip", {"If-None-Match": r.headers.get("ETag", "")})
+        print(f"   {url}")
+        print("      " + "   ".join(f"{enc} {len(x.data)/1024:.1f} KB" for enc, x in sizes.items()))
+        print(f"      Cache-Control: {r.headers.get('Cache-Control')}   revalidação: {again.status_code} ({len(again.data)} B)")
+        assets_best += min(len(x.data) for x in sizes.values())
+
+    src = template_source()
+    comp = []
+    for _ in range(max(5, args.n // 3)):
+        t0 = time.perf_counter(); compras.app.jinja_env.from_string(src); comp.append((time.perf_counter() - t0) * 1000)
+    print(f"\n== compilar o template do zero: p50 {statistics.median(comp):.2f} ms ({len(src)/1024:.1f} KB de fonte)")
+    print(f"\n== bytes por visita (melhor codificação aceita)")
+    print(f"   1ª visita       {(best['/'] + assets_best)/1024:7.1f} KB   (HTML + CSS/JS locais)")
+    print(f"   visitas seguintes {best['/']/1024:5.1f} KB   (assets em cache)")
+    print(f"   resultado       {best['resultado']/1024:7.1f} KB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Ranqueamento das lojas candidatas: tempo e qualidade da deduplicação entre fontes.
+
+Gera lojas sintéticas (redes com várias filiais, algumas vizinhas) e as candidatas que as fontes
+devolveriam: SerpApi (com place_id; às vezes repetida), Nominatim ("Supermercado <nome>, Rua ..., São Paulo",
+coordenada deslocada até ~60 m, sem place_id). Compara:
+- antes: ordenar por haversine_km elemento a elemento, sem deduplicar;
+- agora: rank_candidates (NumPy + fusão por place_id / proximidade + nome).
+
+Uso:
+    python bench/bench_rank.py
+    python bench/bench_rank.py --sizes 10,100,500 --osm 0.5 --repeat 0.1
+"""
+
+import argparse, math, os, random, statistics, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("PIPELINE_LOG_TIMINGS", "0")
+
+import compras
+
+BRANDS = ["Pão de Açúcar", "Carrefour", "Extra", "Dia", "Assaí", "Atacadão", "Sonda", "Hirota", "St Marche",
+          "Oba Hortifruti", "Mambo", "Negreiros", "Bom Preço", "Economia", "Comper"]
+SUFFIX = ["", "", " Express", " Bairro", " Vila Mariana", " Moema", " Centro"]
+
+def synthetic(n_stores: int, osm: float, repeat: float, rnd: random.Random, lat0=-23.55, lng0=-46.63):
+    """Candidatas (embaralhadas) + id da loja verdadeira de cada uma."""
+    cands, truth = [], []
+    for k in range(n_stores):
+        name = rnd.choice(BRANDS) + rnd.choice(SUFFIX)
+        lat, lng = lat0 + rnd.uniform(-0.03, 0.03), lng0 + rnd.uniform(-0.03, 0.03)
+        serp = {"title": name, "address": f"R. {k}, São Paulo", "lat": lat, "lng": lng, "place_id": f"P{k}",
+                "website": f"https://loja{k}.example.com.br" if rnd.random() < 0.5 else "", "maps_url": ""}
+        cands.append(serp); truth.append(k)
+        if rnd.random() < repeat:
+            cands.append(dict(serp)); truth.append(k)
+        if rnd.random() < osm:
+            d, a = rnd.uniform(0, 60), rnd.uniform(0, 2*math.pi)
+            olat = lat + d*math.sin(a)/110540.0; olng = lng + d*math.cos(a)/(111320.0*math.cos(math.radians(lat)))
+            cands.append({"title": f"Supermercado {name}, Rua OSM {k}, São Paulo", "address": "", "lat": olat, "lng": olng,
+                          "website": "", "maps_url": ""}); truth.append(k)
+    order = list(range(len(cands))); rnd.shuffle(order)
+    return [cands[i] for i in order], [truth[i] for i in order]
+
+def old_rank(lat, lng, cands):
+    return sorted(cands, key=lambda c: compras.haversine_km(lat, lng, c["lat"], c["lng"]))
+
+def timeit(fn, n):
+    fn(); xs = []
+    for _ in range(n):
+        t0 = time.perf_counter(); fn(); xs.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(xs)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10,30,100,300,600", help="lojas verdadeiras por cenário")
+    ap.add_argument("--osm", type=float, default=0.5, help="fração das lojas também devolvidas pelo Nominatim")
+    ap.add_argument("--repeat", type=float, default=0.1, help="fração repetida pelo SerpApi")
+    ap.add_argument("-n", type=int, default=20)
+    args = ap.parse_args()
+    rnd = random.Random(7)
+    lat, lng = -23.55, -46.63
+
+    print(f"{'lojas':>6} {'candidatas':>10} {'antes ms':>9} {'agora ms':>9} {'distintas':>9} "
+          f"{'fusões erradas':>14} {'dup. restantes':>14} {'dup. no top 9 antes→agora':>26}")
+    for n in (int(x) for x in args.sizes.split(",")):
+        cands, truth = synthetic(n, args.osm, args.repeat, rnd)
+        t_old = timeit(lambda: old_rank(lat, lng, cands), args.n)
+        t_new = timeit(lambda: compras.rank_candidates(lat, lng, cands), args.n)
+
+        tid = {id(c): t for c, t in zip(cands, truth)}
+        ranked = compras.rank_candidates(lat, lng, cands)
+        # cada saída é cópia da candidata escolhida no grupo: acha a loja verdadeira pela coordenada
+        by_coord = {}
+        for c, t in zip(cands, truth): by_coord.setdefault((c["lat"], c["lng"]), set()).add(t)
+        out_truth = [next(iter(by_coord[(r["lat"], r["lng"])])) for r in ranked]
+        wrong = len(set(truth)) - len(set(out_truth))           # lojas que sumiram fundidas a outra
+        left = len(out_truth) - len(set(out_truth))             # duplicatas que ficaram
+        top_old = [tid[id(c)] for c in old_rank(lat, lng, cands)[:9]]
+        print(f"{n:6d} {len(cands):10d} {t_old:9.2f} {t_new:9.2f} {len(ranked):9d} {wrong:14d} {left:14d} "
+              f"{9 - len(set(top_old)):>17d} → {len(out_truth[:9]) - len(set(out_truth[:9]))}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Chamadas ao OSRM por sessão de busca com o carrossel de rotas.
+
+Cada sessão: POST /api/analyze (texto + localização) e depois o que a página faria no carrossel —
+se as rotas vierem com route_url, busca a exibida e pré-carrega a seguinte a cada clique em
+"Próxima loja"; se vierem com a polyline embutida (versão antiga), não busca nada.
+Os cliques seguem --clicks (fração de sessões por número de cliques); com --origins K as sessões
+partem de K bairros (até ~100 m do centro de cada um), como usuários de uma mesma região.
+As chamadas são contadas na réplica do OSRM (bench/fakes.py, perfil "fast").
+
+Uso:
+    python bench/bench_routes.py
+    python bench/bench_routes.py -n 200 --clicks 0:0.6,1:0.25,2:0.15
+    python bench/bench_routes.py -n 300 --origins 20      # mesmos bairros: mostra o cache de rotas
+"""
+
+import argparse, os, random, statistics, sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import fakes
+
+_svcs, _env = fakes.isolated_env("fast", prefix="bench-routes-")
+
+import compras
+
+QUERIES = ["arroz tio joão 5kg", "dipirona 500mg", "shampoo anticaspa", "pilha aa", "leite integral"]
+
+def parse_clicks(s: str):
+    pairs = [(int(k), float(v)) for k, v in (x.split(":") for x in s.split(","))]
+    total = sum(w for _, w in pairs)
+    return [(k, w / total) for k, w in pairs]
+
+def session(client, rnd: random.Random, clicks: int, origin) -> dict:
+    osrm = _svcs["osrm"]
+    before = osrm.requests
+    lat, lng = origin[0] + rnd.uniform(-0.0009, 0.0009), origin[1] + rnd.uniform(-0.0009, 0.0009)
+    js = client.post("/api/analyze", data={"q": rnd.choice(QUERIES), "lat": f"{lat:.6f}", "lng": f"{lng:.6f}"}).get_json()
+    at_page = osrm.requests - before
+    routes = js.get("routes") or []
+    fetched = set()
+    for i in range(min(clicks, max(0, len(routes) - 1)) + 1):
+        for r in routes[i:i + 2]:   # rota exibida + a seguinte (prefetch)
+            url = r.get("route_url")
+            if url and url not in fetched:
+                fetched.add(url); client.get(url)
+    stages = (js.get("timings") or {}).get("stages") or {}
+    return {"osrm": osrm.requests - before, "osrm_at_page": at_page, "routes": len(routes),
+            "routes_ms": (stages.get("routes") or {}).get("dur_ms")}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", type=int, default=120, help="sessões")
+    ap.add_argument("--clicks", default="0:0.6,1:0.25,2:0.15", help='cliques em "Próxima loja": k:fração,...')
+    ap.add_argument("--origins", type=int, default=0, help="bairros de onde partem as sessões (0 = cada uma num lugar)")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    rnd = random.Random(args.seed)
+    dist = parse_clicks(args.clicks)
+    client = compras.app.test_client()
+    spot = lambda: (-23.55 + rnd.uniform(-0.08, 0.08), -46.63 + rnd.uniform(-0.08, 0.08))
+    origins = [spot() for _ in range(args.origins)]
+    by_clicks = {k: [] for k, _ in dist}
+    for _ in range(args.n):
+        k = rnd.choices([k for k, _ in dist], [w for _, w in dist])[0]
+        by_clicks[k].append(session(client, rnd, k, rnd.choice(origins) if origins else spot()))
+
+    alls = [s for v in by_clicks.values() for s in v]
+    print(f"{args.n} sessões, {statistics.mean(s['routes'] for s in alls):.1f} rotas por busca")
+    for k, v in by_clicks.items():
+        if v: print(f"   {k} clique(s): {len(v):4d} sessões   OSRM/sessão {statistics.mean(s['osrm'] for s in v):.2f}")
+    print(f"   média: OSRM/sessão {statistics.mean(s['osrm'] for s in alls):.2f}"
+          f"   (até a página responder: {statistics.mean(s['osrm_at_page'] for s in alls):.2f})")
+    ms = [s["routes_ms"] for s in alls if s["routes_ms"] is not None]
+    if ms: print(f"   etapa routes: p50 {statistics.median(ms):.1f} ms")
+    rc = client.get("/stats").get_json().get("route_cache")
+    if rc: print(f"   cache de rotas: hit ratio {rc['hit_ratio']}   {rc['size']} rotas, {rc['points']} pontos, {rc['bytes']/1024:.0f} KB")
+
+if __name__ == "__main__":
+    main()
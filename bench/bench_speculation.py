@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Nominatim especulativo: latência da busca de lojas + rotas e consultas ao Nominatim por política.
+
+Cada busca chama compute_top_routes (busca no mapa + /table + fallback do OSM se faltar loja) a partir
+de --origins bairros; nas áreas "esparsas" (bench/fakes.py --sparse) o google_maps só acha 1 loja e o
+Nominatim é obrigatório. Compara NOMINATIM_SPECULATE=never|always|adaptive, cada uma num processo novo
+(caches vazios, índice local de lojas desligado p/ toda busca passar pelo mapa).
+Réplicas com latência fixa: serpapi 300 ms, nominatim 200 ms, osrm 30 ms; o Nominatim da réplica
+segue o limite de taxa de produção (--nominatim-rate, req/s:rajada).
+
+Uso:
+    python bench/bench_speculation.py
+    python bench/bench_speculation.py -n 200 --sparse 0.3 --origins 15
+    python bench/bench_speculation.py --policy adaptive        # só uma política, neste processo
+"""
+
+import argparse, json, os, random, statistics, subprocess, sys, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+POLICIES = ("never", "always", "adaptive")
+QUERIES = ["arroz tio joão 5kg", "dipirona 500mg", "parafuso sextavado", "caderno 10 matérias"]
+
+def pct(xs, p):
+    xs = sorted(xs)
+    return xs[int(p * (len(xs) - 1))]
+
+def run(args) -> dict:
+    import fakes
+    fakes.SPARSE = args.sparse
+    lat_ms = {"serpapi": 300, "nominatim": 200, "osrm": 30}
+    svcs, env = fakes.isolated_env("fast", {k: {"median_ms": v, "sigma": 0.1} for k, v in lat_ms.items()},
+                                   prefix="bench-spec-", NOMINATIM_SPECULATE=args.policy, POI_DB="", RATE_LIMIT_DB="")
+    os.environ["RATE_LIMITS"] = f"{env['NOMINATIM_URL'].split('/')[2]}={args.nominatim_rate}"
+    import compras
+
+    rnd = random.Random(args.seed)
+    origins = [(-23.55 + rnd.uniform(-0.4, 0.4), -46.63 + rnd.uniform(-0.4, 0.4)) for _ in range(args.origins)]
+    ms, osm_ms = [], []
+    for _ in range(args.n):
+        o = rnd.choice(origins)
+        lat, lng = o[0] + rnd.uniform(-0.01, 0.01), o[1] + rnd.uniform(-0.01, 0.01)
+        time.sleep(rnd.expovariate(1.0 / args.gap))   # usuários chegando: o balde do Nominatim reabastece entre buscas
+        before = compras.FALLBACKS_TOTAL._values.get(("nominatim",), 0)
+        t0 = time.perf_counter()
+        compras.compute_top_routes(lat, lng, rnd.choice(QUERIES), None, topn=3)
+        ms.append((time.perf_counter() - t0) * 1000)
+        if compras.FALLBACKS_TOTAL._values.get(("nominatim",), 0) > before: osm_ms.append(ms[-1])
+    spec = {k[0]: v for k, v in compras.NOMINATIM_SPECULATIVE_TOTAL._values.items()}
+    return {"policy": args.policy, "p50": statistics.median(ms), "p95": pct(ms, 0.95),
+            "osm_p50": statistics.median(osm_ms) if osm_ms else 0, "osm_p95": pct(osm_ms, 0.95) if osm_ms else 0,
+            "fallbacks": len(osm_ms), "nominatim": svcs["nominatim"].requests, "spec": spec,
+            "stats": compras.OSM_SPECULATION.stats()}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", type=int, default=120, help="buscas por política")
+    ap.add_argument("--sparse", type=float, default=0.25, help="fração das áreas com só 1 loja no google_maps")
+    ap.add_argument("--origins", type=int, default=12, help="bairros de onde partem as buscas")
+    ap.add_argument("--gap", type=float, default=1.0, help="intervalo médio entre buscas (s)")
+    ap.add_argument("--nominatim-rate", default="1:1", help="limite do Nominatim, req/s:rajada")
+    ap.add_argument("--policy", choices=POLICIES)
+    ap.add_argument("--json", action="store_true", help=argparse.SUPPRESS)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    if args.policy:
+        out = run(args)
+        if args.json: print(json.dumps(out)); return
+        print(json.dumps(out, indent=1)); return
+
+    print(f"{args.n} buscas por política, {args.origins} bairros, {args.sparse:.0%} das áreas esparsas, "
+          f"Nominatim {args.nominatim_rate} req/s:rajada")
+    print(f"{'':>9} {'todas as buscas':>15} {'com fallback do OSM':>24}")
+    print(f"{'política':>9} {'p50 ms':>7} {'p95 ms':>7} {'n':>6} {'p50 ms':>7} {'p95 ms':>7} {'Nominatim':>10}   especulação")
+    for policy in POLICIES:
+        p = subprocess.run([sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--policy", policy, "--json"],
+                           capture_output=True, text=True, check=True)
+        r = json.loads(p.stdout.strip().splitlines()[-1])
+        spec = ", ".join(f"{k} {v:g}" for k, v in sorted(r["spec"].items())) or "-"
+        print(f"{policy:>9} {r['p50']:7.0f} {r['p95']:7.0f} {r['fallbacks']:6d} {r['osm_p50']:7.0f} {r['osm_p95']:7.0f} "
+              f"{r['nominatim']:10d}   {spec}")
+
+if __name__ == "__main__":
+    main()
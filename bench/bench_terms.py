@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark da detecção de intenção e do filtro de termos proibidos.
+
+Compara a implementação anterior (normaliza todos os termos a cada chamada e faz busca
+por substring) com os matchers pré-compilados do compras.py, em consultas longas e em
+saídas da visão cheias de palavras-chave.
+
+Uso:
+    python bench/bench_terms.py [-n 2000]
+"""
+
+import argparse, os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("PIPELINE_LOG_TIMINGS", "0")
+
+import compras
+from compras import _norm, _norm_txt, INTENT_TABLE, PROHIBITED_TERMS
+
+# --- implementação anterior (referência) ---
+
+def old_is_prohibited(text):
+    bag = _norm_txt(text)
+    return any(term in bag for term in (_norm_txt(t) for t in PROHIBITED_TERMS))
+
+def old_detect_intent(user_q, info):
+    bag = _norm(user_q)
+    if info:
+        for k in ("product_name", "brand", "model", "category"):
+            v = info.get(k)
+            if isinstance(v, str): bag += " " + _norm(v)
+        for kw in info.get("keywords") or []:
+            bag += " " + _norm(kw)
+    for name, terms in INTENT_TABLE:
+        if any(_norm(t) in bag for t in terms):
+            return name
+    return "grocery"
+
+# --- cargas ---
+
+SHORT = [("arroz", None), ("dipirona 500mg", None), ("alicate universal", None), ("cabeleireiro", None)]
+LONG = [(("preciso comprar um presente de aniversário para minha sobrinha que gosta de desenhar, "
+          "talvez lápis de cor, caderno de desenho e uma caneta bonita, perto de casa ") * 4, None),
+        ("qualquer coisa que não bate em nenhuma tabela de intenção " * 10, None)]
+VISION = [("", {"product_name": "Furadeira de Impacto 650W", "brand": "Bosch", "model": "GSB 550 RE",
+                "category": "Ferramentas elétricas",
+                "keywords": ["furadeira", "impacto", "bosch", "650w", "mandril", "alvenaria", "madeira", "metal",
+                             "maleta", "brocas", "uso doméstico", "bivolt", "velocidade variável", "reversível"]}),
+          ("shampoo", {"product_name": "Shampoo Hidratante Coco 350ml", "brand": "Seda", "model": None,
+                       "category": "Higiene pessoal",
+                       "keywords": ["shampoo", "cabelo", "hidratação", "coco", "seda", "350ml", "cabelos secos",
+                                    "limpeza", "brilho", "maciez", "frasco", "família", "uso diário"]})]
+
+def bench(fn, cases, n):
+    fn(*cases[0])
+    t0 = time.perf_counter()
+    for _ in range(n):
+        for args in cases: fn(*args)
+    return (time.perf_counter() - t0) / (n * len(cases)) * 1e6
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", type=int, default=2000)
+    args = ap.parse_args()
+
+    print(f"{'carga':28} {'antigo µs':>10} {'novo µs':>9} {'ganho':>7}")
+    for label, cases in (("intenção — curtas", SHORT), ("intenção — longas", LONG), ("intenção — saída da visão", VISION)):
+        a, b = bench(old_detect_intent, cases, args.n), bench(compras.detect_intent, cases, args.n)
+        print(f"{label:28} {a:10.1f} {b:9.1f} {a/b:6.1f}x")
+    texts = [(q,) for q, _ in SHORT + LONG] + [(" ".join(i["keywords"]),) for _, i in VISION]
+    a, b = bench(old_is_prohibited, texts, args.n), bench(compras.is_prohibited, texts, args.n)
+    print(f"{'proibidos':28} {a:10.1f} {b:9.1f} {a/b:6.1f}x")
+
+if __name__ == "__main__":
+    main()
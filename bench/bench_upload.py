@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Upload da foto: bytes enviados e CPU do servidor até o JPEG do modelo.
+
+Antes: quadro da câmera em tamanho cheio, toDataURL('image/jpeg', 0.92) em dois campos ocultos
+(image_base64 e thumb_base64) → o servidor faz regex + b64decode da string inteira.
+Agora: o navegador reduz a UPLOAD_MAX_SIDE e envia um JPEG (0.85) binário no campo "image" →
+o servidor grava num SpooledTemporaryFile e entrega o stream ao decodificador.
+
+A redução no navegador é simulada com PIL (não entra na CPU do servidor).
+
+Uso:
+    python bench/bench_upload.py                    # quadros 1920x1080 e 4032x3024
+    python bench/bench_upload.py foto1.jpg ... -n 30
+"""
+
+import argparse, base64, io, os, re, statistics, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("PIPELINE_LOG_TIMINGS", "0")
+
+from PIL import Image
+from werkzeug.test import EnvironBuilder
+
+import compras
+from bench_images import synthetic_photo
+
+def old_b64_to_bytes(data_url: str) -> bytes:
+    """b64_to_bytes antes da mudança (regex sobre a string inteira)."""
+    if not data_url: return b""
+    m = re.match(r"^data:image\/[a-zA-Z0-9+.\-]+;base64,(.+)$", data_url)
+    if not m: return b""
+    return base64.b64decode(m.group(1))
+
+def browser_resize(raw: bytes, max_side: int, quality: float = 0.85) -> bytes:
+    im = Image.open(io.BytesIO(raw)).convert("RGB")
+    im.thumbnail((max_side, max_side), Image.BILINEAR)
+    out = io.BytesIO(); im.save(out, format="JPEG", quality=int(quality * 100))
+    return out.getvalue()
+
+def build(data) -> (bytes, dict):
+    env = EnvironBuilder(method="POST", path="/analyze", data=data).get_environ()
+    body = env["wsgi.input"].read()
+    return body, env
+
+def environ(body: bytes, env: dict) -> dict:
+    e = dict(env); e["wsgi.input"] = io.BytesIO(body)
+    return e
+
+def server_old(body, env):
+    with compras.app.request_context(environ(body, env)):
+        from flask import request
+        raw = old_b64_to_bytes(request.form.get("image_base64", ""))
+        request.form.get("thumb_base64")
+        return compras.compress_upload(raw)
+
+def server_new(body, env):
+    with compras.app.request_context(environ(body, env)):
+        _q, raw, _thumb, _loc = compras.read_analyze_inputs()
+        return compras.compress_upload(raw)
+
+def measure(fn, body, env, n):
+    fn(body, env)
+    cpu, wall = [], []
+    for _ in range(n):
+        c0, t0 = time.process_time(), time.perf_counter()
+        fn(body, env)
+        cpu.append(time.process_time() - c0); wall.append(time.perf_counter() - t0)
+    return statistics.median(cpu) * 1000, statistics.median(wall) * 1000
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("photos", nargs="*")
+    ap.add_argument("-n", type=int, default=20)
+    args = ap.parse_args()
+
+    frames = [(p, open(p, "rb").read()) for p in args.photos] or \
+             [("1920x1080", synthetic_photo(1920, 1080, quality=92)), ("4032x3024", synthetic_photo(4032, 3024, quality=92))]
+    for name, raw in frames:
+        data_url = "data:image/jpeg;base64," + base64.b64encode(raw).decode("ascii")
+        old_body, old_env = build({"q": "", "image_base64": data_url, "thumb_base64": data_url, "lat": "", "lng": ""})
+        small = browser_resize(raw, compras.UPLOAD_MAX_SIDE)
+        new_body, new_env = build({"q": "", "image": (io.BytesIO(small), "foto.jpg", "image/jpeg"), "lat": "", "lng": ""})
+
+        o_cpu, o_wall = measure(server_old, old_body, old_env, args.n)
+        n_cpu, n_wall = measure(server_new, new_body, new_env, args.n)
+        print(f"\n== {name} (foto {len(raw)/1024:.0f} KB)")
+        print(f"   upload   antes {len(old_body)/1024:8.0f} KB   agora {len(new_body)/1024:8.0f} KB   "
+              f"(-{100*(1-len(new_body)/len(old_body)):.0f}%)")
+        print(f"   CPU srv  antes {o_cpu:8.1f} ms   agora {n_cpu:8.1f} ms   (-{100*(1-n_cpu/o_cpu):.0f}%)")
+        print(f"   tempo    antes {o_wall:8.1f} ms   agora {n_wall:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
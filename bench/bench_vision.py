@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Visão adaptativa: bytes enviados, latência e taxa de escalada por modo.
+
+Fotos sintéticas (bench_images.synthetic_photo, tamanhos variados) passam por compress_upload e
+identify_product (sem o cache de visão) em VISION_MODE=full (só a foto cheia, como antes) e adaptive
+(JPEG pequeno com detail "low"; escala p/ a cheia com confiança < VISION_MIN_CONFIDENCE ou campos faltando).
+A réplica da OpenAI (bench/fakes.py) cobra latência por token de imagem (--ms-per-token) e tira até
+--low-penalty pontos de confiança das imagens com detail "low".
+
+Uso:
+    python bench/bench_vision.py
+    python bench/bench_vision.py -n 60 --min-confidence 80 --low-side 384
+"""
+
+import argparse, os, random, statistics, sys, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import fakes
+
+_svcs, _env = fakes.isolated_env("fast", {"openai": {"median_ms": 600, "sigma": 0.2}}, prefix="bench-vision-")
+
+import compras
+from bench_images import synthetic_photo
+
+SIZES = [(1280, 960), (1920, 1080), (4032, 3024), (1080, 1920)]
+
+def pct(xs, p):
+    xs = sorted(xs)
+    return xs[int(p * (len(xs) - 1))]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", type=int, default=40, help="fotos por modo")
+    ap.add_argument("--min-confidence", type=int, default=compras.VISION_MIN_CONFIDENCE)
+    ap.add_argument("--low-side", type=int, default=compras.VISION_LOW_SIDE)
+    ap.add_argument("--ms-per-token", type=float, default=1.0, help="latência da réplica por token de imagem")
+    ap.add_argument("--low-penalty", type=int, default=15, help="perda máxima de confiança com detail low")
+    args = ap.parse_args()
+
+    fakes.OPENAI_MS_PER_IMAGE_TOKEN, fakes.LOW_DETAIL_PENALTY = args.ms_per_token, args.low_penalty
+    compras.VISION_MIN_CONFIDENCE, compras.VISION_LOW_SIDE = args.min_confidence, args.low_side
+    rnd = random.Random(3)
+    photos = []
+    for i in range(args.n):
+        w, h = rnd.choice(SIZES)
+        photos.append(synthetic_photo(w + rnd.randint(0, 64), h + rnd.randint(0, 64), quality=88 + i % 5))
+
+    print(f"{args.n} fotos por modo, escala com confiança < {args.min_confidence}, imagem pequena {args.low_side} px, "
+          f"{args.ms_per_token:g} ms/token na réplica")
+    print(f"{'modo':>9} {'KB/foto':>8} {'p50 ms':>7} {'p95 ms':>7} {'escaladas':>9} {'confiança':>9}")
+    for mode in ("full", "adaptive"):
+        compras.VISION_MODE = mode
+        ms, conf = [], []
+        before = compras.VISION_BYTES_TOTAL._values.copy()
+        esc0 = sum(compras.VISION_ESCALATIONS_TOTAL._values.values())
+        for raw in photos:
+            jpeg, _thumb, _phash, low = compras.compress_upload(raw)
+            t0 = time.perf_counter()
+            info = compras.identify_product(jpeg, low)
+            ms.append((time.perf_counter() - t0) * 1000)
+            conf.append(info.get("confidence_pct") or 0)
+        after = compras.VISION_BYTES_TOTAL._values
+        sent = sum(after.get(k, 0) - before.get(k, 0) for k in after)
+        esc = sum(compras.VISION_ESCALATIONS_TOTAL._values.values()) - esc0
+        print(f"{mode:>9} {sent / len(photos) / 1024:8.1f} {statistics.median(ms):7.0f} {pct(ms, 0.95):7.0f} "
+              f"{esc / len(photos):9.0%} {statistics.mean(conf):9.1f}")
+    print("\n/stats → vision:", compras.VISION_STATS.stats())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Réplicas locais dos serviços externos usados pelo compras.py, p/ benchmarks reprodutíveis.
+
+Um servidor HTTP por serviço (portas distintas, como hosts distintos em produção):
+- openai    POST /v1/chat/completions             (identificação de produto)
+- serpapi   GET  /search.json                     (engine=google_shopping | google_maps)
+- bing      GET  /v7.0/search
+- nominatim GET  /search
+- osrm      GET  /route/v1/driving/..., /table/v1/driving/...
+
+Cada serviço tem latência log-normal (mediana em ms + sigma) e taxa de erro (HTTP 503).
+As respostas são determinísticas para os mesmos parâmetros.
+
+Uso isolado (imprime as URLs em JSON e fica rodando):
+    python bench/fakes.py --profile realistic --latency openai=1800:0.3 --errors serpapi=0.05
+"""
+
+import argparse, base64, hashlib, io, json, math, os, random, sys, tempfile, threading, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+# mediana (ms), sigma log-normal, taxa de erro
+PROFILES: Dict[str, Dict[str, Dict[str, float]]] = {
+    "fast": {s: {"median_ms": 5, "sigma": 0.2, "error_rate": 0.0} for s in ("openai", "serpapi", "bing", "nominatim", "osrm")},
+    "realistic": {
+        "openai":    {"median_ms": 2500, "sigma": 0.35, "error_rate": 0.0},
+        "serpapi":   {"median_ms": 1800, "sigma": 0.40, "error_rate": 0.0},
+        "bing":      {"median_ms": 600,  "sigma": 0.30, "error_rate": 0.0},
+        "nominatim": {"median_ms": 400,  "sigma": 0.40, "error_rate": 0.0},
+        "osrm":      {"median_ms": 150,  "sigma": 0.50, "error_rate": 0.0},
+    },
+}
+
+PRODUCTS = [
+    {"product_name": "Arroz Branco Tipo 1 5kg", "brand": "Tio João", "model": None, "category": "Alimentos",
+     "keywords": ["arroz", "tipo 1", "5kg"], "suggested_query": "arroz tio joão 5kg", "confidence_pct": 92},
+    {"product_name": "Dipirona Monoidratada 500mg", "brand": "Medley", "model": None, "category": "Medicamento",
+     "keywords": ["dipirona", "analgésico", "remedio"], "suggested_query": "dipirona 500mg", "confidence_pct": 88},
+    {"product_name": "Alicate Universal 8\"", "brand": "Tramontina", "model": "44001/108", "category": "Ferramentas",
+     "keywords": ["alicate", "ferramenta"], "suggested_query": "alicate universal tramontina", "confidence_pct": 81},
+    {"product_name": "Caderno Universitário 10 Matérias", "brand": "Tilibra", "model": None, "category": "Papelaria",
+     "keywords": ["caderno", "material escolar"], "suggested_query": "caderno 10 matérias", "confidence_pct": 64},
+]
+
+# fração das áreas (células de ~10 km) onde o google_maps só acha 1 loja: obriga o fallback do Nominatim
+SPARSE = 0.0
+# visão: ms extras por token de imagem (tokens como os da OpenAI: detail "low" = 85, senão 85 + 170 por bloco de 512 px)
+# e perda de confiança (até LOW_DETAIL_PENALTY pontos) quando a imagem vem com detail "low"
+OPENAI_MS_PER_IMAGE_TOKEN = 0.0
+LOW_DETAIL_PENALTY = 15
+
+TYPES = {"supermercado": "Supermercado", "farmácia": "Farmácia", "loja de ferramentas": "Loja de ferramentas",
+         "papelaria": "Papelaria", "loja de eletrônicos": "Loja de eletrônicos", "cabeleireiro": "Cabeleireiro",
+         "oficina mecânica": "Oficina mecânica"}
+
+def _rng(*parts: Any) -> random.Random:
+    return random.Random(hashlib.sha1("|".join(map(str, parts)).encode()).hexdigest())
+
+def _haversine_m(lat1, lon1, lat2, lon2) -> float:
+    p = math.pi / 180.0
+    a = math.sin((lat2-lat1)*p/2)**2 + math.cos(lat1*p)*math.cos(lat2*p)*math.sin((lon2-lon1)*p/2)**2
+    return 2 * 6371000.0 * math.asin(math.sqrt(a))
+
+def _places(q: str, lat: float, lng: float, n: int):
+    r = _rng(q, round(lat, 3), round(lng, 3))
+    out = []
+    for i in range(n):
+        out.append((f"{TYPES.get(q, q.title())} {r.choice(['Central', 'da Vila', 'Bom Preço', 'Popular', 'Express', 'do Bairro'])} {i+1}",
+                    lat + r.uniform(-0.03, 0.03), lng + r.uniform(-0.03, 0.03)))
+    return out
+
+# ---------- respostas por serviço ----------
+
+def _vision_image(body: bytes) -> Tuple[Optional[bytes], str]:
+    """JPEG e detail da mensagem enviada à visão (None se não houver imagem)."""
+    try:
+        for msg in json.loads(body).get("messages") or []:
+            for part in msg.get("content") if isinstance(msg.get("content"), list) else []:
+                if part.get("type") == "image_url":
+                    url = part["image_url"]["url"]
+                    return base64.b64decode(url.partition(",")[2]), part["image_url"].get("detail") or "auto"
+    except Exception:
+        pass
+    return None, "auto"
+
+def image_tokens(jpeg: bytes, detail: str) -> int:
+    if detail == "low": return 85
+    from PIL import Image
+    w, h = Image.open(io.BytesIO(jpeg)).size
+    s = min(1.0, 2048 / max(w, h)); w, h = w * s, h * s
+    s = min(1.0, 768 / min(w, h)); w, h = w * s, h * s
+    return 85 + 170 * math.ceil(w / 512) * math.ceil(h / 512)
+
+def openai_response(body: bytes) -> Dict[str, Any]:
+    prod = PRODUCTS[int(hashlib.sha1(body[-4096:]).hexdigest(), 16) % len(PRODUCTS)]
+    jpeg, detail = _vision_image(body)
+    if jpeg is not None:
+        if OPENAI_MS_PER_IMAGE_TOKEN: time.sleep(image_tokens(jpeg, detail) * OPENAI_MS_PER_IMAGE_TOKEN / 1000.0)
+        if detail == "low":
+            prod = dict(prod, confidence_pct=prod["confidence_pct"] - _rng(body[-4096:]).randint(0, LOW_DETAIL_PENALTY))
+    return {"choices": [{"message": {"role": "assistant", "content": json.dumps(prod, ensure_ascii=False)}}]}
+
+def serpapi_response(qs: Dict[str, str]) -> Dict[str, Any]:
+    if qs.get("engine") == "google_maps":
+        lat, lng = [float(x) for x in qs.get("ll", "@-23.55,-46.63,14z").lstrip("@").split(",")[:2]]
+        anchor = qs.get("q", "supermercado")
+        sparse = _rng("sparse", round(lat, 1), round(lng, 1)).random() < SPARSE
+        res = []
+        for k, (title, slat, slng) in enumerate(_places(anchor, lat, lng, 1 if sparse else 20)):
+            res.append({"position": k+1, "title": title, "address": f"Rua Exemplo, {100+k}",
+                        "gps_coordinates": {"latitude": slat, "longitude": slng}, "type": TYPES.get(anchor, anchor.title()),
+                        "place_id": hashlib.md5(title.encode()).hexdigest()[:20],
+                        "website": f"https://loja{k}.example.com.br" if k % 3 == 0 else None,
+                        "link": f"https://www.google.com/maps/place/?q=place_id:{k}"})
+        return {"local_results": res}
+    r = _rng(qs.get("q", ""))
+    return {"shopping_results": [{"title": f"{qs.get('q', '')} — oferta {i+1}", "link": f"https://loja{r.randint(1, 40)}.example.com.br/p/{i}",
+                                  "price": f"R$ {r.uniform(5, 500):.2f}".replace(".", ","), "source": f"Loja {i+1}"} for i in range(20)]}
+
+def bing_response(qs: Dict[str, str]) -> Dict[str, Any]:
+    return {"webPages": {"value": [{"name": f"Resultado {i+1}", "url": f"https://www.site{i % 7}.example.com.br/{i}",
+                                    "snippet": "Compre com frete grátis"} for i in range(20)]}}
+
+def nominatim_response(qs: Dict[str, str]):
+    minx, maxy, maxx, miny = [float(x) for x in qs.get("viewbox", "-47,-23,-46,-24").split(",")]
+    lat, lng = (miny + maxy) / 2, (minx + maxx) / 2
+    limit = int(qs.get("limit", "10"))
+    return [{"display_name": f"{t}, Rua OSM, São Paulo", "lat": str(a), "lon": str(b), "category": "shop", "type": "supermarket"}
+            for t, a, b in _places("osm " + qs.get("q", ""), lat, lng, limit)]
+
+def osrm_response(path: str, qs: Dict[str, str]) -> Dict[str, Any]:
+    coords = [tuple(map(float, c.split(","))) for c in path.rsplit("/", 1)[1].split(";")]
+    if "/table/" in path:
+        src = coords[0]
+        dests = [int(x) for x in qs.get("destinations", "").split(";") if x] or list(range(1, len(coords)))
+        dist = [_haversine_m(src[1], src[0], coords[j][1], coords[j][0]) * 1.35 for j in dests]
+        return {"code": "Ok", "distances": [dist], "durations": [[d / 8.0 for d in dist]]}
+    (lng1, lat1), (lng2, lat2) = coords[0], coords[-1]
+    d = _haversine_m(lat1, lng1, lat2, lng2) * 1.35
+    n = max(2, int(d / 12))  # overview=full: ~1 ponto a cada 12 m
+    r = _rng(path)
+    geom = [[round(lng1 + (lng2-lng1)*k/(n-1) + r.uniform(-2e-4, 2e-4), 6), round(lat1 + (lat2-lat1)*k/(n-1) + r.uniform(-2e-4, 2e-4), 6)]
+            for k in range(n)]
+    return {"code": "Ok", "routes": [{"distance": d, "duration": d / 8.0, "geometry": {"type": "LineString", "coordinates": geom}}]}
+
+# ---------- servidores ----------
+
+class FakeService:
+    def __init__(self, name: str, median_ms: float, sigma: float, error_rate: float, seed: int = 0):
+        self.name, self.median_ms, self.sigma, self.error_rate = name, median_ms, sigma, error_rate
+        self.rand = random.Random(f"{name}-{seed}")
+        self.lock = threading.Lock()
+        self.requests = self.errors = 0
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    def delay_and_fail(self) -> bool:
+        with self.lock:
+            self.requests += 1
+            d = self.median_ms * math.exp(self.rand.gauss(0, self.sigma)) / 1000.0
+            fail = self.rand.random() < self.error_rate
+            if fail: self.errors += 1
+        time.sleep(d)
+        return fail
+
+    def handle(self, method: str, path: str, qs: Dict[str, str], body: bytes) -> Tuple[int, Any]:
+        if self.name == "openai": return 200, openai_response(body)
+        if self.name == "serpapi": return 200, serpapi_response(qs)
+        if self.name == "bing": return 200, bing_response(qs)
+        if self.name == "nominatim": return 200, nominatim_response(qs)
+        if self.name == "osrm": return 200, osrm_response(path, qs)
+        return 404, {"error": "unknown"}
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        svc = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _serve(self, method: str):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0)) if method == "POST" else b""
+                u = urlsplit(self.path)
+                qs = {k: v[0] for k, v in parse_qs(u.query).items()}
+                if svc.delay_and_fail():
+                    code, payload = 503, {"error": "fake upstream error"}
+                else:
+                    code, payload = svc.handle(method, u.path, qs, body)
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                try:
+                    self.send_response(code)
+                    self.send_header("Content-Type", "application/json; charset=utf-8")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):   # cliente desistiu (prazo/hedge)
+                    self.close_connection = True
+
+            def do_GET(self): self._serve("GET")
+            def do_POST(self): self._serve("POST")
+            def log_message(self, *a): pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name=f"fake-{self.name}", daemon=True).start()
+        return f"http://{host}:{self.server.server_port}"
+
+    def stop(self):
+        if self.server: self.server.shutdown(); self.server.server_close()
+
+def parse_overrides(items, key: str) -> Dict[str, Dict[str, float]]:
+    """"openai=1800:0.3" (latência mediana:sigma) ou "serpapi=0.05" (taxa de erro)."""
+    out: Dict[str, Dict[str, float]] = {}
+    for it in items or []:
+        name, _, val = it.partition("=")
+        if key == "latency":
+            med, _, sig = val.partition(":")
+            out[name] = {"median_ms": float(med), **({"sigma": float(sig)} if sig else {})}
+        else:
+            out[name] = {"error_rate": float(val)}
+    return out
+
+def start_all(profile: str = "realistic", overrides: Optional[Dict[str, Dict[str, float]]] = None, seed: int = 0):
+    """Sobe todas as réplicas; devolve (serviços, env com as URLs p/ o compras.py)."""
+    conf = {k: dict(v) for k, v in PROFILES[profile].items()}
+    for name, o in (overrides or {}).items(): conf.setdefault(name, {}).update(o)
+    svcs = {name: FakeService(name, c["median_ms"], c.get("sigma", 0.3), c.get("error_rate", 0.0), seed) for name, c in conf.items()}
+    base = {name: s.start() for name, s in svcs.items()}
+    env = {
+        "OPENAI_CHAT_URL": base["openai"] + "/v1/chat/completions",
+        "SERPAPI_URL": base["serpapi"] + "/search.json",
+        "BING_SEARCH_URL": base["bing"] + "/v7.0/search",
+        "NOMINATIM_URL": base["nominatim"] + "/search",
+        "OSRM_URL": base["osrm"],
+    }
+    return svcs, env
+
+def app_env(prefix: str = "bench-", **extra: str) -> Dict[str, str]:
+    """Chaves falsas e bancos SQLite do compras.py num diretório novo (nada aquecido de rodadas anteriores)."""
+    tmp = tempfile.mkdtemp(prefix=prefix)
+    env = {"OPENAI_API_KEY": "bench", "SERPAPI_API_KEY": "bench", "PIPELINE_LOG_TIMINGS": "0",
+           "POI_DB": os.path.join(tmp, "poi.sqlite"), "VISION_CACHE_DB": os.path.join(tmp, "vision.sqlite"),
+           "MAPS_CACHE_DB": os.path.join(tmp, "maps.sqlite"), "SHOP_CACHE_DB": os.path.join(tmp, "shops.sqlite"),
+           "RATE_LIMIT_DB": os.path.join(tmp, "ratelimit.sqlite")}
+    env.update(extra)
+    return env
+
+def isolated_env(profile: str = "fast", overrides: Optional[Dict[str, Dict[str, float]]] = None,
+                 prefix: str = "bench-", **extra: str):
+    """
+    Sobe as réplicas e aponta o compras.py deste processo p/ elas (os.environ, com app_env);
+    importar o compras só depois. Devolve (serviços, env aplicado).
+    """
+    svcs, env = start_all(profile, overrides)
+    env.update(app_env(prefix, **extra))
+    os.environ.update(env)
+    return svcs, env
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--profile", default="realistic", choices=sorted(PROFILES))
+    ap.add_argument("--latency", action="append", help="serviço=mediana_ms[:sigma]")
+    ap.add_argument("--errors", action="append", help="serviço=taxa")
+    ap.add_argument("--sparse", type=float, default=0.0, help="fração das áreas com só 1 loja no google_maps")
+    args = ap.parse_args()
+    global SPARSE
+    SPARSE = args.sparse
+    ov = parse_overrides(args.latency, "latency")
+    for k, v in parse_overrides(args.errors, "errors").items(): ov.setdefault(k, {}).update(v)
+    _, env = start_all(args.profile, ov)
+    print(json.dumps(env), flush=True)
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -10,19 +10,32 @@ Recursos:
 - Geolocalização automática ao carregar; sem campo de endereço.
 - Intenções para beauty (cabeleireiro/barbearia) e auto_service (mecânico).
 - Bloqueio para itens/consultas proibidas (drogas ilícitas) com mensagem de aviso.
+- /analyze em pipeline concorrente (visão, lojas online, mapa e rotas em paralelo) com tempos por etapa.
+- /api/analyze em JSON, com modo streaming (NDJSON) usado pela página p/ mostrar cada resultado assim que chega.
 
 Observação: chaves padrão seguem como no código original; em produção use variáveis de ambiente.
 """
 
-import os, io, base64, json, re, math, unicodedata
+import os, io, sys, gzip, base64, hashlib, hmac, secrets, json, re, math, time, heapq, queue, random, sqlite3, mimetypes, tempfile, threading, unicodedata, contextvars
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from functools import lru_cache
 from datetime import datetime
-from typing import List, Dict, Any, Tuple, Optional
-from urllib.parse import quote_plus
+from typing import List, Dict, Any, Tuple, Optional, Union, BinaryIO
+from urllib.parse import quote_plus, urlencode, urlsplit
 
+import numpy as np
 import requests
-from flask import Flask, request, render_template_string
+from requests.adapters import HTTPAdapter
+from flask import Flask, Request, Response, abort, g, request, jsonify, render_template
 from PIL import Image
 
+try: import brotli   # opcional: compressão br do HTML/CSS/JS (sem ele, só gzip)
+except ImportError: brotli = None
+
 # === CHAVES (como no seu código; em produção, use variáveis de ambiente) ===
 OPENAI_FALLBACK_KEY = ""
 SERPAPI_FALLBACK_KEY = ""
@@ -35,7 +48,12 @@ SERPAPI_GOOGLE_DOMAIN = os.getenv("SERPAPI_GOOGLE_DOMAIN", "google.com.br").stri
 SERPAPI_HL = os.getenv("SERPAPI_HL", "pt-BR").strip() or "pt-BR"
 
 PORT = int(os.getenv("PORT", "11001"))
-OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+# Endpoints externos (configuráveis p/ apontar a réplicas locais, ex.: bench/fakes.py)
+OPENAI_CHAT_URL = os.getenv("OPENAI_CHAT_URL", "https://api.openai.com/v1/chat/completions").strip()
+SERPAPI_URL = os.getenv("SERPAPI_URL", "https://serpapi.com/search.json").strip()
+BING_SEARCH_URL = os.getenv("BING_SEARCH_URL", "https://api.bing.microsoft.com/v7.0/search").strip()
+NOMINATIM_URL = os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search").strip()
+OSRM_URL = os.getenv("OSRM_URL", "https://router.project-osrm.org").rstrip("/")
 
 NOMINATIM_EMAIL = os.getenv("NOMINATIM_EMAIL", "").strip()
 NOMINATIM_HEADERS = {
@@ -44,398 +62,707 @@ NOMINATIM_HEADERS = {
 }
 
 # === App ===
-app = Flask(__name__)
-
-PAGE = r"""
-<!doctype html>
-<html lang="pt-br">
-<head>
-<meta charset="utf-8"/>
-<meta name="viewport" content="width=device-width,initial-scale=1"/>
-<title>Foto → Onde comprar</title>
-<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css"
-  integrity="sha256-p4NxAoJBhIIN+hmNHrzRCf9tD/miZyoHS5obTRR9BMY=" crossorigin=""/>
-<style>
-  :root{
-    --bg:#F5F8FF; --fg:#142A4D; --mut:#5E6E8C; --card:#FFFFFF; --line:#E3ECF7;
-    --accent:#2F6BFF; --accent-2:#00B5FF; --link:#1E66F5; --chip:#F1F6FF; --chip-line:#D6E4FF;
-  }
-  *{box-sizing:border-box}
-  html,body{margin:0;background:var(--bg);color:var(--fg);font:16px/1.5 system-ui,-apple-system,Segoe UI,Roboto,Ubuntu,Arial}
-  a{color:var(--link);text-decoration:none} a:hover{text-decoration:underline}
-  .wrap{max-width:1280px;margin:0 auto;padding:16px 16px 210px}
-  .grid{display:grid;gap:16px}
-  @media (min-width: 1024px){
-    .grid{ grid-template-columns: 1fr 1fr; align-items:start; }
-    .col-side .card{ position: sticky; top: 12px; }
-  }
-  .brand{display:flex;gap:12px;align-items:center;padding:12px 4px}
-  .logo{width:36px;height:36px;border-radius:10px;background:linear-gradient(135deg,var(--accent),var(--accent-2));}
-  h1{font-size:18px;margin:0}
-  .hint{color:var(--mut);font-size:13px;margin-top:4px}
-  .card{background:var(--card);border:1px solid var(--line);border-radius:16px;padding:16px;margin:0;box-shadow:0 6px 16px rgba(20,42,77,.06)}
-  .me{background:linear-gradient(180deg,#FFFFFF 0%, #F9FBFF 100%)}
-  .me-row{display:flex;gap:10px;align-items:flex-start}
-  .me-thumb{width:56px;height:56px;border-radius:10px;border:1px solid var(--line);object-fit:cover;flex:0 0 auto}
-  .pill{display:inline-block;padding:3px 10px;border-radius:999px;border:1px solid var(--chip-line);background:var(--chip);color:#2A4A88;font-size:12px;margin:2px 6px 0 0}
-  .shops{display:grid;grid-template-columns:1fr;gap:10px;margin-top:8px}
-  @media (min-width: 1024px){ .shops{grid-template-columns:1fr 1fr;} }
-  .shop{padding:12px;border-radius:12px;border:1px solid var(--line);background:#FFFFFF}
-  .mut{color:var(--mut)}
-  .footer{position:fixed;left:0;right:0;bottom:0;background:linear-gradient(180deg, rgba(245,248,255,0) 0%, rgba(245,248,255,.9) 35%, #F5F8FF 75%);padding:12px 10px;border-top:1px solid var(--line);backdrop-filter:saturate(120%) blur(4px)}
-  .ft-wrap{max-width:1280px;margin:0 auto;display:flex;gap:8px;align-items:center;flex-wrap:wrap}
-  .box{display:flex;align-items:center;gap:10px;background:#FFFFFF;border:1px solid var(--line);border-radius:14px;padding:10px 12px;flex:1;min-width:280px}
-  .box input[type="text"]{background:transparent;border:0;outline:0;color:var(--fg);font-size:15px}
-  .box .q{flex:2;min-width:180px}
-  .thumbchip{width:44px;height:44px;border-radius:10px;overflow:hidden;border:1px solid var(--line);display:none}
-  .thumbchip img{width:100%;height:100%;object-fit:cover;display:block}
-  .btn{display:inline-flex;align-items:center;gap:8px;background:#FFFFFF;border:1px solid var(--line);border-radius:12px;padding:10px 12px;cursor:pointer;transition:.15s ease;color:var(--fg)}
-  .btn:hover{border-color:#BFD3FF;box-shadow:0 0 0 2px rgba(47,107,255,.12) inset}
-  .send{background:linear-gradient(135deg,var(--accent),var(--accent-2));color:#fff;border:0}
-  .send:hover{filter:brightness(1.06)}
-  .hidden{display:none}
-  .tiny{font-size:12px;color:var(--mut)}
-  .modal{position:fixed; inset:0; background:rgba(0,0,0,.5); display:none; align-items:center; justify-content:center; padding:20px;}
-  .modal.show{ display:flex; }
-  .cam{ background:#fff; border:1px solid var(--line); border-radius:16px; max-width:720px; width:100%; padding:14px; box-shadow:0 10px 30px rgba(20,42,77,.18) }
-  .cam video{width:100%;border-radius:12px;border:1px solid var(--line);max-height:70vh;object-fit:contain;background:#F1F4FA}
-
-  /* Mapa + carrossel destacado */
-  .mapbox{height:380px;border-radius:12px;border:1px solid var(--line)}
-  @media (min-width: 1400px){ .mapbox{height:420px;} }
-  .car-head{display:flex;justify-content:space-between;align-items:center;gap:8px}
-  .car-ctrl{display:flex;align-items:center;gap:10px}
-  .car-btn{
-    display:inline-flex;align-items:center;gap:8px;
-    border:0; padding:10px 14px; border-radius:12px; cursor:pointer;
-    background:linear-gradient(135deg,var(--accent),var(--accent-2)); color:#fff;
-    font-weight:600; letter-spacing:.2px; box-shadow:0 6px 14px rgba(47,107,255,.25);
-  }
-  .car-btn:disabled{opacity:.6;cursor:not-allowed;filter:grayscale(.2)}
-  .car-hint{font-size:12px;color:var(--mut);margin-top:6px}
-
-  /* Pontinhos */
-  .dots{display:flex;gap:6px;align-items:center}
-  .dot{width:10px;height:10px;border-radius:999px;background:#C7D6F7}
-  .dot.active{background:#fff;outline:3px solid #2F6BFF}
-
-  /* Chamar atenção (pulso curto no início) */
-  @keyframes pulse {
-    0%{ box-shadow:0 0 0 0 rgba(47,107,255,.5) }
-    70%{ box-shadow:0 0 0 12px rgba(47,107,255,0) }
-    100%{ box-shadow:0 0 0 0 rgba(47,107,255,0) }
-  }
-  .attn{ animation: pulse 1.6s ease-out 3; }
-
-  .leaflet-control-zoom a{background:#fff;color:#27406e;border:1px solid var(--line)}
-  .leaflet-control-zoom a:hover{background:#F3F7FF}
-
-  .toast{position:fixed; right:14px; bottom:92px; background:#fff; border:1px solid var(--line); border-radius:12px; padding:10px 12px; box-shadow:0 4px 16px rgba(20,42,77,.12); display:none}
-  .toast.show{display:block}
-</style>
-</head>
-<body>
-<div class="wrap">
-  <div class="brand">
-    <div class="logo"></div>
-    <div>
-      <h1>Foto → Onde comprar</h1>
-      <div class="hint">Digite o que procura ou use a câmera. A sua localização é solicitada automaticamente.</div>
-    </div>
-  </div>
-
-  <div class="grid">
-    <div class="col-main">
-      {% if last_query or me_thumb %}
-      <div class="card me">
-        <div class="mut tiny">Você</div>
-        <div class="me-row" style="margin-top:4px">
-          {% if me_thumb %}<img class="me-thumb" src="{{ me_thumb }}" alt="sua foto"/>{% endif %}
-          {% if last_query %}<div>{{ last_query }}</div>{% endif %}
-        </div>
-      </div>
-      {% endif %}
-
-      {% if result %}
-      <div class="card">
-        <div class="mut tiny">Assistente</div>
-        <div style="font-size:18px;font-weight:700;margin:4px 0 6px">
-          {{ result.product_name or "Produto" }}{% if result.brand %} • {{ result.brand }}{% endif %}{% if result.model %} • {{ result.model }}{% endif %}
-        </div>
-        {% if result.category %}<div class="mut">Categoria: {{ result.category }}</div>{% endif %}
-        {% if result.confidence_pct %}<div style="margin-top:6px"><span class="pill">confiança {{ result.confidence_pct }}%</span></div>{% endif %}
-        {% if result.keywords %}
-          <div style="margin-top:6px">
-            {% for k in result.keywords %}<span class="pill">{{ k }}</span>{% endfor %}
-          </div>
-        {% endif %}
-        {% if result.suggested_query %}<div class="mut" style="margin-top:8px">Consulta sugerida: <code>{{ result.suggested_query }}</code></div>{% endif %}
-        <div class="tiny" style="margin-top:10px">Modelo: <b>{{ model_name }}</b></div>
-      </div>
-      {% endif %}
-
-      {% if policy_msg %}
-      <div class="card" style="border-color:#ffd2d2;background:#fff7f7">
-        <div style="font-weight:700">⚠️ Solicitação não suportada</div>
-        <div class="mut" style="margin-top:6px">{{ policy_msg }}</div>
-      </div>
-      {% endif %}
-
-      {% if shops is not none %}
-      <div class="card">
-        <div style="font-weight:700">🛒 Onde comprar — Lojas do mapa</div>
-        {% if shops and shops|length > 0 %}
-          <div class="shops">
-            {% for s in shops %}
-              <div class="shop">
-                <div style="display:flex;justify-content:space-between;gap:10px;align-items:center">
-                  <div style="min-width:0">
-                    <b><a href="{{ s.url }}" target="_blank" rel="noopener">{{ s.title }}</a></b>
-                    <div class="tiny">{{ s.domain }}</div>
-                  </div>
-                  <div style="white-space:nowrap">{{ s.right or "" }}</div>
-                </div>
-                {% if s.snippet %}<div class="mut" style="margin-top:6px">{{ s.snippet }}</div>{% endif %}
-              </div>
-            {% endfor %}
-          </div>
-        {% else %}
-          <div class="mut">Não encontrei lojas próximas desta categoria.</div>
-        {% endif %}
-      </div>
-      {% endif %}
-
-      {% if extra_shops is not none and extra_shops|length > 0 %}
-      <div class="card">
-        <div style="font-weight:700">🌐 Outras opções online</div>
-        <div class="shops">
-          {% for s in extra_shops %}
-            <div class="shop">
-              <div style="display:flex;justify-content:space-between;gap:10px;align-items:center">
-                <div style="min-width:0">
-                  <b><a href="{{ s.url }}" target="_blank" rel="noopener">{{ s.title }}</a></b>
-                  <div class="tiny">{{ s.domain }}</div>
-                </div>
-                <div style="white-space:nowrap">{{ s.price or "" }}</div>
-              </div>
-              {% if s.snippet %}<div class="mut" style="margin-top:6px">{{ s.snippet }}</div>{% endif %}
-            </div>
-          {% endfor %}
-        </div>
-        <div class="tiny" style="margin-top:10px">Busca: <b>{{ provider }}</b></div>
-      </div>
-      {% endif %}
-    </div>
-
-    {% if routes and routes|length > 0 %}
-    <div class="col-side">
-      <div class="card">
-        <div class="car-head">
-          <div style="font-weight:700">📍 Rotas — {{ routes|length }} lojas próximas</div>
-          <div class="car-ctrl">
-            <button class="car-btn attn" id="prevBtn" title="Mostrar rota da loja anterior" aria-label="Mostrar rota da loja anterior">◀ Loja anterior</button>
-            <div id="dots" class="dots" aria-label="Seleção de loja"></div>
-            <button class="car-btn attn" id="nextBtn" title="Mostrar rota da próxima loja" aria-label="Mostrar rota da próxima loja">Próxima loja ▶</button>
-          </div>
-        </div>
-        <div id="routeInfo" class="mut" style="margin:6px 0 8px"></div>
-        <div id="map" class="mapbox"></div>
-        <div id="openLinks" class="car-hint"></div>
-        <div class="car-hint">Dica: use os botões acima ou as teclas ← → para alternar entre as lojas.</div>
-      </div>
-    </div>
-    {% endif %}
-  </div>
-</div>
-
-<div class="footer">
-  <form id="form" class="ft-wrap" method="post" enctype="multipart/form-data" action="{{ url_for('analyze') }}">
-    <button type="button" class="btn" id="openCam" title="Abrir câmera" aria-label="Abrir câmera">📷</button>
-
-    <div class="box" style="flex:2">
-      <div id="thumbChip" class="thumbchip"><img id="thumbImg" alt="thumb"/></div>
-      <input id="q" name="q" type="text" class="q" placeholder="o que procura? (ex.: arroz, dipirona, alicate)" autocomplete="on"/>
-      <input id="image_base64" name="image_base64" type="hidden"/>
-      <input id="thumb_base64" name="thumb_base64" type="hidden"/>
-      <input id="file" name="image" type="file" accept="image/*" capture="environment" class="hidden"/>
-      <input id="lat" name="lat" type="hidden"/>
-      <input id="lng" name="lng" type="hidden"/>
-    </div>
-
-    <button type="submit" class="btn send" id="sendBtn" aria-label="Enviar">Enviar</button>
-  </form>
-  <div class="ft-wrap" style="margin-top:8px">
-    <div class="tiny">Sua localização é usada apenas para as rotas; nada é armazenado.</div>
-  </div>
-</div>
-
-<!-- Modal da câmera -->
-<div class="modal" id="camModal" aria-hidden="true">
-  <div class="cam">
-    <div class="tiny">Câmera</div>
-    <video id="video" autoplay playsinline></video>
-    <div style="display:flex;gap:8px;margin-top:10px;flex-wrap:wrap">
-      <button type="button" class="btn" id="btnCapture">Capturar</button>
-      <button type="button" class="btn" id="btnClose">Fechar</button>
-    </div>
-  </div>
-</div>
-
-<div id="toast" class="toast">✅ Localização ativada.</div>
-
-<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"
-  integrity="sha256-20nQCchB9co0qIjJZRGuk2/Z9VM+kNiyxNV1lvTlZBo=" crossorigin=""></script>
-<script>
-  const form = document.getElementById('form');
-  const q = document.getElementById('q');
-  const fileInput = document.getElementById('file');
-  const imgB64 = document.getElementById('image_base64');
-  const thumbB64 = document.getElementById('thumb_base64');
-  const latInput = document.getElementById('lat');
-  const lngInput = document.getElementById('lng');
-  const chip = document.getElementById('thumbChip');
-  const chipImg = document.getElementById('thumbImg');
-  const toast = document.getElementById('toast');
-
-  // Geo automática ao carregar
-  document.addEventListener('DOMContentLoaded', () => {
-    if (navigator.geolocation) {
-      navigator.geolocation.getCurrentPosition(
-        (pos) => {
-          latInput.value = String(pos.coords.latitude);
-          lngInput.value = String(pos.coords.longitude);
-          toast.classList.add('show');
-          setTimeout(()=>toast.classList.remove('show'), 3000);
-        },
-        (err) => { console.warn("Geo erro:", err); },
-        { enableHighAccuracy: true, timeout: 12000, maximumAge: 0 }
-      );
-    }
-  });
-
-  // Câmera
-  const camModal = document.getElementById('camModal');
-  const openCam = document.getElementById('openCam');
-  const btnClose = document.getElementById('btnClose');
-  const btnCapture = document.getElementById('btnCapture');
-  const video = document.getElementById('video');
-  let stream = null;
-
-  openCam.addEventListener('click', async () => {
-    camModal.classList.add('show'); camModal.setAttribute('aria-hidden','false');
-    try{
-      stream = await navigator.mediaDevices.getUserMedia({ video: { facingMode: { ideal: 'environment' } }, audio: false });
-      video.srcObject = stream;
-    }catch(e){ camModal.classList.remove('show'); camModal.setAttribute('aria-hidden','true'); fileInput.click(); }
-  });
-  function closeCam(){ camModal.classList.remove('show'); camModal.setAttribute('aria-hidden','true'); if(stream){ stream.getTracks().forEach(t=>t.stop()); stream=null; } }
-  btnClose.addEventListener('click', closeCam);
-
-  btnCapture.addEventListener('click', () => {
-    if(!stream) return;
-    const track = stream.getVideoTracks()[0];
-    const s = track.getSettings ? track.getSettings() : {};
-    const w = s.width || video.videoWidth || 1280;
-    const h = s.height || video.videoHeight || 720;
-    const c = document.createElement('canvas'); c.width = w; c.height = h;
-    const ctx = c.getContext('2d'); ctx.drawImage(video, 0, 0, w, h);
-    const dataUrl = c.toDataURL('image/jpeg', 0.92);
-    imgB64.value = dataUrl; thumbB64.value = dataUrl; chipImg.src = du = dataUrl; chip.style.display = 'block';
-    closeCam();
-  });
-
-  // Upload manual → miniatura também
-  fileInput.addEventListener('change', () => {
-    imgB64.value = ""; thumbB64.value = "";
-    const f = fileInput.files && fileInput.files[0];
-    if(!f) { chip.style.display='none'; return; }
-    const reader = new FileReader();
-    reader.onload = (e)=>{ const du = String(e.target.result); chipImg.src = du; chip.style.display='block'; thumbB64.value = du; imgB64.value = du; };
-    reader.readAsDataURL(f);
-  });
-
-  // Enviar com Enter
-  q.addEventListener('keydown', (e) => { if(e.key === 'Enter'){ e.preventDefault(); form.submit(); } });
-
-  // ===== Carrossel de rotas (um único mapa) =====
-  {% if routes and routes|length > 0 %}
-    const routes = {{ routes|tojson }};
-    const infoEl = document.getElementById('routeInfo');
-    const dotsEl = document.getElementById('dots');
-    const prevBtn = document.getElementById('prevBtn');
-    const nextBtn = document.getElementById('nextBtn');
-    const openLinks = document.getElementById('openLinks');
-
-    const map = L.map('map');
-    L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
-      maxZoom: 19, attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OSM</a>'
-    }).addTo(map);
-
-    let userMarker = null, storeMarker = null, poly = null, current = 0;
-
-    function renderDots(){
-      dotsEl.innerHTML = '';
-      routes.forEach((_, i) => {
-        const d = document.createElement('div');
-        d.className = 'dot' + (i===current?' active':'');
-        d.title = 'Ir para a loja ' + String(i+1);
-        d.style.cursor = 'pointer';
-        d.addEventListener('click', () => { current = i; renderRoute(true); });
-        dotsEl.appendChild(d);
-      });
-    }
+# Fotos: o navegador já reduz ao lado máximo usado no servidor e envia o JPEG binário (multipart)
+UPLOAD_MAX_SIDE = int(os.getenv("UPLOAD_MAX_SIDE", "1280"))
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(4*1024*1024)))   # acima disso o arquivo vai p/ disco
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(25*1024*1024)))
 
-    function renderRoute(userAction=false){
-      const r = routes[current];
-      infoEl.innerHTML = `<b>${current+1}/${routes.length}) ${r.store_name}</b><br/>${r.store_address}<br/>~${r.distance_km} km · ~${r.duration_min} min (estimativa)`;
+class UploadRequest(Request):
+    """Arquivos enviados vão direto p/ um SpooledTemporaryFile (memória até UPLOAD_SPOOL_BYTES),
+    que é entregue ao decodificador sem virar bytes no meio do caminho."""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
 
-      if (poly) { map.removeLayer(poly); poly = null; }
-      if (userMarker) { map.removeLayer(userMarker); userMarker = null; }
-      if (storeMarker) { map.removeLayer(storeMarker); storeMarker = null; }
+app = Flask(__name__, static_folder=None)   # CSS/JS servidos em /assets (ver "Página e arquivos estáticos")
+app.request_class = UploadRequest
+app.config["MAX_CONTENT_LENGTH"] = UPLOAD_MAX_BYTES
+app.config["MAX_FORM_MEMORY_SIZE"] = UPLOAD_MAX_BYTES   # clientes antigos ainda mandam a foto em base64 num campo
+app.jinja_env.globals["upload_max_side"] = UPLOAD_MAX_SIDE
 
-      const user = [r.user_lat, r.user_lng];
-      const store = [r.store_lat, r.store_lng];
 
-      poly = L.polyline(r.geometry.map(p => [p[1], p[0]]), { weight: 5, color:'#2F6BFF' }).addTo(map);
-      userMarker = L.marker(user).addTo(map).bindPopup("Você");
-      storeMarker = L.marker(store).addTo(map).bindPopup(r.store_name);
+# ================== Estatísticas ==================
 
-      const bounds = L.latLngBounds([user, store, ...poly.getLatLngs()]);
-      map.fitBounds(bounds, { padding: [40,40] });
+# nome → função que devolve um dict serializável (exposto em /stats)
+STATS_PROVIDERS: Dict[str, Any] = {}
 
-      prevBtn.disabled = (current === 0);
-      nextBtn.disabled = (current === routes.length - 1);
+def register_stats(name: str, fn) -> None:
+    STATS_PROVIDERS[name] = fn
 
-      // Links rápidos
-      const site = r.website ? `<a href="${r.website}" target="_blank" rel="noopener">Abrir site da loja</a>` : '';
-      const maps = r.maps_url ? `<a href="${r.maps_url}" target="_blank" rel="noopener">Abrir no Google Maps</a>` : '';
-      openLinks.innerHTML = [site, maps].filter(Boolean).join(" · ");
+def collect_stats() -> Dict[str, Any]:
+    out = {}
+    for name, fn in STATS_PROVIDERS.items():
+        try: out[name] = fn()
+        except Exception as e: out[name] = {"error": str(e)}
+    return out
 
-      if (userAction){
-        prevBtn.classList.remove('attn');
-        nextBtn.classList.remove('attn');
-      }
+# ================== Métricas (formato Prometheus, em /metrics) ==================
+
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS: List[Any] = []
+METRICS_DB = os.getenv("METRICS_DB", "").strip()            # SQLite p/ somar contadores de todos os workers; vazio = por processo
+METRICS_FLUSH_S = float(os.getenv("METRICS_FLUSH_S", "5"))   # a cada quanto cada worker grava os seus no METRICS_DB
+
+def _label_str(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    parts = [f'{n}="{esc(v)}"' for n, v in zip(names, values)]
+    if extra: parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+        METRICS.append(self)
+
+    def inc(self, *labelvalues: str, n: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + n
+
+    def snapshot(self) -> Dict[str, float]:
+        """Valores por rótulos (chave = lista JSON), p/ somar com os de outros workers."""
+        with self._lock: return {json.dumps(k): v for k, v in self._values.items()}
+
+    def reset(self) -> None:
+        with self._lock: self._values.clear()
+
+    def render(self, snap: Dict[str, float]) -> List[str]:
+        items = sorted((tuple(json.loads(k)), v) for k, v in snap.items())
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        out += [f"{self.name}{_label_str(self.labels, k)} {v:g}" for k, v in items]
+        return out
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = METRICS_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], List[float]] = {}   # contagens por bucket (+Inf no fim), soma no último
+
+    def observe(self, seconds: float, *labelvalues: str) -> None:
+        i = 0
+        while i < len(self.buckets) and seconds > self.buckets[i]: i += 1
+        with self._lock:
+            v = self._values.get(labelvalues)
+            if v is None: v = self._values[labelvalues] = [0] * (len(self.buckets) + 2)
+            v[i] += 1; v[-1] += seconds
+
+    @contextmanager
+    def time(self, *labelvalues: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *labelvalues)
+
+    def snapshot(self) -> Dict[str, List[float]]:
+        with self._lock: return {json.dumps(k): list(v) for k, v in self._values.items()}
+
+    def reset(self) -> None:
+        with self._lock: self._values.clear()
+
+    def render(self, snap: Dict[str, List[float]]) -> List[str]:
+        items = sorted((tuple(json.loads(k)), v) for k, v in snap.items())
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for k, v in items:
+            acc = 0
+            for le, n in zip(list(self.buckets) + ["+Inf"], v[:-1]):
+                acc += n
+                lbl = _label_str(self.labels, k, 'le="%s"' % le)
+                out.append(f"{self.name}_bucket{lbl} {acc}")
+            out.append(f"{self.name}_sum{_label_str(self.labels, k)} {v[-1]:.6f}")
+            out.append(f"{self.name}_count{_label_str(self.labels, k)} {acc}")
+        return out
+
+def _histogram(*a, **kw) -> Histogram:
+    h = Histogram(*a, **kw); METRICS.append(h); return h
+
+STAGE_SECONDS = _histogram("compras_stage_seconds",
+    "Duração de cada etapa (image, vision, query, shops, maps, routes, osrm_route, osrm_table, nominatim, render)", ("stage",))
+REQUEST_SECONDS = _histogram("compras_request_seconds", "Duração das requisições HTTP (no NDJSON, até o início do streaming)", ("endpoint",))
+REQUESTS_TOTAL = Counter("compras_requests_total", "Requisições HTTP atendidas", ("endpoint", "status"))
+ERRORS_TOTAL = Counter("compras_errors_total", "Falhas por origem", ("source",))
+TIMEOUTS_TOTAL = Counter("compras_timeouts_total", "Falhas por timeout, por origem", ("source",))
+FALLBACKS_TOTAL = Counter("compras_fallbacks_total", "Degradações: store_links (sem resultado das lojas online), "
+                          "nominatim (completa lojas do mapa), haversine (sem /table), routes_skipped (prazo esgotado)", ("kind",))
+CIRCUIT_REJECTED_TOTAL = Counter("compras_circuit_rejected_total", "Chamadas recusadas com o circuito do host aberto", ("host",))
+RATE_WAIT_SECONDS = _histogram("compras_ratelimit_wait_seconds", "Espera na fila do limitador de taxa", ("host", "priority"))
+RATE_SHED_TOTAL = Counter("compras_ratelimit_shed_total", "Chamadas descartadas pelo limitador de taxa", ("host", "priority"))
+HEDGES_TOTAL = Counter("compras_hedged_requests_total", "GETs duplicados por lentidão (won = a cópia respondeu antes)", ("host", "won"))
+UPLOADS_TOTAL = Counter("compras_uploads_total", "Fotos recebidas por codificação (binary = multipart, base64 = data URL)", ("encoding",))
+UPLOAD_BYTES_TOTAL = Counter("compras_upload_bytes_total", "Bytes de foto recebidos (base64 conta o texto)", ("encoding",))
+RESPONSE_BYTES_TOTAL = Counter("compras_response_bytes_total", "Bytes enviados de páginas HTML, assets e rotas, por tipo e codificação", ("kind", "encoding"))
+VISION_CALL_SECONDS = _histogram("compras_vision_call_seconds", "Duração de cada chamada de visão, por resolução (low, full)", ("detail",))
+VISION_BYTES_TOTAL = Counter("compras_vision_bytes_total", "Bytes de JPEG enviados à visão, por resolução (low, full)", ("detail",))
+VISION_ESCALATIONS_TOTAL = Counter("compras_vision_escalations_total",
+    "Identificações refeitas em resolução cheia após a imagem pequena (low_confidence, missing_fields)", ("reason",))
+NOMINATIM_TOTAL = Counter("compras_nominatim_requests_total", "Consultas ao Nominatim admitidas pelo limitador de taxa (cada tentativa)")
+NOMINATIM_SHED_TOTAL = Counter("compras_nominatim_shed_total", "Consultas ao Nominatim descartadas pelo limitador, por prioridade", ("priority",))
+NOMINATIM_SPECULATIVE_TOTAL = Counter("compras_nominatim_speculative_total",
+    "Nominatim disparado junto com a busca no mapa, por desfecho (used, ignored, cancelled, shed, failed)", ("outcome",))
+RANK_CANDIDATES_TOTAL = Counter("compras_rank_candidates_total", "Lojas candidatas recebidas pelo ranqueamento (todas as fontes)")
+RANK_DUPLICATES_TOTAL = Counter("compras_rank_duplicates_total", "Candidatas fundidas por serem a mesma loja (place_id ou proximidade + nome)")
+
+def log_error(source: str, e: BaseException) -> None:
+    """Registra a falha no log (SOURCE_ERROR: ...) e nos contadores de erro/timeout."""
+    print(f"{source}_ERROR:", e)
+    ERRORS_TOTAL.inc(source.lower())
+    if isinstance(e, (requests.Timeout, FutureTimeout)): TIMEOUTS_TOTAL.inc(source.lower())
+
+def _stats_gauges() -> List[str]:
+    """Valores numéricos do /stats do worker que respondeu como gauges (compras_stats{section, key, pid})."""
+    out = ["# HELP compras_stats Valores numéricos de /stats (do worker que respondeu)", "# TYPE compras_stats gauge"]
+    pid = str(os.getpid())
+    def walk(section: str, prefix: str, v: Any):
+        if isinstance(v, bool) or v is None: return
+        if isinstance(v, (int, float)):
+            out.append(f"compras_stats{_label_str(('section', 'key', 'pid'), (section, prefix, pid))} {v:g}")
+        elif isinstance(v, dict):
+            for k, x in v.items(): walk(section, f"{prefix}.{k}" if prefix else str(k), x)
+    for section, data in collect_stats().items(): walk(section, "", data)
+    return out
 
-      renderDots();
-      setTimeout(()=>map.invalidateSize(), 50);
-    }
+def _merge_snapshot(dst: Dict[str, Any], src: Dict[str, Any]) -> None:
+    for k, v in src.items():
+        cur = dst.get(k)
+        if cur is None: dst[k] = v
+        elif isinstance(v, list): dst[k] = [a + b for a, b in zip(cur, v)]
+        else: dst[k] = cur + v
+
+def render_metrics() -> str:
+    """Contadores e histogramas deste processo somados aos dos outros workers (METRICS_DB), + gauges do /stats."""
+    METRICS_STORE.flush()
+    others = METRICS_STORE.others()
+    lines: List[str] = []
+    for m in METRICS:
+        snap = m.snapshot()
+        for o in others: _merge_snapshot(snap, o.get(m.name) or {})
+        lines += m.render(snap)
+    lines += _stats_gauges()
+    return "\n".join(lines) + "\n"
+
+def server_timing(timings: Optional[Dict[str, Any]], **extra_ms: float) -> str:
+    """Header Server-Timing a partir de StageTimings.as_dict() (+ etapas extras em ms, ex.: render)."""
+    parts = []
+    for name, s in ((timings or {}).get("stages") or {}).items():
+        parts.append(f"{name};dur={s['dur_ms']}")
+    parts += [f"{k};dur={v:.1f}" for k, v in extra_ms.items()]
+    return ", ".join(parts)
+
+# ================== Prazo por requisição ==================
+
+# Orçamento total do /analyze: cada chamada externa usa no máximo o que resta (além do próprio timeout)
+ANALYZE_BUDGET_S = float(os.getenv("ANALYZE_BUDGET_S", "15"))
+_DEADLINE: "contextvars.ContextVar[Optional[float]]" = contextvars.ContextVar("deadline", default=None)
+
+class DeadlineExceeded(requests.Timeout):
+    """O orçamento da requisição acabou antes da chamada."""
+
+@contextmanager
+def request_deadline(budget_s: float):
+    """Define o prazo (time.monotonic) da requisição atual; prazos aninhados só encurtam."""
+    cur = _DEADLINE.get()
+    dl = time.monotonic() + budget_s
+    token = _DEADLINE.set(dl if cur is None else min(cur, dl))
+    try:
+        yield
+    finally:
+        _DEADLINE.reset(token)
+
+def deadline_remaining() -> Optional[float]:
+    """Segundos até o prazo (pode ser negativo); None sem prazo."""
+    dl = _DEADLINE.get()
+    return None if dl is None else dl - time.monotonic()
+
+def clamp_timeout(timeout: Optional[float]) -> Optional[float]:
+    """Timeout da chamada limitado ao que resta do prazo; DeadlineExceeded se não resta nada."""
+    left = deadline_remaining()
+    if left is None: return timeout
+    if left <= 0: raise DeadlineExceeded("prazo da requisição esgotado")
+    return left if timeout is None else min(timeout, left)
+
+def bind_context(fn):
+    """fn rodando com uma cópia do contexto atual (prazo) — p/ enviar a outras threads/pools."""
+    ctx = contextvars.copy_context()
+    return lambda *a, **kw: ctx.run(fn, *a, **kw)
+
+# ================== Limite de taxa por upstream ==================
+
+class SqliteDB:
+    """Conexão SQLite por thread (WAL), p/ caches em disco compartilháveis entre processos."""
+    def __init__(self, path: str, schema: str):
+        self.path, self.schema = path, schema
+        self._local = threading.local()
+
+    def conn(self) -> sqlite3.Connection:
+        c = getattr(self._local, "conn", None)
+        if c is None:
+            d = os.path.dirname(os.path.abspath(self.path))
+            if d: os.makedirs(d, exist_ok=True)
+            c = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            c.execute("PRAGMA journal_mode=WAL"); c.execute("PRAGMA synchronous=NORMAL")
+            c.executescript(self.schema)
+            self._local.conn = c
+        return c
+
+class MetricsStore:
+    """
+    Contadores e histogramas de todos os workers num SQLite (METRICS_DB): cada worker grava o próprio
+    retrato a cada METRICS_FLUSH_S (e a cada /metrics), e o /metrics soma o seu aos dos outros.
+    Worker que sai soma o seu numa linha "exited", p/ os contadores não voltarem nem a tabela crescer.
+    """
+    EXITED = "exited"
+
+    def __init__(self, path: str, flush_s: float):
+        self.path, self.flush_s = path, flush_s
+        self.db: Optional[SqliteDB] = None
+        self.worker = ""
+        self._lock = threading.Lock()   # flush periódico × retire: o worker que saiu não volta a gravar a própria linha
+
+    def _open(self) -> SqliteDB:
+        return SqliteDB(self.path, "CREATE TABLE IF NOT EXISTS metrics(worker TEXT PRIMARY KEY, ts REAL, data TEXT);")
+
+    def clear(self) -> None:
+        """No mestre, antes dos workers: descarta os contadores de uma execução anterior."""
+        if not self.path: return
+        try: self._open().conn().execute("DELETE FROM metrics")
+        except Exception as e: log_error("METRICS_DB", e)
+
+    def start(self) -> None:
+        """No worker recém-criado (post_fork): zera o que herdou do mestre e passa a gravar periodicamente."""
+        if not self.path: return
+        for m in METRICS: m.reset()
+        self.db, self.worker = self._open(), f"{os.getpid()}-{secrets.token_hex(4)}"
+        def loop():
+            while True:
+                time.sleep(self.flush_s); self.flush()
+        threading.Thread(target=loop, name="metrics-flush", daemon=True).start()
+
+    def _snapshot(self) -> str:
+        return json.dumps({m.name: m.snapshot() for m in METRICS})
+
+    def flush(self) -> None:
+        with self._lock:
+            if self.db is None: return
+            try:
+                self.db.conn().execute("INSERT OR REPLACE INTO metrics VALUES(?,?,?)", (self.worker, time.time(), self._snapshot()))
+            except Exception as e:
+                log_error("METRICS_DB", e)
+
+    def others(self) -> List[Dict[str, Dict[str, Any]]]:
+        if self.db is None: return []
+        try:
+            rows = self.db.conn().execute("SELECT data FROM metrics WHERE worker != ?", (self.worker,)).fetchall()
+        except Exception as e:
+            log_error("METRICS_DB", e); return []
+        return [json.loads(r[0]) for r in rows]
 
-    prevBtn.addEventListener('click', () => { if (current > 0) { current--; renderRoute(true); } });
-    nextBtn.addEventListener('click', () => { if (current < routes.length-1) { current++; renderRoute(true); } });
-
-    // Atalhos de teclado ← →
-    window.addEventListener('keydown', (e) => {
-      if (e.key === 'ArrowLeft' && current > 0){ current--; renderRoute(true); }
-      if (e.key === 'ArrowRight' && current < routes.length-1){ current++; renderRoute(true); }
-    });
-
-    renderRoute();
-    setTimeout(()=>{ prevBtn.classList.remove('attn'); nextBtn.classList.remove('attn'); }, 6000);
-  {% endif %}
-</script>
-</body>
-</html>
-"""
+    def retire(self) -> None:
+        """Encerramento do worker: soma os seus valores na linha "exited" e apaga a própria."""
+        with self._lock:
+            if self.db is None: return
+            self._retire(self.db); self.db = None
+
+    def _retire(self, db: SqliteDB) -> None:
+        try:
+            c = db.conn()
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                row = c.execute("SELECT data FROM metrics WHERE worker=?", (self.EXITED,)).fetchone()
+                total = json.loads(row[0]) if row else {}
+                for name, snap in json.loads(self._snapshot()).items():
+                    _merge_snapshot(total.setdefault(name, {}), snap)
+                c.execute("INSERT OR REPLACE INTO metrics VALUES(?,?,?)", (self.EXITED, time.time(), json.dumps(total)))
+                c.execute("DELETE FROM metrics WHERE worker=?", (self.worker,))
+                c.execute("COMMIT")
+            except Exception:
+                c.execute("ROLLBACK"); raise
+        except Exception as e:
+            log_error("METRICS_DB", e)
+
+METRICS_STORE = MetricsStore(METRICS_DB, METRICS_FLUSH_S)
+
+# host=req/s:rajada — Nominatim pede no máximo 1 req/s; SerpApi conforme o plano;
+# osrm-route: balde só das geometrias pedidas pelo navegador em /api/route (o /table do /analyze fica de fora)
+RATE_LIMITS = os.getenv("RATE_LIMITS", "nominatim.openstreetmap.org=1:1,serpapi.com=5:10,osrm-route=5:10").strip()
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", "data/ratelimit.sqlite").strip()     # baldes compartilhados entre processos; vazio = por processo
+RATE_LIMIT_MAX_QUEUE = int(os.getenv("RATE_LIMIT_MAX_QUEUE", "32"))             # chamadas esperando por host (por processo)
+RATE_LIMIT_MAX_WAIT_S = float(os.getenv("RATE_LIMIT_MAX_WAIT_S", "10"))
+RATE_LIMIT_BACKGROUND_RESERVE = float(os.getenv("RATE_LIMIT_BACKGROUND_RESERVE", "0.5"))  # fração da rajada só p/ interativas
+
+_PRIORITY: "contextvars.ContextVar[str]" = contextvars.ContextVar("priority", default="interactive")
+
+@contextmanager
+def request_priority(priority: str):
+    """Chamadas externas feitas dentro do bloco usam esta prioridade: "interactive", "background" ou
+    "speculative" (só usa folga que já existe: sem ficha na hora, é descartada em vez de esperar)."""
+    token = _PRIORITY.set(priority)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+class RateLimited(requests.RequestException):
+    """Chamada descartada pelo limitador: fila cheia ou espera maior que o prazo."""
+
+def _parse_rate_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    out = {}
+    for part in spec.split(","):
+        host, _, v = part.strip().partition("=")
+        rate, _, burst = v.partition(":")
+        try:
+            if host and float(rate) > 0: out[host.strip().lower()] = (float(rate), max(1.0, float(burst or 1)))
+        except ValueError:
+            pass
+    return out
+
+class LocalBuckets:
+    """Token buckets deste processo."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: Dict[str, Tuple[float, float]] = {}
+
+    def take(self, key: str, rate: float, burst: float, floor: float) -> float:
+        """Tira uma ficha se sobrar ≥ floor depois; senão devolve quantos segundos esperar."""
+        now = time.time()
+        with self._lock:
+            tokens, ts = self._state.get(key, (burst, now))
+            tokens = min(burst, tokens + max(0.0, now - ts) * rate)
+            wait = 0.0
+            if tokens >= 1 + floor: tokens -= 1
+            else: wait = (1 + floor - tokens) / rate
+            self._state[key] = (tokens, now)
+            return wait
+
+class SqliteBuckets:
+    """Token buckets num SQLite compartilhado: todos os workers dividem a mesma cota."""
+    def __init__(self, path: str):
+        self.db = SqliteDB(path, "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, ts REAL NOT NULL);")
+        self.local = LocalBuckets()
+
+    def take(self, key: str, rate: float, burst: float, floor: float) -> float:
+        try:
+            c = self.db.conn()
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                row = c.execute("SELECT tokens, ts FROM buckets WHERE key=?", (key,)).fetchone()
+                now = time.time()
+                tokens = burst if row is None else min(burst, row[0] + max(0.0, now - row[1]) * rate)
+                wait = 0.0
+                if tokens >= 1 + floor: tokens -= 1
+                else: wait = (1 + floor - tokens) / rate
+                c.execute("INSERT OR REPLACE INTO buckets(key, tokens, ts) VALUES(?,?,?)", (key, tokens, now))
+                c.execute("COMMIT")
+                return wait
+            except Exception:
+                c.execute("ROLLBACK"); raise
+        except Exception as e:
+            log_error("RATE_LIMIT_DB", e)
+            return self.local.take(key, rate, burst, floor)
+
+class _HostQueue:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.waiting: List[List[Any]] = []   # heap de [prioridade, ordem de chegada]
+        self.acquired = self.shed = 0
+        self.wait_s_sum = 0.0; self.wait_s_max = 0.0
+
+class RateLimiter:
+    """
+    Agendador por upstream: token bucket (rate/s, rajada) + fila por prioridade.
+    Interativas passam à frente das de fundo (e estas não gastam a reserva da rajada);
+    com a fila cheia ou espera maior que o prazo/limite, a chamada é descartada (RateLimited).
+    Especulativas nunca esperam: sem ficha disponível na hora, são descartadas.
+    """
+    def __init__(self, limits: Dict[str, Tuple[float, float]], store, max_queue: int = RATE_LIMIT_MAX_QUEUE,
+                 max_wait_s: float = RATE_LIMIT_MAX_WAIT_S, background_reserve: float = RATE_LIMIT_BACKGROUND_RESERVE):
+        self.limits, self.store = limits, store
+        self.max_queue, self.max_wait_s, self.background_reserve = max_queue, max_wait_s, background_reserve
+        self._queues = {host: _HostQueue() for host in limits}
+        self._seq = 0
+
+    def acquire(self, host: str) -> None:
+        lim = self.limits.get(host)
+        if lim is None: return
+        rate, burst = lim
+        priority = _PRIORITY.get()
+        rank = {"interactive": 0, "background": 1}.get(priority, 2)
+        floor = 0.0 if rank == 0 else max(0.0, min(burst * self.background_reserve, burst - 1))
+        q = self._queues[host]
+        with q.cond:
+            if len(q.waiting) >= self.max_queue:
+                self._shed(q, host, priority, "fila cheia")
+            self._seq += 1
+            entry = [rank, self._seq]
+            heapq.heappush(q.waiting, entry)
+        t0 = time.monotonic()
+        try:
+            while True:
+                with q.cond: head = q.waiting[0] is entry
+                # a ficha sai fora da trava da fila: com SqliteBuckets é um BEGIN IMMEDIATE entre processos
+                wait = self.store.take(host, rate, burst, floor) if head else 1.0 / rate
+                if wait <= 0: break
+                with q.cond:
+                    if rank == 2: self._shed(q, host, priority, "sem folga p/ chamada especulativa")
+                    left = deadline_remaining()
+                    budget = self.max_wait_s if left is None else min(self.max_wait_s, left)
+                    if time.monotonic() - t0 + wait > budget:
+                        self._shed(q, host, priority, "espera maior que o prazo")
+                    if (q.waiting[0] is entry) == head: q.cond.wait(wait)   # virou a primeira: tenta já
+        finally:
+            with q.cond:
+                q.waiting.remove(entry); heapq.heapify(q.waiting)
+                q.cond.notify_all()
+        with q.cond:
+            dt = time.monotonic() - t0
+            q.acquired += 1; q.wait_s_sum += dt; q.wait_s_max = max(q.wait_s_max, dt)
+        RATE_WAIT_SECONDS.observe(dt, host, priority)
+
+    def _shed(self, q: _HostQueue, host: str, priority: str, why: str):
+        q.shed += 1
+        RATE_SHED_TOTAL.inc(host, priority)
+        raise RateLimited(f"{host}: {why}")
+
+    def stats(self) -> Dict[str, Any]:
+        out = {}
+        for host, q in self._queues.items():
+            with q.cond:
+                out[host] = {"rate_per_s": self.limits[host][0], "burst": self.limits[host][1],
+                             "queue_depth": len(q.waiting), "acquired": q.acquired, "shed": q.shed,
+                             "wait_ms_avg": round(q.wait_s_sum*1000/q.acquired, 1) if q.acquired else None,
+                             "wait_ms_max": round(q.wait_s_max*1000, 1)}
+        return out
+
+RATE_LIMITER = RateLimiter(_parse_rate_limits(RATE_LIMITS), SqliteBuckets(RATE_LIMIT_DB) if RATE_LIMIT_DB else LocalBuckets())
+register_stats("rate_limit", RATE_LIMITER.stats)
+
+# ================== HTTP (cliente compartilhado) ==================
+
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "32"))      # conexões keep-alive por host
+HTTP_MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", "16"))      # chamadas simultâneas por host
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))                 # só GET (idempotente)
+HTTP_BACKOFF_S = float(os.getenv("HTTP_BACKOFF_S", "0.25"))
+# limites por host (host[:porta]), ex.: "nominatim.openstreetmap.org=1,router.project-osrm.org=8"
+HTTP_HOST_LIMITS = os.getenv("HTTP_HOST_LIMITS", "nominatim.openstreetmap.org=1").strip()
+# circuito por host: abre após N falhas seguidas (erro de rede/timeout/5xx) e testa de novo após o cooldown
+HTTP_BREAKER_FAILURES = int(os.getenv("HTTP_BREAKER_FAILURES", "5"))
+HTTP_BREAKER_COOLDOWN_S = float(os.getenv("HTTP_BREAKER_COOLDOWN_S", "30"))
+# GETs "hedged": se o host não responde em X s, dispara uma cópia e fica com a primeira resposta.
+# Desligado por padrão; ex.: "router.project-osrm.org=0.8,serpapi.com=3"
+HTTP_HEDGE = os.getenv("HTTP_HEDGE", "").strip()
+
+def _parse_host_limits(spec: str) -> Dict[str, int]:
+    out = {}
+    for part in spec.split(","):
+        host, _, n = part.strip().partition("=")
+        if host and n.strip().isdigit(): out[host.strip().lower()] = int(n)
+    return out
+
+def _parse_float_map(spec: str) -> Dict[str, float]:
+    out = {}
+    for part in spec.split(","):
+        host, _, v = part.strip().partition("=")
+        try:
+            if host: out[host.strip().lower()] = float(v)
+        except ValueError:
+            pass
+    return out
+
+class CircuitOpen(requests.ConnectionError):
+    """Host com o circuito aberto: a chamada nem é feita."""
+
+class CircuitBreaker:
+    """closed → open após `failures` falhas seguidas → half_open após `cooldown_s` (uma chamada de teste)."""
+    def __init__(self, failures: int, cooldown_s: float):
+        self.failures, self.cooldown_s = max(1, failures), cooldown_s
+        self.lock = threading.Lock()
+        self.state = "closed"; self.fails = 0; self.opened_at = 0.0; self.probing = False
+        self.opens = self.rejected = 0
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == "closed": return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown_s:
+                self.state = "half_open"; self.probing = False
+            if self.state == "half_open" and not self.probing:
+                self.probing = True; return True
+            self.rejected += 1
+            return False
+
+    def release(self):
+        """A chamada liberada por allow() não saiu (limitador/prazo): devolve a vaga de teste do half_open."""
+        with self.lock:
+            if self.state == "half_open": self.probing = False
+
+    def record(self, ok: bool):
+        with self.lock:
+            if ok:
+                self.state = "closed"; self.fails = 0; self.probing = False
+                return
+            self.fails += 1
+            if self.state == "half_open" or self.fails >= self.failures:
+                if self.state != "open": self.opens += 1
+                self.state = "open"; self.opened_at = time.monotonic(); self.probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"state": self.state, "consecutive_failures": self.fails, "opens": self.opens, "rejected": self.rejected}
+
+class _Host:
+    def __init__(self, name: str, pool_maxsize: int, limit: int, breaker: CircuitBreaker, hedge_after_s: Optional[float]):
+        self.name = name
+        self.breaker, self.hedge_after_s = breaker, hedge_after_s
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", self.adapter); self.session.mount("http://", self.adapter)
+        self.sem = threading.BoundedSemaphore(max(1, limit))
+        self.limit = max(1, limit)
+        self.lock = threading.Lock()
+        self.requests = self.errors = self.retries = self.in_flight = 0
+        self.hedges = self.hedge_wins = 0
+        self.latency_s_sum = 0.0; self.latency_s_max = 0.0
+        self.admitted: Optional[Counter] = None   # contador das tentativas admitidas pelo limitador de taxa
+
+    def record(self, dt: float, ok: bool):
+        with self.lock:
+            self.requests += 1
+            if not ok: self.errors += 1
+            self.latency_s_sum += dt; self.latency_s_max = max(self.latency_s_max, dt)
+
+    def stats(self) -> Dict[str, Any]:
+        conns = reqs = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            p = pools.get(key)
+            if p is None: continue
+            conns += getattr(p, "num_connections", 0); reqs += getattr(p, "num_requests", 0)
+        with self.lock:
+            return {"requests": self.requests, "errors": self.errors, "retries": self.retries,
+                    "in_flight": self.in_flight, "limit": self.limit,
+                    "hedges": self.hedges, "hedge_wins": self.hedge_wins, "breaker": self.breaker.stats(),
+                    "connections_opened": conns, "connections_reused": max(0, reqs - conns),
+                    "latency_ms_avg": round(self.latency_s_sum*1000/self.requests, 1) if self.requests else None,
+                    "latency_ms_max": round(self.latency_s_max*1000, 1)}
+
+class HttpClient:
+    """
+    Cliente HTTP único p/ todas as chamadas externas: pool keep-alive por host,
+    limite de concorrência por host, retries com backoff (jitter) só p/ GET, circuito por host,
+    GETs "hedged" opcionais e contadores. O timeout de cada tentativa respeita o prazo da requisição.
+    """
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, pool_maxsize: int = HTTP_POOL_MAXSIZE, max_per_host: int = HTTP_MAX_PER_HOST,
+                 retries: int = HTTP_RETRIES, backoff_s: float = HTTP_BACKOFF_S, host_limits: Optional[Dict[str, int]] = None,
+                 breaker_failures: int = HTTP_BREAKER_FAILURES, breaker_cooldown_s: float = HTTP_BREAKER_COOLDOWN_S,
+                 hedge: Optional[Dict[str, float]] = None, limiter: Optional[RateLimiter] = None):
+        self.pool_maxsize, self.max_per_host = pool_maxsize, max_per_host
+        self.retries, self.backoff_s = retries, backoff_s
+        self.host_limits = host_limits or {}
+        self.breaker_failures, self.breaker_cooldown_s = breaker_failures, breaker_cooldown_s
+        self.hedge = hedge or {}
+        self.limiter = limiter
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, _Host] = {}
+        # só p/ as tentativas hedged (a chamada original e a cópia); nunca espera outras tarefas
+        self._hedge_pool = ThreadPoolExecutor(max_workers=4*max_per_host, thread_name_prefix="hedge") if self.hedge else None
+
+    def host(self, url: str) -> _Host:
+        name = urlsplit(url).netloc.lower()   # host[:porta]
+        h = self._hosts.get(name)
+        if h is None:
+            with self._lock:
+                h = self._hosts.get(name)
+                if h is None:
+                    h = self._hosts[name] = _Host(name, self.pool_maxsize, self.host_limits.get(name, self.max_per_host),
+                                                  CircuitBreaker(self.breaker_failures, self.breaker_cooldown_s),
+                                                  self.hedge.get(name))
+        return h
+
+    def request(self, method: str, url: str, retry: Optional[bool] = None, **kw) -> requests.Response:
+        h = self.host(url)
+        if method.upper() == "GET" and h.hedge_after_s is not None and self._hedge_pool is not None:
+            return self._hedged(h, method, url, retry, **kw)
+        return self._send(h, method, url, retry, **kw)
+
+    def _send(self, h: _Host, method: str, url: str, retry: Optional[bool], **kw) -> requests.Response:
+        attempts = 1 + (self.retries if (method.upper() == "GET" if retry is None else retry) else 0)
+        base_timeout = kw.pop("timeout", None)
+        for attempt in range(attempts):
+            last = attempt + 1 >= attempts
+            clamp_timeout(base_timeout)   # prazo já esgotado: nem entra na fila
+            # circuito antes do limitador: chamada rejeitada não gasta ficha nem conta como admitida
+            if not h.breaker.allow():
+                CIRCUIT_REJECTED_TOTAL.inc(h.name)
+                raise CircuitOpen(f"circuito aberto para {h.name}")
+            try:
+                if self.limiter: self.limiter.acquire(h.name)
+                timeout = clamp_timeout(base_timeout)
+            except Exception:
+                h.breaker.release(); raise
+            if h.admitted is not None: h.admitted.inc()
+            with h.sem:
+                with h.lock: h.in_flight += 1
+                t0 = time.perf_counter()
+                try:
+                    r = h.session.request(method, url, timeout=timeout, **kw)
+                except requests.ConnectionError:   # inclui ConnectTimeout; ReadTimeout não é repetido
+                    h.record(time.perf_counter()-t0, False); h.breaker.record(False)
+                    if last: raise
+                    r = None
+                except Exception:
+                    h.record(time.perf_counter()-t0, False); h.breaker.record(False)
+                    raise
+                else:
+                    h.record(time.perf_counter()-t0, r.status_code < 400); h.breaker.record(r.status_code < 500)
+                finally:
+                    with h.lock: h.in_flight -= 1
+            if r is not None and (last or r.status_code not in self.RETRY_STATUS):
+                return r
+            pause = random.uniform(0, self.backoff_s * (2 ** attempt))
+            left = deadline_remaining()
+            if left is not None and left <= pause:   # sem tempo p/ outra tentativa
+                if r is not None: return r
+                raise DeadlineExceeded("prazo da requisição esgotado")
+            with h.lock: h.retries += 1
+            time.sleep(pause)
+        raise RuntimeError("unreachable")
+
+    def _hedged(self, h: _Host, method: str, url: str, retry: Optional[bool], **kw) -> requests.Response:
+        """Dispara a cópia se a primeira tentativa passar de hedge_after_s; fica com a primeira resposta boa."""
+        first = self._hedge_pool.submit(bind_context(self._send), h, method, url, retry, **kw)
+        try:
+            return first.result(timeout=h.hedge_after_s)
+        except FutureTimeout:
+            pass
+        left = deadline_remaining()
+        if left is not None and left <= 0: return first.result()
+        with h.lock: h.hedges += 1
+        second = self._hedge_pool.submit(bind_context(self._send), h, method, url, retry, **kw)
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None and (not pending or f.result().status_code < 500):
+                    won = f is second
+                    if won:
+                        with h.lock: h.hedge_wins += 1
+                    HEDGES_TOTAL.inc(h.name, "1" if won else "0")
+                    return f.result()
+        HEDGES_TOTAL.inc(h.name, "0")
+        return first.result()   # as duas falharam: propaga o erro da original
+
+    def get(self, url: str, **kw) -> requests.Response:
+        return self.request("GET", url, **kw)
+
+    def post(self, url: str, **kw) -> requests.Response:
+        return self.request("POST", url, **kw)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock: hosts = list(self._hosts.values())
+        return {h.name: h.stats() for h in hosts}
+
+HTTP = HttpClient(host_limits=_parse_host_limits(HTTP_HOST_LIMITS), hedge=_parse_float_map(HTTP_HEDGE), limiter=RATE_LIMITER)
+register_stats("http", HTTP.stats)
 
 # ================== Utils ==================
 
@@ -449,11 +776,79 @@ def pil_compress_to_jpeg(fp, max_side=1280, quality=82) -> bytes:
     im.save(out, format="JPEG", quality=quality, optimize=True)
     return out.getvalue()
 
+# Orçamento de pixels da imagem enviada (antes de decodificar; evita "bombas" de descompressão)
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(50_000_000)))
+
+def _jpeg_bytes(im: Image.Image, quality: int) -> bytes:
+    out = io.BytesIO()
+    im.save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue()
+
+def prepare_upload(fp, max_side=1280, quality=82, thumb_side=360, thumb_quality=70,
+                   low_side: Optional[int] = None, low_quality: int = 70) -> Dict[str, Any]:
+    """
+    Decodifica a foto UMA vez e gera: JPEG p/ o modelo (max_side), miniatura (thumb_side) e dHash;
+    com low_side, também o JPEG pequeno da 1ª tentativa da visão ("low", senão None).
+    JPEG usa draft (DCT scaling 1/2, 1/4, 1/8): a decodificação já sai perto do tamanho final.
+    A miniatura e o JPEG pequeno são reduzidos da imagem intermediária, não do original.
+    """
+    im = Image.open(fp)
+    w, h = im.size
+    if w * h > IMAGE_MAX_PIXELS:
+        raise ValueError(f"imagem acima do limite de pixels ({w}x{h})")
+    scale = min(1.0, float(max_side)/float(max(w,h)))
+    size = (max(1, int(w*scale)), max(1, int(h*scale)))
+    if scale < 1.0 and im.format == "JPEG":
+        im.draft("RGB", (math.ceil(w*scale), math.ceil(h*scale)))
+    im = im.convert("RGB")
+    if im.size != size:
+        im = im.resize(size, Image.LANCZOS, reducing_gap=3.0)
+    th = im.copy()
+    th.thumbnail((thumb_side, thumb_side), Image.LANCZOS)
+    low = None
+    if low_side:
+        lo = im.copy()
+        lo.thumbnail((low_side, low_side), Image.LANCZOS)
+        low = _jpeg_bytes(lo, low_quality)
+    return {"jpeg": _jpeg_bytes(im, quality), "thumb": _jpeg_bytes(th, thumb_quality),
+            "phash": image_dhash(th), "size": im.size, "low": low}
+
+def image_dhash(im: Image.Image) -> int:
+    """Hash de diferença (64 bits): compara pixels vizinhos de uma miniatura 9×8 em tons de cinza."""
+    g = im.convert("L").resize((9, 8), Image.BILINEAR)
+    px = list(g.getdata())
+    h = 0
+    for row in range(8):
+        for col in range(8):
+            h = (h << 1) | (1 if px[row*9 + col] > px[row*9 + col + 1] else 0)
+    return h
+
+_DATA_URL_HEAD = re.compile(r"^data:image/[a-zA-Z0-9+.\-]+;base64$")
+
 def b64_to_bytes(data_url: str) -> bytes:
     if not data_url: return b""
-    m = re.match(r"^data:image\/[a-zA-Z0-9+.\-]+;base64,(.+)$", data_url)
-    if not m: return b""
-    return base64.b64decode(m.group(1))
+    head, sep, payload = data_url.partition(",")   # regex só no cabeçalho, não nos megabytes de base64
+    if not sep or not payload or not _DATA_URL_HEAD.match(head): return b""
+    return base64.b64decode(payload)
+
+def take_upload(f) -> Optional[BinaryIO]:
+    """
+    Fica com o stream do arquivo enviado (sem copiar p/ bytes): a requisição fecha seus arquivos ao
+    terminar a resposta, o que no NDJSON acontece antes de o pipeline ler a foto. None se vazio.
+    """
+    stream = f.stream
+    stream.seek(0, io.SEEK_END); n = stream.tell(); stream.seek(0)
+    if n == 0: return None
+    f.stream = io.BytesIO()
+    UPLOADS_TOTAL.inc("binary"); UPLOAD_BYTES_TOTAL.inc("binary", n=n)
+    return stream
+
+def release_upload(raw: Optional[Union[bytes, BinaryIO]]) -> None:
+    """Fecha o stream de take_upload (e o que foi p/ disco) quando a requisição termina, mesmo que o
+    pipeline tenha saído antes de ler a foto (texto bloqueado, prazo esgotado)."""
+    if raw is not None and not isinstance(raw, (bytes, bytearray)):
+        try: raw.close()
+        except Exception as e: log_error("UPLOAD", e)
 
 def parse_domain(url: str) -> str:
     try:
@@ -461,6 +856,166 @@ def parse_domain(url: str) -> str:
     except Exception:
         return ""
 
+# ================== Cache / Geohash ==================
+
+class TTLCache:
+    """
+    Cache em memória com TTL e despejo LRU (thread-safe), com contadores de hit/miss.
+    Com db_path, um SQLite compartilhado fica atrás da memória (valores em JSON, chave = JSON da chave):
+    os workers dividem os acertos em vez de cada um aquecer o seu.
+    """
+    def __init__(self, name: str, maxsize: int, ttl_s: float, db_path: str = "", db_max: int = 20000):
+        self.name, self.maxsize, self.ttl_s, self.db_max = name, max(1, maxsize), ttl_s, db_max
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.db = SqliteDB(db_path, """
+            CREATE TABLE IF NOT EXISTS ttl_cache(key TEXT PRIMARY KEY, value TEXT, expires REAL);
+            CREATE INDEX IF NOT EXISTS ttl_cache_expires ON ttl_cache(expires);
+            """) if db_path else None
+        self.hits = self.hits_disk = self.misses = self.evictions = 0
+
+    def _mem_set(self, key, value, exp: float) -> None:
+        with self._lock:
+            self._data[key] = (exp, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False); self.evictions += 1
+
+    def _disk_get(self, key):
+        try:
+            row = self.db.conn().execute("SELECT value, expires FROM ttl_cache WHERE key=?",
+                                         (json.dumps(key, ensure_ascii=False),)).fetchone()
+        except Exception as e:
+            log_error("TTL_CACHE_DB", e); return None
+        left = row[1] - time.time() if row else 0
+        if left <= 0: return None
+        value = json.loads(row[0])
+        self._mem_set(key, value, time.monotonic() + left)
+        return value
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] >= now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None: del self._data[key]
+        value = self._disk_get(key) if self.db else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return default
+            self.hits_disk += 1
+        return value
+
+    def set(self, key, value, ttl_s: Optional[float] = None) -> None:
+        ttl = self.ttl_s if ttl_s is None else ttl_s
+        self._mem_set(key, value, time.monotonic() + ttl)
+        if not self.db or ttl <= 0: return
+        try:
+            c = self.db.conn()
+            c.execute("INSERT OR REPLACE INTO ttl_cache VALUES(?,?,?)",
+                      (json.dumps(key, ensure_ascii=False), json.dumps(value, ensure_ascii=False), time.time() + ttl))
+            c.execute("DELETE FROM ttl_cache WHERE expires < ? OR rowid IN "
+                      "(SELECT rowid FROM ttl_cache ORDER BY expires DESC LIMIT -1 OFFSET ?)", (time.time(), self.db_max))
+        except Exception as e:
+            log_error("TTL_CACHE_DB", e)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.hits + self.hits_disk; total = hits + self.misses
+            return {"size": len(self._data), "maxsize": self.maxsize, "ttl_s": self.ttl_s, "shared": bool(self.db),
+                    "hits": self.hits, "hits_disk": self.hits_disk, "misses": self.misses, "evictions": self.evictions,
+                    "hit_ratio": round(hits/total, 3) if total else None}
+
+SINGLEFLIGHTS: Dict[str, "SingleFlight"] = {}
+# falhas ligadas ao prazo/prioridade de quem liderou a chamada, não à chamada em si
+_LEADER_LOCAL_ERRORS = (requests.Timeout, FutureTimeout, RateLimited)
+
+class SingleFlight:
+    """
+    Chamadas concorrentes com a mesma chave compartilham uma única execução (resultado ou erro).
+    Quem chega com a chamada em andamento espera por ela, até o prazo da requisição.
+    Falhas que dependem de quem liderou (prazo/timeout dele, descarte pelo limitador de taxa pela prioridade
+    dele) não são repassadas: quem ainda espera assume a chamada e tenta de novo com o próprio prazo.
+    O resultado é o mesmo objeto p/ todos: não deve ser modificado.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Any, Future] = {}
+        self.calls = self.shared = self.retaken = 0
+        SINGLEFLIGHTS[name] = self
+
+    def do(self, key, fn, *args, **kw):
+        while True:
+            with self._lock:
+                fut = self._calls.get(key)
+                leader = fut is None
+                if leader:
+                    fut = self._calls[key] = Future(); self.calls += 1
+                else:
+                    self.shared += 1
+            if leader: break
+            left = deadline_remaining()
+            try:
+                return fut.result(timeout=None if left is None else max(0.0, left))
+            except _LEADER_LOCAL_ERRORS:
+                if not fut.done(): raise          # o prazo que acabou foi o deste chamador
+                with self._lock: self.retaken += 1
+        try:
+            res = fn(*args, **kw)
+        except BaseException as e:
+            self._release(key, fut); fut.set_exception(e); raise
+        self._release(key, fut); fut.set_result(res)
+        return res
+
+    def _release(self, key, fut: Future) -> None:
+        """Tira a chamada da tabela antes de acordar quem espera (quem assume não a encontra de novo)."""
+        with self._lock:
+            if self._calls.get(key) is fut: del self._calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.calls + self.shared
+            return {"calls": self.calls, "deduplicated": self.shared, "retaken": self.retaken, "in_flight": len(self._calls),
+                    "dedup_ratio": round(self.shared/total, 3) if total else None}
+
+register_stats("singleflight", lambda: {name: sf.stats() for name, sf in SINGLEFLIGHTS.items()})
+
+_GH32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+def geohash_encode(lat: float, lng: float, precision: int = 6) -> str:
+    lat_r, lng_r = [-90.0, 90.0], [-180.0, 180.0]
+    out, bits, ch, even = [], 0, 0, True
+    while len(out) < precision:
+        rng, v = (lng_r, lng) if even else (lat_r, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if v >= mid: ch = (ch << 1) | 1; rng[0] = mid
+        else: ch = ch << 1; rng[1] = mid
+        even = not even; bits += 1
+        if bits == 5:
+            out.append(_GH32[ch]); bits, ch = 0, 0
+    return "".join(out)
+
+def geohash_center(gh: str) -> Tuple[float, float]:
+    lat_r, lng_r = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for c in gh:
+        d = _GH32.index(c)
+        for k in range(4, -1, -1):
+            rng = lng_r if even else lat_r
+            mid = (rng[0] + rng[1]) / 2
+            if (d >> k) & 1: rng[0] = mid
+            else: rng[1] = mid
+            even = not even
+    return (lat_r[0] + lat_r[1]) / 2, (lng_r[0] + lng_r[1]) / 2
+
 # Normalização para política
 def _norm_txt(s: str) -> str:
     return unicodedata.normalize("NFD", (s or "").lower()).encode("ascii","ignore").decode("ascii")
@@ -472,6 +1027,42 @@ def _norm(s: str) -> str:
     s = "".join(c for c in s if unicodedata.category(c) != "Mn")
     return s.lower().strip()
 
+class TermMatcher:
+    """
+    Tabelas de termos normalizadas e compiladas uma vez numa única regex.
+    Casa termos inteiros (fronteira de palavra, aceita plural em -s/-es): "met" não casa em "metal".
+    A regex usa lookahead, então percorre o texto uma vez e enxerga casamentos sobrepostos;
+    first() devolve o nome da tabela de maior prioridade (ordem da lista) que casou.
+    """
+    def __init__(self, table: List[Tuple[str, Any]], norm=_norm):
+        self.norm = norm
+        self.names = [name for name, _ in table]
+        groups = []
+        for k, (_, terms) in enumerate(table):
+            alts = sorted({norm(t) for t in terms if norm(t)}, key=len, reverse=True)
+            if alts: groups.append(f"(?P<g{k}>{'|'.join(re.escape(a) for a in alts)})")
+        self.rx = re.compile(rf"(?<![a-z0-9])(?=(?:{'|'.join(groups)})(?:e?s)?(?![a-z0-9]))") if groups else None
+
+    def first(self, text: str, normalized: bool = False) -> Optional[str]:
+        if self.rx is None: return None
+        bag = text if normalized else self.norm(text)
+        best = None
+        for m in self.rx.finditer(bag):
+            k = int(m.lastgroup[1:])
+            if best is None or k < best:
+                best = k
+                if k == 0: break
+        return None if best is None else self.names[best]
+
+    def matches(self, text: str, normalized: bool = False) -> bool:
+        if self.rx is None: return False
+        return self.rx.search(text if normalized else self.norm(text)) is not None
+
+@lru_cache(maxsize=256)
+def term_matcher(terms: frozenset) -> TermMatcher:
+    """Matcher de um único conjunto de termos (cacheado por conjunto)."""
+    return TermMatcher([("t", terms)])
+
 FOOD_TERMS = {"arroz","feijao","leite","acucar","cafe","oleo","azeite","farinha","trigo","macarrao","sal","carne","frango","ovo","ovos","refrigerante","suco","agua","mercado","supermercado","hortifruti"}
 PHARMACY_TERMS = {"remedio","medicamento","remedios","medicamentos","dipirona","paracetamol","ibuprofeno","antigripal","dorflex","buscopan","antialergico","farmacia","drogaria","xarope"}
 TOOLS_TERMS = {"alicate","martelo","chave de fenda","broca","serra","ferramenta","ferramentas","furadeira","parafusadeira","serrote","trena","nivel","marreta","serra circular","home center","materiais de construcao","material de construcao"}
@@ -499,9 +1090,10 @@ PROHIBITED_TERMS = {
     "lsd","heroína","heroina","ketamina","metanfetamina","met","meth","gbl","ghb"
 }
 
+PROHIBITED_MATCHER = TermMatcher([("prohibited", PROHIBITED_TERMS)], norm=_norm_txt)
+
 def is_prohibited(text: str) -> bool:
-    bag = _norm_txt(text)
-    return any(term in bag for term in (_norm_txt(t) for t in PROHIBITED_TERMS))
+    return PROHIBITED_MATCHER.matches(text)
 
 INTENT_TABLE = [
     ("auto_service", AUTO_TERMS),      # serviços primeiro
@@ -547,7 +1139,13 @@ BLACKLIST_BY_INTENT = {
     "auto_service": {"supermercado","mercado","farmacia","drogaria","papelaria","loja de eletronicos"},
 }
 
-def detect_intent(user_q: str, info: Optional[Dict[str,Any]]) -> str:
+INTENT_MATCHER = TermMatcher(INTENT_TABLE)
+# categorias/blacklist conhecidas já compiladas na importação
+for _intent in INTENT_TABLE:
+    term_matcher(frozenset(INTENT_CATS[_intent[0]])); term_matcher(frozenset(BLACKLIST_BY_INTENT[_intent[0]]))
+
+def match_intent(user_q: str, info: Optional[Dict[str,Any]]) -> Optional[str]:
+    """Como detect_intent, mas devolve None quando nenhum termo casa (sem o padrão 'grocery')."""
     bag = _norm(user_q)
     if info:
         for k in ("product_name","brand","model","category"):
@@ -555,14 +1153,15 @@ def detect_intent(user_q: str, info: Optional[Dict[str,Any]]) -> str:
             if isinstance(v,str): bag += " " + _norm(v)
         for kw in info.get("keywords") or []:
             bag += " " + _norm(kw)
-    for name, terms in INTENT_TABLE:
-        if any(_norm(t) in bag for t in terms):
-            return name
-    return "grocery"  # default
+    return INTENT_MATCHER.first(bag, normalized=True)
+
+def detect_intent(user_q: str, info: Optional[Dict[str,Any]]) -> str:
+    return match_intent(user_q, info) or "grocery"  # default
 
 # =============== OpenAI (opcional para identificar produto em foto) ===============
 
-def identify_product_with_gpt4omini(image_data_uri: str, user_locale: str = "pt-BR", user_hint: str = "") -> Dict[str, Any]:
+def identify_product_with_gpt4omini(image_data_uri: str, user_locale: str = "pt-BR", user_hint: str = "",
+                                    detail: Optional[str] = None) -> Dict[str, Any]:
     headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
     system_prompt = "Você é um assistente especialista em identificar produtos a partir de imagens para e-commerce. Responda em JSON válido, sem texto fora do JSON."
     hint_txt = f"\nDica do usuário: {user_hint}\n" if user_hint else ""
@@ -575,12 +1174,14 @@ def identify_product_with_gpt4omini(image_data_uri: str, user_locale: str = "pt-
         "}\n"
         f"Idioma: {user_locale}.{hint_txt}Responda estritamente em JSON."
     )
+    image_url = {"url": image_data_uri}
+    if detail: image_url["detail"] = detail
     payload = {"model":"gpt-4o-mini","temperature":0.2,"messages":[
         {"role":"system","content":system_prompt},
-        {"role":"user","content":[{"type":"text","text":user_prompt},{"type":"image_url","image_url":{"url":image_data_uri}}]},
+        {"role":"user","content":[{"type":"text","text":user_prompt},{"type":"image_url","image_url":image_url}]},
     ],"max_tokens":400}
     try:
-        r = requests.post(OPENAI_CHAT_URL, headers=headers, data=json.dumps(payload), timeout=60)
+        r = HTTP.post(OPENAI_CHAT_URL, headers=headers, data=json.dumps(payload), timeout=60)
         r.raise_for_status()
         data = r.json()
         content = data["choices"][0]["message"]["content"]
@@ -590,49 +1191,244 @@ def identify_product_with_gpt4omini(image_data_uri: str, user_locale: str = "pt-
             m = re.search(r"\{.*\}", content, flags=re.S)
             if m: return json.loads(m.group(0))
     except Exception as e:
-        print("OPENAI_ERROR:", e)
+        log_error("OPENAI", e)
     return {"product_name":None,"brand":None,"model":None,"category":None,"keywords":[],"suggested_query":None,"confidence_pct":None}
 
+# Cache da identificação por foto: hash perceptual (dHash 64 bits) + dica do usuário.
+# Fotos repetidas ou quase iguais (distância de Hamming ≤ limiar) não chamam a OpenAI de novo.
+VISION_CACHE_MAX = int(os.getenv("VISION_CACHE_MAX", "512"))
+VISION_CACHE_HAMMING = int(os.getenv("VISION_CACHE_HAMMING", "4"))
+VISION_CACHE_DB = os.getenv("VISION_CACHE_DB", "data/vision.sqlite").strip()   # vazio = só memória (por processo)
+VISION_CACHE_DB_MAX = int(os.getenv("VISION_CACHE_DB_MAX", "20000"))
+
+def _to_i64(h: int) -> int:
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+class VisionCache:
+    """
+    Memória (LRU) + disco opcional (SQLite). No disco, o hash é guardado também em 8 bandas de 8 bits:
+    com limiar < 8, um vizinho sempre repete ao menos uma banda (pigeonhole), então a busca usa índice.
+    """
+    def __init__(self, maxsize: int, max_dist: int, db_path: str = "", db_max: int = 20000):
+        self.maxsize, self.max_dist, self.db_max = max(1, maxsize), max_dist, db_max
+        self._mem: "OrderedDict[Tuple[int, str], str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.db = SqliteDB(db_path, """
+            CREATE TABLE IF NOT EXISTS vision_cache(
+              phash INTEGER, hint TEXT, info TEXT, created REAL,
+              b0 INT, b1 INT, b2 INT, b3 INT, b4 INT, b5 INT, b6 INT, b7 INT,
+              PRIMARY KEY(phash, hint));
+            """ + "".join(f"CREATE INDEX IF NOT EXISTS vision_b{k} ON vision_cache(hint, b{k});" for k in range(8))
+        ) if db_path else None
+        self.hits_exact = self.hits_near = self.hits_disk = self.misses = 0
+
+    def _mem_lookup(self, phash: int, hint: str) -> Optional[str]:
+        with self._lock:
+            key = (phash, hint)
+            if key in self._mem:
+                self._mem.move_to_end(key); self.hits_exact += 1
+                return self._mem[key]
+            best, best_d = None, self.max_dist + 1
+            for (h, ht), v in self._mem.items():
+                if ht != hint: continue
+                d = bin(h ^ phash).count("1")
+                if d < best_d: best, best_d = (h, ht), d
+            if best is not None:
+                self._mem.move_to_end(best); self.hits_near += 1
+                return self._mem[best]
+        return None
+
+    def _mem_put(self, phash: int, hint: str, info_json: str):
+        with self._lock:
+            self._mem[(phash, hint)] = info_json
+            self._mem.move_to_end((phash, hint))
+            while len(self._mem) > self.maxsize: self._mem.popitem(last=False)
+
+    def _disk_lookup(self, phash: int, hint: str) -> Optional[str]:
+        if not self.db: return None
+        try:
+            if self.max_dist < 8:
+                bands = [(phash >> (8*k)) & 0xFF for k in range(8)]
+                where = " OR ".join(f"b{k}=?" for k in range(8))
+                rows = self.db.conn().execute(f"SELECT phash, info FROM vision_cache WHERE hint=? AND ({where})", [hint] + bands).fetchall()
+            else:
+                rows = self.db.conn().execute("SELECT phash, info FROM vision_cache WHERE hint=?", (hint,)).fetchall()
+        except Exception as e:
+            log_error("VISION_CACHE_DB", e); return None
+        best, best_d = None, self.max_dist + 1
+        for h, info in rows:
+            d = bin((h & 0xFFFFFFFFFFFFFFFF) ^ phash).count("1")
+            if d < best_d: best, best_d = info, d
+        if best is not None:
+            with self._lock: self.hits_disk += 1
+            self._mem_put(phash, hint, best)
+        return best
+
+    def get(self, phash: int, hint: str) -> Optional[Dict[str, Any]]:
+        v = self._mem_lookup(phash, hint) or self._disk_lookup(phash, hint)
+        if v is None:
+            with self._lock: self.misses += 1
+            return None
+        return json.loads(v)
+
+    def put(self, phash: int, hint: str, info: Dict[str, Any]) -> None:
+        v = json.dumps(info, ensure_ascii=False)
+        self._mem_put(phash, hint, v)
+        if not self.db: return
+        try:
+            c = self.db.conn()
+            c.execute("INSERT OR REPLACE INTO vision_cache VALUES(?,?,?,?,?,?,?,?,?,?,?,?)",
+                      [_to_i64(phash), hint, v, time.time()] + [(phash >> (8*k)) & 0xFF for k in range(8)])
+            c.execute("DELETE FROM vision_cache WHERE rowid IN (SELECT rowid FROM vision_cache ORDER BY created DESC LIMIT -1 OFFSET ?)", (self.db_max,))
+        except Exception as e:
+            log_error("VISION_CACHE_DB", e)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.hits_exact + self.hits_near + self.hits_disk
+            total = hits + self.misses
+            return {"size": len(self._mem), "maxsize": self.maxsize, "max_hamming": self.max_dist, "disk": bool(self.db),
+                    "hits_exact": self.hits_exact, "hits_near": self.hits_near, "hits_disk": self.hits_disk,
+                    "misses": self.misses, "hit_ratio": round(hits/total, 3) if total else None}
+
+VISION_CACHE = VisionCache(VISION_CACHE_MAX, VISION_CACHE_HAMMING, VISION_CACHE_DB, VISION_CACHE_DB_MAX)
+register_stats("vision_cache", VISION_CACHE.stats)
+
+# Visão adaptativa: 1ª tentativa com JPEG pequeno e detail "low"; só refaz com a foto cheia (como antes)
+# se a confiança vier abaixo do limiar ou faltarem campos
+VISION_MODE = os.getenv("VISION_MODE", "adaptive").strip().lower()                       # adaptive | full
+VISION_FULL_SAMPLE = float(os.getenv("VISION_FULL_SAMPLE", "0"))                          # fração em "full" p/ comparar
+VISION_LOW_SIDE = int(os.getenv("VISION_LOW_SIDE", "512"))
+VISION_LOW_QUALITY = int(os.getenv("VISION_LOW_QUALITY", "70"))
+VISION_MIN_CONFIDENCE = int(os.getenv("VISION_MIN_CONFIDENCE", "70"))                     # abaixo disso, escala
+VISION_REQUIRED_FIELDS = tuple(f.strip() for f in os.getenv("VISION_REQUIRED_FIELDS", "product_name,suggested_query").split(",") if f.strip())
+
+class VisionModeStats:
+    """Por modo (adaptive, full): identificações, bytes enviados, latência somada das chamadas e escaladas."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._modes: Dict[str, Dict[str, float]] = {}
+
+    def record(self, mode: str, sent: int, seconds: float, escalated: bool) -> None:
+        with self._lock:
+            m = self._modes.setdefault(mode, {"requests": 0, "bytes": 0, "seconds": 0.0, "escalated": 0})
+            m["requests"] += 1; m["bytes"] += sent; m["seconds"] += seconds; m["escalated"] += escalated
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock: modes = {k: dict(v) for k, v in self._modes.items()}
+        return {"mode": VISION_MODE, "min_confidence": VISION_MIN_CONFIDENCE, "low_side": VISION_LOW_SIDE,
+                **{k: {"requests": int(m["requests"]), "bytes_avg": round(m["bytes"] / m["requests"]),
+                       "latency_ms_avg": round(m["seconds"] * 1000 / m["requests"], 1),
+                       "escalation_rate": round(m["escalated"] / m["requests"], 3)} for k, m in modes.items()}}
+
+VISION_STATS = VisionModeStats()
+register_stats("vision", VISION_STATS.stats)
+
+def vision_escalation_reason(info: Any) -> Optional[str]:
+    """Por que a resposta da imagem pequena não basta (None = basta)."""
+    if not isinstance(info, dict) or any(not info.get(f) for f in VISION_REQUIRED_FIELDS): return "missing_fields"
+    try:
+        conf = float(info.get("confidence_pct"))
+    except (TypeError, ValueError):
+        return "missing_fields"
+    return "low_confidence" if conf < VISION_MIN_CONFIDENCE else None
+
+def identify_product(jpeg: bytes, low: Optional[bytes] = None, user_locale: str = "pt-BR", user_hint: str = "") -> Dict[str, Any]:
+    """
+    Identifica o produto da foto conforme VISION_MODE. "adaptive" (com low) manda antes o JPEG pequeno com
+    detail "low" e só escala p/ a foto cheia quando vision_escalation_reason aponta motivo; "full" manda só a cheia.
+    """
+    mode = "adaptive" if VISION_MODE == "adaptive" and low and random.random() >= VISION_FULL_SAMPLE else "full"
+    sent, spent = 0, 0.0
+    def call(data: bytes, detail: str) -> Dict[str, Any]:
+        nonlocal sent, spent
+        t0 = time.perf_counter()
+        try:
+            return identify_product_with_gpt4omini("data:image/jpeg;base64," + base64.b64encode(data).decode("ascii"),
+                                                   user_locale=user_locale, user_hint=user_hint,
+                                                   detail="low" if detail == "low" else None)
+        finally:
+            dt = time.perf_counter() - t0
+            sent += len(data); spent += dt
+            VISION_BYTES_TOTAL.inc(detail, n=len(data)); VISION_CALL_SECONDS.observe(dt, detail)
+    reason = None
+    if mode == "adaptive":
+        info = call(low, "low")
+        reason = vision_escalation_reason(info)
+        if reason:
+            VISION_ESCALATIONS_TOTAL.inc(reason)
+            full = call(jpeg, "full")
+            named = lambda x: isinstance(x, dict) and bool(x.get("product_name"))
+            if named(full) or not named(info): info = full   # falha na cheia: fica a resposta da pequena
+    else:
+        info = call(jpeg, "full")
+    VISION_STATS.record(mode, sent, spent, reason is not None)
+    return info
+
+def identify_product_cached(jpeg: bytes, phash: Optional[int], user_locale: str = "pt-BR", user_hint: str = "",
+                            low: Optional[bytes] = None) -> Dict[str, Any]:
+    """identify_product com cache por hash perceptual; só respostas válidas são guardadas."""
+    if phash is None:
+        return identify_product(jpeg, low, user_locale=user_locale, user_hint=user_hint)
+    hint = f"{user_locale}|{_norm(user_hint)}"
+    info = VISION_CACHE.get(phash, hint)
+    if info is not None: return info
+    info = identify_product(jpeg, low, user_locale=user_locale, user_hint=user_hint)
+    if isinstance(info, dict) and info.get("product_name"):
+        VISION_CACHE.put(phash, hint, info)
+    return info
+
 # =============== Online shops (busca geral) ===============
 
 def search_shops_serpapi(query: str, gl: str="br", hl: str="pt-BR") -> List[Dict[str, Any]]:
     if not SERPAPI_API_KEY: return []
-    url = "https://serpapi.com/search.json"
+    url = SERPAPI_URL
     params = {"engine":"google_shopping","q":query,"gl":gl,"hl":hl,"api_key":SERPAPI_API_KEY,"num":"20"}
     try:
-        rs = requests.get(url, params=params, timeout=40); rs.raise_for_status(); js = rs.json()
+        rs = HTTP.get(url, params=params, timeout=40); rs.raise_for_status(); js = rs.json()
     except Exception as e:
-        print("SERPAPI_ERROR:", e); return []
+        log_error("SERPAPI", e); return []
     items = []
     for it in (js.get("shopping_results") or []):
         items.append({"title":it.get("title"),"url":it.get("link"),"price":it.get("price"),
                       "domain":parse_domain(it.get("link","")),"snippet":(it.get("source") or it.get("product_id") or "")})
-    seen, uniq = set(), []
-    for x in items:
-        k = (x.get("domain"), x.get("title"))
-        if k in seen: continue
-        seen.add(k); uniq.append(x)
-    return uniq[:12]
+    return merge_shops([items])[:12]
 
 def search_shops_bing(query: str, mkt: str="pt-BR") -> List[Dict[str, Any]]:
     if not BING_SEARCH_KEY: return []
-    url = "https://api.bing.microsoft.com/v7.0/search"
+    url = BING_SEARCH_URL
     headers = {"Ocp-Apim-Subscription-Key": BING_SEARCH_KEY}
     q = f'{query} comprar site:mercadolivre.com.br OR site:magazineluiza.com.br OR site:amazon.com.br OR site:kabum.com.br OR site:submarino.com.br'
     try:
-        rs = requests.get(url, headers=headers, params={"q": q, "mkt": mkt, "count": 20, "textDecorations": False}, timeout=40)
+        rs = HTTP.get(url, headers=headers, params={"q": q, "mkt": mkt, "count": 20, "textDecorations": False}, timeout=40)
         rs.raise_for_status(); js = rs.json()
     except Exception as e:
-        print("BING_ERROR:", e); return []
+        log_error("BING", e); return []
     out = []
     for w in (js.get("webPages") or {}).get("value", []):
         out.append({"title":w.get("name"),"url":w.get("url"),"price":None,"domain":parse_domain(w.get("url","")),"snippet":w.get("snippet")})
-    seen, uniq = set(), []
-    for x in out:
-        k = (x.get("domain"), x.get("title"))
-        if k in seen: continue
-        seen.add(k); uniq.append(x)
-    return uniq[:12]
+    return merge_shops([out])[:12]
+
+def _shop_key(x: Dict[str, Any]) -> Tuple[str, str]:
+    dom = (x.get("domain") or "").lower()
+    for pre in ("www.", "m."):
+        if dom.startswith(pre): dom = dom[len(pre):]
+    title = re.sub(r"[^a-z0-9]+", " ", _norm(x.get("title") or "")).strip()
+    return dom, title
+
+def merge_shops(lists: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Junta listas de lojas (na ordem dada) sem repetir a mesma oferta: mesma loja (domínio sem www/m.)
+    e mesmo título normalizado. Na repetição, preenche o que faltar — principalmente o preço."""
+    merged: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for items in lists:
+        for x in items or []:
+            k = _shop_key(x)
+            cur = merged.get(k)
+            if cur is None:
+                merged[k] = dict(x); continue
+            for f, v in x.items():
+                if v and not cur.get(f): cur[f] = v
+    return list(merged.values())
 
 def build_store_links(query: str) -> List[Dict[str, Any]]:
     q = quote_plus(query.strip())
@@ -654,26 +1450,204 @@ def build_store_links(query: str) -> List[Dict[str, Any]]:
         out.append({"title": f"{name} — resultados para '{query}'","url": url,"price": None,"domain": parse_domain(url),"snippet": "Abrir resultados de busca"})
     return out
 
+# Cache das buscas de lojas online: memória (LRU) na frente de um SQLite compartilhado pelos workers.
+# Dentro do TTL do provedor a resposta é "fresca"; até TTL + SHOP_CACHE_STALE_S é servida e
+# atualizada em segundo plano (stale-while-revalidate); depois disso, busca de novo.
+SHOP_CACHE_MAX = int(os.getenv("SHOP_CACHE_MAX", "2000"))
+SHOP_CACHE_DB = os.getenv("SHOP_CACHE_DB", "data/shops.sqlite").strip()      # vazio = só memória
+SHOP_CACHE_DB_MAX = int(os.getenv("SHOP_CACHE_DB_MAX", "50000"))
+SHOP_CACHE_TTL = os.getenv("SHOP_CACHE_TTL", "serpapi=21600,bing=21600,links=0").strip()  # provedor=segundos (0 = não guarda)
+SHOP_CACHE_STALE_S = float(os.getenv("SHOP_CACHE_STALE_S", str(24*3600)))
+
+def shop_query_key(query: str, user_locale: str) -> str:
+    """Chave canônica da busca: _norm sem "comprar" (com ou sem acento/maiúsculas, a mesma chave)."""
+    words = [w for w in _norm(query).split() if w != "comprar"]
+    return f"{user_locale.lower()}|{' '.join(words)}"
+
+class ShopCache:
+    def __init__(self, maxsize: int, ttl_by_provider: Dict[str, float], stale_s: float, db_path: str = "", db_max: int = 50000):
+        self.maxsize, self.ttl, self.stale_s, self.db_max = max(1, maxsize), ttl_by_provider, stale_s, db_max
+        self._mem: "OrderedDict[str, Tuple[float, str, str]]" = OrderedDict()   # chave → (quando, provedor, json)
+        self._lock = threading.Lock()
+        self.db = SqliteDB(db_path, """
+            CREATE TABLE IF NOT EXISTS shop_cache(key TEXT PRIMARY KEY, provider TEXT, fetched REAL, shops TEXT);
+            CREATE INDEX IF NOT EXISTS shop_cache_fetched ON shop_cache(fetched);
+            """) if db_path else None
+        self._refreshing: set = set()
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="shops-revalidate")
+        self.hits_mem = self.hits_disk = self.stale = self.misses = self.revalidations = self.evictions = 0
+
+    def _ttl(self, provider: str) -> float:
+        return min(self.ttl.get(p, 0) for p in provider.split("+"))   # resposta combinada: o menor TTL
+
+    def _state(self, fetched: float, provider: str) -> str:
+        age = time.time() - fetched; ttl = self._ttl(provider)
+        if age < ttl: return "fresh"
+        if age < ttl + self.stale_s: return "stale"
+        return "expired"
+
+    def _mem_put(self, key: str, item: Tuple[float, str, str]):
+        with self._lock:
+            self._mem[key] = item; self._mem.move_to_end(key)
+            while len(self._mem) > self.maxsize:
+                self._mem.popitem(last=False); self.evictions += 1
+
+    def _disk_get(self, key: str) -> Optional[Tuple[float, str, str]]:
+        if not self.db: return None
+        try:
+            row = self.db.conn().execute("SELECT fetched, provider, shops FROM shop_cache WHERE key=?", (key,)).fetchone()
+        except Exception as e:
+            log_error("SHOP_CACHE_DB", e); return None
+        return (row[0], row[1], row[2]) if row is not None else None
+
+    def get(self, key: str) -> Optional[Tuple[List[Dict[str, Any]], str, str]]:
+        """
+        (lojas, provedor, "fresh"|"stale") ou None. Se a cópia em memória não está fresca, relê o SQLite:
+        outro worker pode já ter gravado uma versão mais nova.
+        """
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None: self._mem.move_to_end(key)
+        tier = "mem"
+        if item is None or self._state(item[0], item[1]) != "fresh":
+            row = self._disk_get(key)
+            if row is not None and (item is None or row[0] > item[0]):
+                item, tier = row, "disk"; self._mem_put(key, item)
+        state = self._state(item[0], item[1]) if item is not None else "expired"
+        with self._lock:
+            if state == "expired": self.misses += 1; return None
+            if state == "stale": self.stale += 1
+            elif tier == "mem": self.hits_mem += 1
+            else: self.hits_disk += 1
+        return json.loads(item[2]), item[1], state
+
+    def put(self, key: str, shops: List[Dict[str, Any]], provider: str) -> None:
+        if self._ttl(provider) <= 0 or not shops: return
+        item = (time.time(), provider, json.dumps(shops, ensure_ascii=False))
+        self._mem_put(key, item)
+        if not self.db: return
+        try:
+            c = self.db.conn()
+            c.execute("INSERT OR REPLACE INTO shop_cache VALUES(?,?,?,?)", (key, item[1], item[0], item[2]))
+            c.execute("DELETE FROM shop_cache WHERE rowid IN (SELECT rowid FROM shop_cache ORDER BY fetched DESC LIMIT -1 OFFSET ?)", (self.db_max,))
+        except Exception as e:
+            log_error("SHOP_CACHE_DB", e)
+
+    def revalidate(self, key: str, fetch) -> None:
+        """Atualiza a chave em segundo plano (uma vez por chave), com prioridade de fundo no limitador."""
+        with self._lock:
+            if key in self._refreshing: return
+            self._refreshing.add(key); self.revalidations += 1
+        def run():
+            try:
+                item = self._disk_get(key)
+                if item is not None and self._state(item[0], item[1]) == "fresh":
+                    self._mem_put(key, item); return   # outro worker já revalidou
+                with request_priority("background"):
+                    shops, provider = fetch()
+                self.put(key, shops, provider)
+            except Exception as e:
+                log_error("SHOP_REVALIDATE", e)
+            finally:
+                with self._lock: self._refreshing.discard(key)
+        self._pool.submit(run)   # sem o contexto da requisição: não herda o prazo dela
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.hits_mem + self.hits_disk + self.stale; total = hits + self.misses
+            return {"size": len(self._mem), "maxsize": self.maxsize, "ttl_s": self.ttl, "stale_s": self.stale_s,
+                    "hits_mem": self.hits_mem, "hits_disk": self.hits_disk, "stale_served": self.stale,
+                    "misses": self.misses, "revalidations": self.revalidations, "evictions": self.evictions,
+                    "hit_ratio": round(hits/total, 3) if total else None}
+
+SHOP_CACHE = ShopCache(SHOP_CACHE_MAX, _parse_float_map(SHOP_CACHE_TTL),
+                       SHOP_CACHE_STALE_S, SHOP_CACHE_DB, SHOP_CACHE_DB_MAX)
+register_stats("shop_cache", SHOP_CACHE.stats)
+
+SHOPS_FLIGHT = SingleFlight("shops")
+
+# "fanout": todos os provedores configurados em paralelo (junta o que chegar na janela); "single": só o preferido
+SHOPS_MODE = os.getenv("SHOPS_MODE", "fanout").strip().lower()
+SHOPS_MERGE_GRACE_S = float(os.getenv("SHOPS_MERGE_GRACE_S", "0.3"))   # espera pelos demais após a 1ª resposta
+SHOPS_MAX_WAIT_S = float(os.getenv("SHOPS_MAX_WAIT_S", "8"))           # sem resposta até aqui → links de busca
+SHOPS_MAX_RESULTS = int(os.getenv("SHOPS_MAX_RESULTS", "20"))
+SHOPS_ANSWERED_TOTAL = Counter("compras_shops_answered_total", "Buscas de lojas online por provedor que respondeu", ("provider",))
+
 def find_shops(query: str, user_locale: str="pt-BR") -> Tuple[List[Dict[str, Any]], str]:
-    provider_used = "serpapi" if SERPAPI_API_KEY else ("bing" if BING_SEARCH_KEY else "links")
     q = query.strip()
     if q and "comprar" not in q.lower(): q = "comprar " + q
-    if provider_used == "serpapi":
-        shops = search_shops_serpapi(q, gl="br", hl=user_locale)
-        if not shops: shops = build_store_links(q); provider_used = "links"
-    elif provider_used == "bing":
-        shops = search_shops_bing(q, mkt="pt-BR")
-        if not shops: shops = build_store_links(q); provider_used = "links"
-    else:
-        shops = build_store_links(q); provider_used = "links"
-    return shops, provider_used
+    key = shop_query_key(q, user_locale)
+    hit = SHOP_CACHE.get(key)
+    if hit is not None:
+        shops, provider, state = hit
+        if state == "stale": SHOP_CACHE.revalidate(key, lambda: _find_shops(q, user_locale))
+        return shops, provider
+    # mesma busca já em andamento (ex.: promoção) → espera por ela em vez de repetir a chamada
+    def fetch():
+        shops, provider = _find_shops(q, user_locale)
+        SHOP_CACHE.put(key, shops, provider)
+        return shops, provider
+    return SHOPS_FLIGHT.do(key, fetch)
+
+def _find_shops(q: str, user_locale: str) -> Tuple[List[Dict[str, Any]], str]:
+    providers = []
+    if SERPAPI_API_KEY: providers.append(("serpapi", lambda: search_shops_serpapi(q, gl="br", hl=user_locale)))
+    if BING_SEARCH_KEY: providers.append(("bing", lambda: search_shops_bing(q, mkt="pt-BR")))
+    if not providers: return build_store_links(q), "links"
+    if SHOPS_MODE != "fanout": providers = providers[:1]
+    answered = fanout_shops(providers)
+    if not answered:
+        FALLBACKS_TOTAL.inc("store_links")
+        return build_store_links(q), "links"
+    provider = "+".join(name for name, _ in answered)
+    SHOPS_ANSWERED_TOTAL.inc(provider)
+    return merge_shops([shops for _, shops in answered])[:SHOPS_MAX_RESULTS], provider
+
+def fanout_shops(providers: List[Tuple[str, Any]]) -> List[Tuple[str, List[Dict[str, Any]]]]:
+    """
+    Consulta os provedores em paralelo. Depois da primeira resposta não vazia, espera no máximo
+    SHOPS_MERGE_GRACE_S pelas demais; sem nenhuma em SHOPS_MAX_WAIT_S (ou no prazo), desiste.
+    Devolve [(provedor, lojas)] das respostas não vazias, na ordem de preferência.
+    """
+    futs = {IO_POOL.submit(bind_context(fn)): name for name, fn in providers}
+    order = {name: k for k, (name, _) in enumerate(providers)}
+    answered: List[Tuple[str, List[Dict[str, Any]]]] = []
+    pending = set(futs)
+    end = time.monotonic() + SHOPS_MAX_WAIT_S
+    graced = False
+    while pending:
+        timeout = end - time.monotonic()
+        left = deadline_remaining()
+        if left is not None: timeout = min(timeout, left)
+        if timeout <= 0: break
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done: break
+        for f in done:
+            try:
+                shops = f.result()
+            except Exception as e:
+                log_error("SHOPS_PROVIDER", e); continue
+            if shops:
+                answered.append((futs[f], shops))
+                if not graced:
+                    graced = True; end = min(end, time.monotonic() + SHOPS_MERGE_GRACE_S)
+    answered.sort(key=lambda a: order[a[0]])
+    return answered
 
 # =============== Maps / Geo ===============
 
-def serpapi_maps_search_anchor_only(anchor: str, lat: float, lng: float, allow_cats: Optional[set], blacklist: set) -> List[Dict[str, Any]]:
-    """Busca Google Maps via SerpApi usando APENAS a âncora; filtra por categoria e aplica blacklist."""
-    if not SERPAPI_API_KEY: return []
-    url = "https://serpapi.com/search.json"
+# Cache por célula: vizinhos que pedem a mesma âncora reaproveitam a busca paga no SerpApi
+MAPS_CACHE_PRECISION = int(os.getenv("MAPS_CACHE_PRECISION", "6"))   # geohash 6 ≈ 1,2 km × 0,6 km
+MAPS_CACHE_TTL_S = float(os.getenv("MAPS_CACHE_TTL_S", str(6*3600)))
+MAPS_CACHE_MAX = int(os.getenv("MAPS_CACHE_MAX", "2000"))
+MAPS_CACHE_DB = os.getenv("MAPS_CACHE_DB", "data/maps.sqlite").strip()      # vazio = só memória (por processo)
+MAPS_CACHE = TTLCache("maps", MAPS_CACHE_MAX, MAPS_CACHE_TTL_S, MAPS_CACHE_DB)
+register_stats("maps_cache", MAPS_CACHE.stats)
+app.jinja_env.globals["maps_cache_hours"] = max(1, round(MAPS_CACHE_TTL_S / 3600))      # aviso de privacidade da página
+
+def serpapi_maps_fetch(anchor: str, lat: float, lng: float) -> Optional[List[Dict[str, Any]]]:
+    """Busca Google Maps via SerpApi (só a âncora), sem filtros; None em caso de erro."""
+    url = SERPAPI_URL
     params = {
         "engine": "google_maps",
         "type": "search",
@@ -685,18 +1659,14 @@ def serpapi_maps_search_anchor_only(anchor: str, lat: float, lng: float, allow_c
         "no_cache": "true",
     }
     try:
-        rs = requests.get(url, params=params, timeout=30)
+        rs = HTTP.get(url, params=params, timeout=30)
         rs.raise_for_status()
         js = rs.json()
     except Exception as e:
-        print("SERPAPI_MAPS_ERROR:", e); return []
+        log_error("SERPAPI_MAPS", e); return None
 
-    local_results = js.get("local_results") or []
     out = []
-    cats_norm = {_norm(x) for x in (allow_cats or set())}
-    bl_norm = {_norm(x) for x in (blacklist or set())}
-
-    for it in local_results:
+    for it in js.get("local_results") or []:
         gps = it.get("gps_coordinates") or {}
         if not gps: continue
         try:
@@ -704,48 +1674,216 @@ def serpapi_maps_search_anchor_only(anchor: str, lat: float, lng: float, allow_c
         except Exception:
             continue
 
-        title = it.get("title") or anchor
-        addr = it.get("address") or ""
-        t_norm = _norm(it.get("type") or "")
-        c_norm = _norm(it.get("category") or "")
-        title_norm = _norm(title)
-
-        if any(b in title_norm for b in bl_norm):
-            continue
-
-        if cats_norm:
-            joined = f"{t_norm} {c_norm}".strip()
-            if joined and not any(cat in joined for cat in cats_norm):
-                continue
-
         place_id = it.get("place_id") or ""
-        website = it.get("website") or ""
         gmaps_link = it.get("link") if str(it.get("link","")).startswith("https://www.google.") else ""
-
         maps_url = gmaps_link or (f"https://www.google.com/maps/search/?api=1&query={slat}%2C{slng}&query_place_id={place_id}" if place_id else f"https://www.google.com/maps/@{slat},{slng},18z")
 
         out.append({
-            "title": title,
-            "address": addr,
+            "title": it.get("title") or anchor,
+            "address": it.get("address") or "",
             "lat": slat, "lng": slng,
             "type": it.get("type"), "category": it.get("category"),
             "place_id": place_id,
-            "website": website,
+            "website": it.get("website") or "",
             "maps_url": maps_url
         })
-
-    out.sort(key=lambda p: haversine_km(lat, lng, p["lat"], p["lng"]))
     return out
 
-def nominatim_search(name: str, lat: float, lng: float, limit: int = 10) -> List[Dict[str, Any]]:
+MAPS_FLIGHT = SingleFlight("maps")
+
+def serpapi_maps_search_anchor_only(anchor: str, lat: float, lng: float, allow_cats: Optional[set], blacklist: set) -> List[Dict[str, Any]]:
+    """Busca Google Maps via SerpApi usando APENAS a âncora; filtra por categoria e aplica blacklist.
+    O resultado bruto fica em cache por (âncora, célula geohash); filtro e ordenação usam a posição real."""
+    if not SERPAPI_API_KEY: return []
+    cell = geohash_encode(lat, lng, MAPS_CACHE_PRECISION)
+    key = (_norm(anchor), cell)
+    pois = MAPS_CACHE.get(key)
+    if pois is None:
+        def fetch():
+            clat, clng = geohash_center(cell)
+            got = serpapi_maps_fetch(anchor, clat, clng)
+            if got is not None: MAPS_CACHE.set(key, got)
+            return got
+        pois = MAPS_FLIGHT.do(key, fetch)
+        if pois is None: return []
+
+    out = []
+    cats_rx = term_matcher(frozenset(allow_cats)) if allow_cats else None
+    bl_rx = term_matcher(frozenset(blacklist or ()))
+
+    for p in pois:
+        if bl_rx.matches(p["title"]):
+            continue
+
+        if cats_rx:
+            joined = _norm(f"{p.get('type') or ''} {p.get('category') or ''}")
+            if joined and not cats_rx.matches(joined, normalized=True):
+                continue
+
+        out.append(p)
+
+    return [dict(p) for _, p in nearest_first(lat, lng, out, math.inf)]
+
+# Índice local de lojas (SQLite + R-tree): cresce com os resultados do SerpApi/Nominatim e
+# responde "k lojas mais próximas da intenção" sem chamada externa quando a região já é conhecida.
+POI_DB = os.getenv("POI_DB", "data/pois.sqlite").strip()            # vazio = desativado
+POI_RADIUS_KM = float(os.getenv("POI_RADIUS_KM", "5"))
+POI_MIN_COUNT = int(os.getenv("POI_MIN_COUNT", "6"))                 # abaixo disso a região é "esparsa"
+POI_MAX_AGE_S = float(os.getenv("POI_MAX_AGE_S", str(14*86400)))    # lojas/células mais velhas são ignoradas e apagadas
+POI_PRUNE_EVERY_S = float(os.getenv("POI_PRUNE_EVERY_S", "3600"))   # intervalo entre limpezas (por processo, na ingestão)
+POI_COVERAGE_PRECISION = int(os.getenv("POI_COVERAGE_PRECISION", "5"))  # geohash 5 ≈ 4,9 km × 4,9 km
+POI_K = int(os.getenv("POI_K", "20"))
+
+class PoiIndex:
+    """
+    Lojas por intenção com R-tree de (lat, lng). nearby() devolve None quando a cobertura local
+    é insuficiente (poucas lojas frescas no raio e célula não pesquisada recentemente).
+    Lojas e células com mais de POI_MAX_AGE_S são ignoradas e, a cada POI_PRUNE_EVERY_S, apagadas.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS pois(
+          id INTEGER PRIMARY KEY, intent TEXT NOT NULL, key TEXT NOT NULL,
+          title TEXT, address TEXT, type TEXT, category TEXT, place_id TEXT, website TEXT, maps_url TEXT,
+          lat REAL, lng REAL, source TEXT, updated REAL, UNIQUE(intent, key));
+        CREATE VIRTUAL TABLE IF NOT EXISTS pois_rtree USING rtree(id, min_lat, max_lat, min_lng, max_lng);
+        CREATE INDEX IF NOT EXISTS pois_updated ON pois(updated);
+        CREATE TABLE IF NOT EXISTS poi_coverage(intent TEXT, cell TEXT, updated REAL, PRIMARY KEY(intent, cell));
+    """
+
+    def __init__(self, path: str):
+        self.db = SqliteDB(path, self.SCHEMA)
+        self._lock = threading.Lock()
+        self.local_hits = self.sparse = self.stale = self.ingested = self.pruned = 0
+        self.query_s_sum = 0.0; self.queries = 0
+        self._pruned_at = 0.0
+
+    @staticmethod
+    def _key(p: Dict[str, Any], source: str) -> str:
+        if p.get("place_id"): return "g:" + p["place_id"]
+        return f"{source}:{p['lat']:.5f},{p['lng']:.5f}:{_norm(p.get('title') or '')[:40]}"
+
+    def add(self, intent: str, pois: List[Dict[str, Any]], source: str) -> None:
+        if not pois: return
+        now = time.time()
+        try:
+            c = self.db.conn()
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                for p in pois:
+                    row = c.execute("""
+                        INSERT INTO pois(intent, key, title, address, type, category, place_id, website, maps_url, lat, lng, source, updated)
+                        VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?)
+                        ON CONFLICT(intent, key) DO UPDATE SET title=excluded.title, address=excluded.address,
+                          type=excluded.type, category=excluded.category, website=excluded.website, maps_url=excluded.maps_url,
+                          lat=excluded.lat, lng=excluded.lng, updated=excluded.updated
+                        RETURNING id""",
+                        (intent, self._key(p, source), p.get("title"), p.get("address") or "", p.get("type") or "",
+                         p.get("category") or "", p.get("place_id") or "", p.get("website") or "", p.get("maps_url") or "",
+                         p["lat"], p["lng"], source, now)).fetchone()
+                    c.execute("INSERT OR REPLACE INTO pois_rtree VALUES(?,?,?,?,?)", (row[0], p["lat"], p["lat"], p["lng"], p["lng"]))
+                c.execute("COMMIT")
+            except Exception:
+                c.execute("ROLLBACK"); raise
+            with self._lock:
+                self.ingested += len(pois)
+                due = now - self._pruned_at >= POI_PRUNE_EVERY_S
+                if due: self._pruned_at = now
+            if due: self.prune(now - POI_MAX_AGE_S)
+        except Exception as e:
+            log_error("POI_INDEX", e)
+
+    def prune(self, before: float) -> None:
+        """Apaga lojas (e a entrada no R-tree) e células de cobertura atualizadas antes de `before`."""
+        try:
+            c = self.db.conn()
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                c.execute("DELETE FROM pois_rtree WHERE id IN (SELECT id FROM pois WHERE updated < ?)", (before,))
+                n = c.execute("DELETE FROM pois WHERE updated < ?", (before,)).rowcount
+                c.execute("DELETE FROM poi_coverage WHERE updated < ?", (before,))
+                c.execute("COMMIT")
+            except Exception:
+                c.execute("ROLLBACK"); raise
+            with self._lock: self.pruned += n
+        except Exception as e:
+            log_error("POI_INDEX", e)
+
+    def mark_covered(self, intent: str, lat: float, lng: float) -> None:
+        try:
+            self.db.conn().execute("INSERT OR REPLACE INTO poi_coverage VALUES(?,?,?)",
+                                   (intent, geohash_encode(lat, lng, POI_COVERAGE_PRECISION), time.time()))
+        except Exception as e:
+            log_error("POI_INDEX", e)
+
+    def nearby(self, intent: str, lat: float, lng: float, k: int = POI_K) -> Optional[List[Dict[str, Any]]]:
+        t0 = time.perf_counter()
+        dlat = POI_RADIUS_KM / 111.32
+        dlng = POI_RADIUS_KM / (111.32 * max(0.01, math.cos(math.radians(lat))))
+        fresh_after = time.time() - POI_MAX_AGE_S
+        try:
+            c = self.db.conn()
+            rows = c.execute("""
+                SELECT p.title, p.address, p.type, p.category, p.place_id, p.website, p.maps_url, p.lat, p.lng
+                FROM pois_rtree r JOIN pois p ON p.id = r.id
+                WHERE r.min_lat >= ? AND r.max_lat <= ? AND r.min_lng >= ? AND r.max_lng <= ?
+                  AND p.intent = ? AND p.updated >= ?""",
+                (lat-dlat, lat+dlat, lng-dlng, lng+dlng, intent, fresh_after)).fetchall()
+            covered = c.execute("SELECT updated FROM poi_coverage WHERE intent=? AND cell=?",
+                                (intent, geohash_encode(lat, lng, POI_COVERAGE_PRECISION))).fetchone()
+        except Exception as e:
+            log_error("POI_INDEX", e); return None
+
+        cats_rx = term_matcher(frozenset(INTENT_CATS.get(intent) or ()))
+        bl_rx = term_matcher(frozenset(BLACKLIST_BY_INTENT.get(intent) or ()))
+        out = []
+        for title, addr, typ, cat, place_id, website, maps_url, slat, slng in rows:
+            if bl_rx.matches(title or ""): continue
+            joined = _norm(f"{typ} {cat}")
+            if joined and not cats_rx.matches(joined, normalized=True): continue
+            out.append({"title": title, "address": addr, "lat": slat, "lng": slng, "type": typ or None,
+                        "category": cat or None, "place_id": place_id, "website": website, "maps_url": maps_url})
+        out = nearest_first(lat, lng, out, POI_RADIUS_KM)
+
+        is_covered = covered is not None and covered[0] >= fresh_after
+        with self._lock:
+            self.queries += 1; self.query_s_sum += time.perf_counter() - t0
+            if len(out) >= POI_MIN_COUNT or (is_covered and out): self.local_hits += 1
+            elif covered is not None and not is_covered: self.stale += 1; return None
+            else: self.sparse += 1; return None
+        return [p for _, p in out[:k]]
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            size = self.db.conn().execute("SELECT COUNT(*) FROM pois").fetchone()[0]
+        except Exception:
+            size = None
+        with self._lock:
+            return {"pois": size, "local_hits": self.local_hits, "sparse": self.sparse, "stale": self.stale,
+                    "ingested": self.ingested, "pruned": self.pruned,
+                    "query_us_avg": round(self.query_s_sum*1e6/self.queries, 1) if self.queries else None}
+
+POI_INDEX = PoiIndex(POI_DB) if POI_DB else None
+if POI_INDEX: register_stats("poi_index", POI_INDEX.stats)
+app.jinja_env.globals["poi_max_days"] = max(1, round(POI_MAX_AGE_S / 86400)) if POI_INDEX else 0   # aviso de privacidade
+INTENT_BY_ANCHOR = {v: k for k, v in INTENT_ANCHOR.items()}
+
+HTTP.host(NOMINATIM_URL).admitted = NOMINATIM_TOTAL   # conta cada tentativa que o limitador deixou passar
+
+def nominatim_search(name: str, lat: float, lng: float, limit: int = 10, strict: bool = False) -> List[Dict[str, Any]]:
+    """Lugares do OSM perto de (lat, lng); falhas viram [] (com strict=True, a exceção sobe p/ quem chamou)."""
     minx, miny, maxx, maxy = (lng-0.7, lat-0.7, lng+0.7, lat+0.7)
     params = {"format":"jsonv2","q":name,"limit":str(limit),"viewbox":f"{minx},{maxy},{maxx},{miny}","bounded":1,"countrycodes":"br","addressdetails":1}
     if NOMINATIM_EMAIL: params["email"] = NOMINATIM_EMAIL
     try:
-        r = requests.get("https://nominatim.openstreetmap.org/search", params=params, headers=NOMINATIM_HEADERS, timeout=20)
-        r.raise_for_status(); return r.json() or []
+        with STAGE_SECONDS.time("nominatim"):
+            try:
+                r = HTTP.get(NOMINATIM_URL, params=params, headers=NOMINATIM_HEADERS, timeout=20)
+            except RateLimited:
+                NOMINATIM_SHED_TOTAL.inc(_PRIORITY.get()); raise
+            r.raise_for_status(); return r.json() or []
     except Exception as e:
-        print("NOMINATIM_ERROR:", e); return []
+        if strict: raise
+        log_error("NOMINATIM", e); return []
 
 def haversine_km(lat1, lon1, lat2, lon2):
     R = 6371.0; p = math.pi/180.0
@@ -753,185 +1891,1040 @@ def haversine_km(lat1, lon1, lat2, lon2):
     a = (math.sin(dlat/2)**2) + math.cos(lat1*p)*math.cos(lat2*p)*(math.sin(dlon/2)**2)
     return 2*R*math.asin(math.sqrt(a))
 
+def haversine_km_many(lat: float, lng: float, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    """haversine_km de um ponto até vários, numa passada vetorizada."""
+    p = math.pi/180.0
+    a = np.sin((lats-lat)*p/2)**2 + math.cos(lat*p)*np.cos(lats*p)*np.sin((lngs-lng)*p/2)**2
+    return 2*6371.0*np.arcsin(np.sqrt(a))
+
+def nearest_first(lat: float, lng: float, pois: List[Dict[str, Any]], max_km: float) -> List[Tuple[float, Dict[str, Any]]]:
+    """(distância em km, poi) dos pois a até max_km do ponto, do mais próximo ao mais distante."""
+    if not pois: return []
+    d = haversine_km_many(lat, lng, np.array([p["lat"] for p in pois], float), np.array([p["lng"] for p in pois], float))
+    return [(float(d[k]), pois[k]) for k in np.argsort(d, kind="stable") if d[k] <= max_km]
+
+# Ranqueamento de candidatos: SerpApi, índice local e Nominatim devolvem a mesma loja com nomes e
+# coordenadas ligeiramente diferentes (ou o SerpApi a repete); sem fundir, o /table e os cards pagam duas vezes
+RANK_DEDUPE_M = float(os.getenv("RANK_DEDUPE_M", "120"))                   # nomes equivalentes a menos disso = mesma loja
+RANK_DEDUPE_UNNAMED_M = float(os.getenv("RANK_DEDUPE_UNNAMED_M", "30"))    # sem nome útil, só a proximidade decide
+
+# palavras que não distinguem uma loja de outra ("Supermercado X" × "X")
+_NAME_STOPWORDS = frozenset(re.findall(r"[a-z0-9]+", _norm(" ".join(
+    list(INTENT_ANCHOR.values()) + [c for cats in INTENT_CATS.values() for c in cats])))) | {"de", "da", "do", "das", "dos", "e", "the"}
+
+@lru_cache(maxsize=4096)
+def store_name_key(title: str) -> frozenset:
+    """Palavras distintivas do nome (antes da 1ª vírgula: o Nominatim devolve nome, endereço, cidade...)."""
+    return frozenset(w for w in re.findall(r"[a-z0-9]+", _norm_txt((title or "").split(",")[0])) if w not in _NAME_STOPWORDS)
+
+def _same_store_name(a: frozenset, b: frozenset) -> bool:
+    return bool(a) and bool(b) and len(a & b) * 2 > min(len(a), len(b))
+
+def _completeness(c: Dict[str, Any]) -> int:
+    return 4*bool(c.get("place_id")) + 2*bool(c.get("website")) + bool(c.get("address"))
+
+def _source_ids(c: Dict[str, Any]) -> frozenset:
+    """Identidade de uma candidata nas fontes: as das fundidas por rank_candidates, senão place_id ou coordenadas."""
+    return c.get("sources") or frozenset([c.get("place_id") or (c["lat"], c["lng"])])
+
+def rank_candidates(lat: float, lng: float, cands: List[Dict[str, Any]], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Lojas candidatas de todas as fontes → lojas distintas, da mais próxima à mais distante em linha reta
+    (cópias com distance_km). Distâncias ao usuário e entre candidatas saem de uma passada NumPy cada;
+    são a mesma loja as com o mesmo place_id, ou a menos de RANK_DEDUPE_M com nomes equivalentes
+    (RANK_DEDUPE_UNNAMED_M se uma delas não tem nome útil). Cada grupo vira a candidata mais completa,
+    com os campos vazios preenchidos pelas outras e em "sources" a identidade (place_id ou coordenadas) de todas.
+    """
+    n = len(cands)
+    if n == 0: return []
+    with STAGE_SECONDS.time("rank"):
+        lats = np.array([c["lat"] for c in cands], float); lngs = np.array([c["lng"] for c in cands], float)
+        dist = haversine_km_many(lat, lng, lats, lngs)
+
+        parent = list(range(n))
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]; i = parent[i]
+            return i
+        def union(i: int, j: int) -> None:
+            ri, rj = find(i), find(j)
+            if ri != rj: parent[max(ri, rj)] = min(ri, rj)
+
+        # pares próximos sem matriz n × n: janela de RANK_DEDUPE_M sobre x ordenado, depois a distância exata
+        # (projeção equiretangular local: erro desprezível na escala de centenas de metros)
+        x = lngs * (111320.0 * math.cos(math.radians(lat))); y = lats * 110540.0
+        order = np.argsort(x, kind="stable"); xs = x[order]
+        counts = np.searchsorted(xs, xs + RANK_DEDUPE_M, side="right") - np.arange(n) - 1
+        ii = np.repeat(np.arange(n), counts)
+        jj = ii + 1 + np.arange(len(ii)) - np.repeat(np.cumsum(counts) - counts, counts)
+        a, b = order[ii], order[jj]
+        d2 = (x[a] - x[b])**2 + (y[a] - y[b])**2
+        close = d2 <= RANK_DEDUPE_M**2
+        for i, j, dd in zip(a[close].tolist(), b[close].tolist(), d2[close].tolist()):
+            ki, kj = store_name_key(cands[i].get("title") or ""), store_name_key(cands[j].get("title") or "")
+            if _same_store_name(ki, kj) or ((not ki or not kj) and dd <= RANK_DEDUPE_UNNAMED_M**2):
+                union(i, j)
+        by_place: Dict[str, int] = {}
+        for i, c in enumerate(cands):
+            pid = c.get("place_id")
+            if pid: union(i, by_place.setdefault(pid, i))
+
+        groups: Dict[int, List[int]] = {}
+        for i in range(n): groups.setdefault(find(i), []).append(i)
+        out = []
+        for members in groups.values():
+            best = max(members, key=lambda i: (_completeness(cands[i]), -dist[i]))
+            merged = dict(cands[best])
+            for i in members:
+                for k, v in cands[i].items():
+                    if v and not merged.get(k): merged[k] = v
+            merged["distance_km"] = round(float(dist[best]), 1)
+            merged["sources"] = frozenset().union(*(_source_ids(cands[i]) for i in members))
+            out.append((float(dist[best]), best, merged))
+        out.sort(key=lambda x: x[:2])
+    RANK_CANDIDATES_TOTAL.inc(n=n); RANK_DUPLICATES_TOTAL.inc(n=n - len(out))
+    return [m for _, _, m in out[:limit]]
+
+OSRM_FLIGHT = SingleFlight("osrm")
+
+def _osrm_get(url: str, params: Dict[str, str], stage: str) -> Dict[str, Any]:
+    with STAGE_SECONDS.time(stage):
+        r = HTTP.get(url, params=params, timeout=25)
+    r.raise_for_status(); return r.json()
+
 def osrm_route(user_lat: float, user_lng: float, store_lat: float, store_lng: float) -> Optional[Dict[str, Any]]:
-    url = f"https://router.project-osrm.org/route/v1/driving/{user_lng},{user_lat};{store_lng},{store_lat}"
+    url = f"{OSRM_URL}/route/v1/driving/{user_lng},{user_lat};{store_lng},{store_lat}"
     params = {"overview":"full","geometries":"geojson"}
     try:
-        r = requests.get(url, params=params, timeout=25)
-        r.raise_for_status(); js = r.json(); routes = js.get("routes") or []
+        js = OSRM_FLIGHT.do(url, _osrm_get, url, params, "osrm_route"); routes = js.get("routes") or []
         if not routes: return None
         route = routes[0]
         return {"distance_km": round(route.get("distance",0)/1000.0, 1),
                 "duration_min": round(route.get("duration",0)/60.0),
                 "geometry": route.get("geometry", {}).get("coordinates") or []}
     except Exception as e:
-        print("OSRM_ERROR:", e); return None
-
-def compute_top_routes(lat: float, lng: float, user_query: str, info: Optional[Dict[str,Any]], topn: int = 3) -> List[Dict[str, Any]]:
-    """Retorna até topn rotas p/ lojas mais próximas; inclui site/maps_url das lojas do mapa."""
-    intent = detect_intent(user_query, info)
-    anchor = INTENT_ANCHOR[intent]
-    allow_cats = INTENT_CATS[intent]
-    blacklist = BLACKLIST_BY_INTENT[intent]
-
-    routes: List[Dict[str, Any]] = []
-
+        log_error("OSRM", e); return None
+
+def osrm_table(user_lat: float, user_lng: float, dests: List[Tuple[float, float]]) -> Optional[List[Optional[Dict[str, Any]]]]:
+    """Distância/tempo de carro do usuário até cada (lat, lng) de dests numa única chamada /table.
+    Devolve lista alinhada com dests (None = sem rota) ou None se a chamada falhar."""
+    if not dests: return []
+    coords = ";".join([f"{user_lng},{user_lat}"] + [f"{d[1]},{d[0]}" for d in dests])
+    url = f"{OSRM_URL}/table/v1/driving/{coords}"
+    params = {"sources":"0","destinations":";".join(str(k) for k in range(1, len(dests)+1)),
+              "annotations":"distance,duration"}
+    try:
+        js = OSRM_FLIGHT.do(url, _osrm_get, url, params, "osrm_table")
+        dists = (js.get("distances") or [[]])[0]; durs = (js.get("durations") or [[]])[0]
+        if len(dists) != len(dests): return None
+        out = []
+        for k, d in enumerate(dists):
+            if d is None: out.append(None); continue
+            dur = durs[k] if k < len(durs) and durs[k] is not None else 0
+            out.append({"distance_km": round(d/1000.0, 1), "duration_min": round(dur/60.0)})
+        return out
+    except Exception as e:
+        log_error("OSRM_TABLE", e); return None
+
+def maps_search_for_intent(intent: str, lat: float, lng: float) -> List[Dict[str, Any]]:
+    """Lojas do mapa p/ a intenção (âncora + categorias + blacklist).
+    Usa o índice local quando a região já está coberta; senão busca no SerpApi e alimenta o índice."""
+    if POI_INDEX:
+        local = POI_INDEX.nearby(intent, lat, lng)
+        if local is not None: return local
     try:
-        res = serpapi_maps_search_anchor_only(anchor, lat, lng, allow_cats, blacklist)
+        res = serpapi_maps_search_anchor_only(INTENT_ANCHOR[intent], lat, lng, INTENT_CATS[intent], BLACKLIST_BY_INTENT[intent])
     except Exception as e:
-        print("MAPS_SEARCH_ERROR:", e); res = []
+        log_error("MAPS_SEARCH", e); return []
+    if POI_INDEX and res:
+        POI_INDEX.add(intent, res, "serpapi"); POI_INDEX.mark_covered(intent, lat, lng)
+    return res
+
+def nominatim_candidates(anchor: str, lat: float, lng: float, strict: bool = False) -> List[Dict[str, Any]]:
+    """Lugares do OSM no formato das lojas do mapa (fallback quando o SerpApi não basta).
+    Falhas viram [] (com strict=True, a exceção sobe p/ quem chamou)."""
+    cands = []
+    try:
+        for place in nominatim_search(anchor, lat, lng, limit=10, strict=strict):
+            try:
+                slat = float(place["lat"]); slng = float(place["lon"])
+            except Exception:
+                continue
+            name = place.get("display_name") or anchor
+            cands.append({"title": name, "address": name, "lat": slat, "lng": slng, "website": "",
+                          "maps_url": f"https://www.google.com/maps/search/?api=1&query={slat}%2C{slng}"})
+    except Exception as e:
+        if strict: raise
+        log_error("FALLBACK_OSM", e)
+    if POI_INDEX and cands and anchor in INTENT_BY_ANCHOR:
+        POI_INDEX.add(INTENT_BY_ANCHOR[anchor], cands, "osm")
+    return cands
+
+# Nominatim especulativo: começa junto com a busca no mapa, em vez de só depois que o /table mostra que faltam lojas
+NOMINATIM_SPECULATE = os.getenv("NOMINATIM_SPECULATE", "adaptive").strip().lower()       # always | adaptive | never
+NOMINATIM_SPECULATE_MIN_RATE = float(os.getenv("NOMINATIM_SPECULATE_MIN_RATE", "0.3"))   # adaptive: taxa recente de fallback
+NOMINATIM_SPECULATE_PRECISION = int(os.getenv("NOMINATIM_SPECULATE_PRECISION", "5"))    # célula das taxas (geohash 5 ≈ 5 km)
+NOMINATIM_SPECULATE_ALPHA = float(os.getenv("NOMINATIM_SPECULATE_ALPHA", "0.3"))         # peso da busca mais recente
+NOMINATIM_SPECULATE_CELLS = int(os.getenv("NOMINATIM_SPECULATE_CELLS", "10000"))
+
+class NominatimSpeculation:
+    """
+    Decide se o Nominatim deve ser disparado junto com a busca no mapa.
+    always/never fixam a decisão; adaptive especula onde a fração recente de buscas que precisaram do OSM
+    (média móvel por intenção e célula geohash; célula sem histórico usa a da intenção) passa de min_rate.
+    """
+    def __init__(self, policy: str, min_rate: float, precision: int, alpha: float, max_cells: int):
+        self.policy = policy if policy in ("always", "adaptive", "never") else "adaptive"
+        self.min_rate, self.precision, self.alpha, self.max_cells = min_rate, precision, alpha, max(1, max_cells)
+        self._cells: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._intents: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.started = self.skipped = 0
+
+    def _rate(self, intent: str, cell: str) -> Optional[float]:
+        with self._lock:
+            rate = self._cells.get((intent, cell))
+            return self._intents.get(intent) if rate is None else rate
+
+    def should(self, intent: str, lat: float, lng: float) -> bool:
+        if self.policy == "never": go = False
+        elif self.policy == "always": go = True
+        else:
+            rate = self._rate(intent, geohash_encode(lat, lng, self.precision))
+            go = rate is not None and rate >= self.min_rate
+        with self._lock:
+            if go: self.started += 1
+            else: self.skipped += 1
+        return go
+
+    def record(self, intent: str, lat: float, lng: float, needed: bool) -> None:
+        """Desfecho de uma busca: precisou (ou não) do OSM p/ completar as lojas."""
+        key = (intent, geohash_encode(lat, lng, self.precision)); x = 1.0 if needed else 0.0
+        with self._lock:
+            old = self._cells.get(key)
+            self._cells[key] = x if old is None else old + self.alpha * (x - old)
+            self._cells.move_to_end(key)
+            while len(self._cells) > self.max_cells: self._cells.popitem(last=False)
+            old = self._intents.get(intent)
+            self._intents[intent] = x if old is None else old + self.alpha * (x - old)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"policy": self.policy, "min_rate": self.min_rate, "started": self.started, "skipped": self.skipped,
+                    "cells": len(self._cells), "intent_rates": {k: round(v, 3) for k, v in self._intents.items()}}
+
+OSM_SPECULATION = NominatimSpeculation(NOMINATIM_SPECULATE, NOMINATIM_SPECULATE_MIN_RATE, NOMINATIM_SPECULATE_PRECISION,
+                                       NOMINATIM_SPECULATE_ALPHA, NOMINATIM_SPECULATE_CELLS)
+register_stats("nominatim_speculation", OSM_SPECULATION.stats)
+
+def speculate_nominatim(intent: str, lat: float, lng: float) -> Optional[Future]:
+    """Dispara nominatim_candidates em paralelo se OSM_SPECULATION mandar; roda com prioridade
+    "speculative" (só com folga no limite de taxa do Nominatim, sem fila). None se não especulou."""
+    if not OSM_SPECULATION.should(intent, lat, lng): return None
+    def run():
+        with request_priority("speculative"):
+            return nominatim_candidates(INTENT_ANCHOR[intent], lat, lng, strict=True)
+    return IO_POOL.submit(bind_context(run))
+
+def discard_speculation(osm: Optional[Future]) -> None:
+    """Especulação que não foi necessária: cancela se ainda está na fila, senão só ignora o resultado."""
+    if osm is not None: NOMINATIM_SPECULATIVE_TOTAL.inc("cancelled" if osm.cancel() else "ignored")
+
+def _speculated_places(osm: Future) -> Optional[List[Dict[str, Any]]]:
+    """Resultado da especulação (espera até o prazo); None se falhou ou foi descartada pelo limite de taxa."""
+    left = deadline_remaining()
+    try:
+        places = osm.result(timeout=None if left is None else max(0.0, left))
+    except RateLimited:
+        NOMINATIM_SPECULATIVE_TOTAL.inc("shed"); return None
+    except Exception as e:
+        log_error("NOMINATIM_SPECULATIVE", e)
+        NOMINATIM_SPECULATIVE_TOTAL.inc("failed"); return None
+    NOMINATIM_SPECULATIVE_TOTAL.inc("used")
+    return places
+
+def rank_by_driving(lat: float, lng: float, cands: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]]:
+    """Ordena candidatos pela distância de carro (uma chamada /table); descarta os sem rota.
+    Se o /table falhar, ordena pela distância em linha reta."""
+    if not cands: return []
+    table = osrm_table(lat, lng, [(c["lat"], c["lng"]) for c in cands])
+    if table is None:
+        FALLBACKS_TOTAL.inc("haversine")
+        return [(c, None) for _, c in nearest_first(lat, lng, cands, math.inf)]
+    ranked = [(c, est) for c, est in zip(cands, table) if est is not None]
+    ranked.sort(key=lambda x: x[1]["distance_km"])
+    return ranked
+
+def routes_from_places(lat: float, lng: float, anchor: str, res: List[Dict[str, Any]], topn: int = 3,
+                       osm: Optional[Future] = None) -> List[Dict[str, Any]]:
+    """
+    As topn lojas do mapa (res) mais próximas de carro, completando com Nominatim se faltar.
+    rank_candidates funde duplicatas e escolhe as topn*3 mais próximas em linha reta; um /table
+    ranqueia essas de carro e já dá distância/tempo; a geometria fica p/ /api/route (route_url),
+    que o carrossel busca só p/ a rota exibida e a seguinte.
+    Se o /table falhar, distância em linha reta e duration_min None.
+    osm: Nominatim já disparado por speculate_nominatim (usado se faltarem lojas, descartado se não).
+    """
+    pool = max(topn*3, topn)
+    cands = rank_candidates(lat, lng, res, limit=pool)
+    ordered = rank_by_driving(lat, lng, cands)
+    needed = len(ordered) < topn
+    if anchor in INTENT_BY_ANCHOR: OSM_SPECULATION.record(INTENT_BY_ANCHOR[anchor], lat, lng, needed)
+    if needed:
+        FALLBACKS_TOTAL.inc("nominatim")
+        places = _speculated_places(osm) if osm is not None else None
+        if places is None: places = nominatim_candidates(anchor, lat, lng)
+        # lugares do OSM que são lojas já candidatas são fundidos a elas e não vão de novo ao /table
+        # (pelo grupo: a representante pode passar a ser o lugar do OSM, com outras coordenadas)
+        seen = frozenset().union(*(c["sources"] for c in cands))
+        more = rank_candidates(lat, lng, cands + places, limit=pool)
+        ordered += rank_by_driving(lat, lng, [c for c in more if c["sources"].isdisjoint(seen)])
+    else:
+        discard_speculation(osm)
 
-    for hit in res[:max(topn*3, topn)]:
-        if len(routes) >= topn: break
-        r = osrm_route(lat, lng, hit["lat"], hit["lng"])
-        if not r: continue
+    routes: List[Dict[str, Any]] = []
+    for hit, est in ordered[:topn]:
+        if est is None:
+            est = {"distance_km": hit["distance_km"], "duration_min": None}
         routes.append({
             "store_name": hit["title"],
             "store_address": hit.get("address") or "",
             "store_lat": hit["lat"], "store_lng": hit["lng"],
             "user_lat": lat, "user_lng": lng,
-            "distance_km": r["distance_km"], "duration_min": int(r["duration_min"]),
-            "geometry": r["geometry"],
+            "distance_km": est["distance_km"], "duration_min": est["duration_min"],
+            "route_url": route_url(lat, lng, hit["lat"], hit["lng"]),
             "website": hit.get("website") or "",
             "maps_url": hit.get("maps_url") or ""
         })
+    routes.sort(key=lambda x: x["distance_km"])
+    return routes
+
+# Geometria sob demanda (/api/route): chave = célula geohash da origem + coordenadas da loja,
+# então usuários do mesmo quarteirão compartilham a mesma URL (e o cache HTTP dela)
+ROUTE_ORIGIN_PRECISION = int(os.getenv("ROUTE_ORIGIN_PRECISION", "7"))   # geohash 7 ≈ 150 m × 150 m
+ROUTE_HTTP_MAX_AGE_S = int(os.getenv("ROUTE_HTTP_MAX_AGE_S", "3600"))
+ROUTE_BUDGET_S = float(os.getenv("ROUTE_BUDGET_S", "8"))
+ROUTE_RATE_BUCKET = "osrm-route"   # balde de RATE_LIMITS p/ as chamadas ao OSRM feitas por /api/route
+# assina from/to das URLs geradas pelo /analyze: /api/route não vira um proxy aberto p/ o OSRM.
+# Sem a variável, a chave é sorteada ao importar (com preload_app, a mesma p/ todos os workers)
+ROUTE_URL_SECRET = (os.getenv("ROUTE_URL_SECRET", "").strip() or secrets.token_hex(32)).encode()
+_GEOHASH_RE = re.compile(r"^[0-9b-hjkmnp-z]{%d}$" % ROUTE_ORIGIN_PRECISION)
+
+def _route_sig(cell: str, to: str) -> str:
+    return hmac.new(ROUTE_URL_SECRET, f"{cell}|{to}".encode(), hashlib.sha256).hexdigest()[:20]
+
+def route_url(lat: float, lng: float, store_lat: float, store_lng: float) -> str:
+    cell, to = geohash_encode(lat, lng, ROUTE_ORIGIN_PRECISION), f"{store_lat:.5f},{store_lng:.5f}"
+    return "/api/route?" + urlencode({"from": cell, "to": to, "sig": _route_sig(cell, to)})
+
+# Geometria das rotas: simplificação (Douglas–Peucker, tolerância pelo zoom) + polyline codificada
+ROUTE_MAP_PX = int(os.getenv("ROUTE_MAP_PX", "400"))                       # altura do mapa no carrossel
+ROUTE_SIMPLIFY_PX = float(os.getenv("ROUTE_SIMPLIFY_PX", "1.0"))           # erro máximo em pixels
+ROUTE_SIMPLIFY_ZOOM_MARGIN = int(os.getenv("ROUTE_SIMPLIFY_ZOOM_MARGIN", "2"))  # níveis de zoom além do enquadramento
+
+def route_fit_zoom(coords: List[List[float]], map_px: int = ROUTE_MAP_PX) -> int:
+    """Zoom (Web Mercator) em que o retângulo da rota cabe em map_px pixels."""
+    lngs = [p[0] for p in coords]; lats = [p[1] for p in coords]
+    lat0 = (min(lats) + max(lats)) / 2
+    span_m = max((max(lats)-min(lats)) * 111320.0, (max(lngs)-min(lngs)) * 111320.0 * math.cos(math.radians(lat0)), 1.0)
+    mpp = span_m / max(1, map_px)
+    z = math.log2(156543.03 * math.cos(math.radians(lat0)) / mpp)
+    return max(0, min(19, int(z)))
+
+def simplify_route(coords: List[List[float]], tol_m: float) -> List[List[float]]:
+    """Douglas–Peucker iterativo sobre [lng, lat], distâncias em metros (projeção local equiretangular)."""
+    n = len(coords)
+    if n < 3 or tol_m <= 0: return coords
+    kx = 111320.0 * math.cos(math.radians(coords[0][1])); ky = 110540.0
+    xy = [(p[0]*kx, p[1]*ky) for p in coords]
+    keep = [False] * n; keep[0] = keep[-1] = True
+    stack = [(0, n-1)]
+    tol2 = tol_m * tol_m
+    while stack:
+        a, b = stack.pop()
+        ax, ay = xy[a]; bx, by = xy[b]
+        dx, dy = bx-ax, by-ay
+        L2 = dx*dx + dy*dy
+        best, best_d = -1, tol2
+        for k in range(a+1, b):
+            px, py = xy[k]
+            if L2 == 0:
+                d = (px-ax)**2 + (py-ay)**2
+            else:
+                t = max(0.0, min(1.0, ((px-ax)*dx + (py-ay)*dy) / L2))
+                d = (px-ax-t*dx)**2 + (py-ay-t*dy)**2
+            if d > best_d: best, best_d = k, d
+        if best >= 0:
+            keep[best] = True
+            stack.append((a, best)); stack.append((best, b))
+    return [p for p, k in zip(coords, keep) if k]
+
+def polyline_encode(coords: List[List[float]], precision: int = 5) -> str:
+    """Encoded Polyline (Google) a partir de [lng, lat] (GeoJSON); saída na ordem lat, lng."""
+    f = 10 ** precision
+    out, plat, plng = [], 0, 0
+    for lng, lat in coords:
+        ilat, ilng = int(round(lat*f)), int(round(lng*f))
+        for v in (ilat - plat, ilng - plng):
+            v = ~(v << 1) if v < 0 else (v << 1)
+            while v >= 0x20:
+                out.append(chr((0x20 | (v & 0x1f)) + 63)); v >>= 5
+            out.append(chr(v + 63))
+        plat, plng = ilat, ilng
+    return "".join(out)
+
+def display_geometry(coords: List[List[float]]) -> List[List[float]]:
+    """Geometria OSRM simplificada com tolerância de ROUTE_SIMPLIFY_PX no zoom de exibição."""
+    if not coords: return []
+    z = route_fit_zoom(coords) + ROUTE_SIMPLIFY_ZOOM_MARGIN
+    lat0 = coords[len(coords)//2][1]
+    tol_m = ROUTE_SIMPLIFY_PX * 156543.03 * math.cos(math.radians(lat0)) / (2 ** z)
+    return simplify_route(coords, tol_m)
+
+class PayloadStats:
+    """Bytes de geometria por rota calculada no OSRM: GeoJSON bruto × polyline enviada."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.responses = self.raw_bytes = self.sent_bytes = 0
+        self.last: Optional[Dict[str, int]] = None
+
+    def observe(self, raw: int, sent: int):
+        with self._lock:
+            self.responses += 1; self.raw_bytes += raw; self.sent_bytes += sent
+            self.last = {"raw_bytes": raw, "sent_bytes": sent}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"responses": self.responses, "raw_bytes": self.raw_bytes, "sent_bytes": self.sent_bytes,
+                    "reduction": round(1 - self.sent_bytes/self.raw_bytes, 3) if self.raw_bytes else None,
+                    "last": self.last}
+
+GEOMETRY_STATS = PayloadStats()
+register_stats("route_geometry", GEOMETRY_STATS.stats)
+
+# Cache de rotas: de um mesmo quarteirão ao mesmo mercado a rota quase não muda
+ROUTE_CACHE_MAX = int(os.getenv("ROUTE_CACHE_MAX", "20000"))                          # entradas em memória
+ROUTE_CACHE_MAX_BYTES = int(os.getenv("ROUTE_CACHE_MAX_BYTES", str(32*1024*1024)))   # teto de memória (aprox.)
+ROUTE_CACHE_TTL_S = float(os.getenv("ROUTE_CACHE_TTL_S", "86400"))
+
+class RouteCache:
+    """
+    Rotas por (célula geohash da origem, lat/lng da loja com 5 casas) → (distance_km, duration_min, geometria).
+    A geometria já simplificada fica num array('f') plano [lng, lat, lng, lat, ...]: 8 bytes por ponto,
+    contra ~130 de uma lista de listas de floats. Despejo LRU por número de entradas e por bytes, TTL.
+    Só em memória, de propósito: chave e geometria revelam de onde o usuário partiu, e isso não vai p/ disco.
+    """
+    ENTRY_OVERHEAD = 240   # bytes por entrada além do array (chave, tupla, nó do OrderedDict), aproximado
+
+    def __init__(self, maxsize: int, max_bytes: int, ttl_s: float):
+        self.maxsize, self.max_bytes, self.ttl_s = max(1, maxsize), max_bytes, ttl_s
+        self._data: "OrderedDict[Tuple[str, float, float], Tuple[float, float, int, array]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = self.points = 0
+        self.hits = self.misses = self.evictions = 0
+
+    @staticmethod
+    def key(cell: str, store_lat: float, store_lng: float) -> Tuple[str, float, float]:
+        return (cell, round(store_lat, 5), round(store_lng, 5))
+
+    def _entry_bytes(self, geom: array) -> int:
+        return sys.getsizeof(geom) + self.ENTRY_OVERHEAD
+
+    def _drop(self, key) -> None:
+        _exp, _d, _m, geom = self._data.pop(key)
+        self.bytes -= self._entry_bytes(geom); self.points -= len(geom) // 2
+
+    def _mem_put(self, key, exp: float, distance_km: float, duration_min: int, geom: array) -> None:
+        with self._lock:
+            if key in self._data: self._drop(key)
+            self._data[key] = (exp, distance_km, duration_min, geom)
+            self.bytes += self._entry_bytes(geom); self.points += len(geom) // 2
+            while len(self._data) > 1 and (len(self._data) > self.maxsize or self.bytes > self.max_bytes):
+                self._drop(next(iter(self._data))); self.evictions += 1
+
+    def get(self, key) -> Optional[Tuple[float, int, array]]:
+        """(distance_km, duration_min, geometria plana) ou None."""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] >= now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1:]
+            if item is not None: self._drop(key)
+            self.misses += 1
+        return None
+
+    def put(self, key, distance_km: float, duration_min: int, coords: List[List[float]]) -> Tuple[float, int, array]:
+        geom = array("f", [v for p in coords for v in p[:2]])
+        self._mem_put(key, time.monotonic() + self.ttl_s, distance_km, duration_min, geom)
+        return distance_km, duration_min, geom
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"size": len(self._data), "maxsize": self.maxsize, "ttl_s": self.ttl_s,
+                    "bytes": self.bytes, "max_bytes": self.max_bytes, "points": self.points,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_ratio": round(self.hits/total, 3) if total else None}
+
+ROUTE_CACHE = RouteCache(ROUTE_CACHE_MAX, ROUTE_CACHE_MAX_BYTES, ROUTE_CACHE_TTL_S)
+register_stats("route_cache", ROUTE_CACHE.stats)
+app.jinja_env.globals["route_cache_hours"] = max(1, round(ROUTE_CACHE_TTL_S / 3600))   # aviso de privacidade da página
+
+def route_geometry(cell: str, store_lat: float, store_lng: float) -> Optional[Dict[str, Any]]:
+    """Rota do centro da célula de origem até a loja (distância, tempo e polyline simplificada), via ROUTE_CACHE."""
+    key = RouteCache.key(cell, store_lat, store_lng)
+    hit = ROUTE_CACHE.get(key); raw_bytes = 0
+    if hit is None:
+        try:
+            RATE_LIMITER.acquire(ROUTE_RATE_BUCKET)
+        except RateLimited as e:
+            log_error("ROUTE", e); return None
+        lat, lng = geohash_center(cell)
+        r = osrm_route(lat, lng, store_lat, store_lng)
+        if not r: return None
+        hit = ROUTE_CACHE.put(key, r["distance_km"], int(r["duration_min"]), display_geometry(r["geometry"]))
+        raw_bytes = len(json.dumps(r["geometry"]))
+    distance_km, duration_min, geom = hit
+    polyline = polyline_encode(zip(geom[0::2], geom[1::2]))
+    if raw_bytes: GEOMETRY_STATS.observe(raw_bytes, len(json.dumps(polyline)))
+    return {"distance_km": distance_km, "duration_min": duration_min, "polyline": polyline}
 
-    if len(routes) < topn:
+def compute_top_routes(lat: float, lng: float, user_query: str, info: Optional[Dict[str,Any]], topn: int = 3) -> List[Dict[str, Any]]:
+    """Retorna até topn rotas p/ lojas mais próximas; inclui site/maps_url das lojas do mapa."""
+    intent = detect_intent(user_query, info)
+    osm = speculate_nominatim(intent, lat, lng)
+    res = maps_search_for_intent(intent, lat, lng)
+    return routes_from_places(lat, lng, INTENT_ANCHOR[intent], res, topn, osm=osm)
+
+# =============== Pipeline concorrente (/analyze) ===============
+
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "16"))
+PIPELINE_LOG_TIMINGS = os.getenv("PIPELINE_LOG_TIMINGS", "0") == "1"   # 1 = uma linha JSON por /analyze no stdout (depuração)
+PIPELINE_POOL = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline")
+# Chamadas "folha" (uma requisição HTTP cada); nunca esperam outras tarefas, então não há deadlock
+IO_WORKERS = int(os.getenv("IO_WORKERS", "32"))
+IO_POOL = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+
+# Folga além do prazo ao esperar uma etapa (as chamadas já cortam no prazo; isto cobre o processamento final)
+PIPELINE_DEADLINE_GRACE_S = float(os.getenv("PIPELINE_DEADLINE_GRACE_S", "0.25"))
+# Rotas só começam se ainda restar este tanto do orçamento
+ROUTES_MIN_BUDGET_S = float(os.getenv("ROUTES_MIN_BUDGET_S", "1.0"))
+
+BLOCKED_MSG = "Não posso ajudar a localizar, comprar ou traçar rotas para itens ilegais ou perigosos."
+
+class StageTimings:
+    """Início/duração/CPU de cada etapa (ms relativos ao início da requisição) p/ ver o caminho crítico."""
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages: Dict[str, Dict[str, float]] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter(); cpu0 = time.thread_time()
         try:
-            cands = []
-            for place in nominatim_search(anchor, lat, lng, limit=10):
-                try:
-                    slat = float(place["lat"]); slng = float(place["lon"])
-                except Exception:
-                    continue
-                cands.append({"name": place.get("display_name") or anchor, "lat": slat, "lng": slng,
-                              "d": haversine_km(lat, lng, slat, slng)})
-            cands.sort(key=lambda x: x["d"])
-            for c in cands:
-                if len(routes) >= topn: break
-                r = osrm_route(lat, lng, c["lat"], c["lng"])
-                if not r: continue
-                maps_url = f"https://www.google.com/maps/search/?api=1&query={c['lat']}%2C{c['lng']}"
-                routes.append({
-                    "store_name": c["name"], "store_address": c["name"],
-                    "store_lat": c["lat"], "store_lng": c["lng"],
-                    "user_lat": lat, "user_lng": lng,
-                    "distance_km": r["distance_km"], "duration_min": int(r["duration_min"]),
-                    "geometry": r["geometry"],
-                    "website": "",
-                    "maps_url": maps_url
-                })
+            yield
+        finally:
+            end = time.perf_counter(); cpu = time.thread_time() - cpu0
+            STAGE_SECONDS.observe(end - start, name)
+            with self._lock:
+                self.stages[name] = {"start_ms": round((start-self.t0)*1000, 1),
+                                     "end_ms": round((end-self.t0)*1000, 1),
+                                     "dur_ms": round((end-start)*1000, 1),
+                                     "cpu_ms": round(cpu*1000, 1)}
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = dict(sorted(self.stages.items(), key=lambda kv: kv[1]["start_ms"]))
+        return {"total_ms": round((time.perf_counter()-self.t0)*1000, 1), "stages": stages}
+
+def _submit(timings: StageTimings, name: str, fn, *args, **kw) -> Future:
+    def run():
+        with timings.stage(name):
+            return fn(*args, **kw)
+    return PIPELINE_POOL.submit(bind_context(run))
+
+def _then(fut: Future, timings: StageTimings, name: str, fn) -> Future:
+    """Encadeia fn(resultado de fut) no pool assim que fut terminar, sem bloquear nenhuma thread."""
+    fn = bind_context(fn)   # o callback roda na thread de quem terminou fut: leva o prazo de quem encadeou
+    out: Future = Future()
+    def relay(f: Future):
+        if f.exception() is not None: out.set_exception(f.exception())
+        else: out.set_result(f.result())
+    def start(f: Future):
+        if f.exception() is not None:
+            out.set_exception(f.exception()); return
+        _submit(timings, name, fn, f.result()).add_done_callback(relay)
+    fut.add_done_callback(start)
+    return out
+
+def compress_upload(src: Union[bytes, BinaryIO]) -> Tuple[bytes, bytes, Optional[int], Optional[bytes]]:
+    """Foto (bytes ou o stream do upload, que é fechado aqui) → (JPEG p/ o modelo, miniatura, dHash,
+    JPEG pequeno da visão adaptativa ou None)."""
+    fp = io.BytesIO(src) if isinstance(src, (bytes, bytearray)) else src
+    try:
+        img = prepare_upload(fp, max_side=UPLOAD_MAX_SIDE, quality=82, thumb_side=360, thumb_quality=70,
+                             low_side=VISION_LOW_SIDE if VISION_MODE == "adaptive" else None, low_quality=VISION_LOW_QUALITY)
+    finally:
+        fp.close()
+    return img["jpeg"], img["thumb"], img["phash"], img["low"]
+
+def build_query(user_q: str, info: Optional[Dict[str, Any]]) -> str:
+    q_parts = []
+    for k in ("product_name","brand","model","category","suggested_query"):
+        v = (info or {}).get(k)
+        if v and isinstance(v, str): q_parts.append(v)
+    if (info or {}).get("keywords"): q_parts.extend(info["keywords"][:5])
+    if user_q: q_parts.insert(0, user_q)
+    return " ".join(dict.fromkeys([p for p in q_parts if p])) or ("comprar " + datetime.now().strftime("produto %Y"))
+
+def stores_from_routes(routes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """"Onde comprar" a partir das lojas do mapa (garante correspondência com as rotas)."""
+    out = []
+    for r in routes:
+        url = (r.get("website") or "").strip() or (r.get("maps_url") or "").strip()
+        out.append({
+            "title": r["store_name"],
+            "url": url,
+            "right": f"~{r['distance_km']} km",
+            "domain": parse_domain(url),
+            "snippet": f"~{r['duration_min']} min (rota)" if r.get("duration_min") is not None else "distância em linha reta"
+        })
+    return out
+
+def run_analyze_pipeline(user_q: str, raw_image: Optional[Union[bytes, BinaryIO]], resolved: Optional[Tuple[float, float, str]],
+                         emit=None, budget_s: float = ANALYZE_BUDGET_S) -> Dict[str, Any]:
+    """
+    Executa /analyze com etapas independentes em paralelo:
+    - compressão → visão → (lojas online, busca no mapa) encadeadas como futures;
+    - se a intenção já aparece no texto digitado, a busca no mapa começa sem esperar a visão;
+    - onde costuma faltar loja, o Nominatim começa junto com a busca no mapa (speculate_nominatim);
+    - rotas (estimativas do OSRM /table) encadeadas na busca no mapa; a geometria vem depois, de /api/route.
+    Tudo dentro de um prazo de budget_s: esgotado, a resposta sai com o que ficou pronto
+    (lojas online viram build_store_links, rotas são puladas).
+    emit(evento, dados), se informado, recebe cada resultado assim que fica pronto
+    (product, intent, stores, routes, shops, policy, done) — pode ser chamado de outras threads.
+    """
+    with request_deadline(budget_s):
+        return _run_analyze_pipeline(user_q, raw_image, resolved, emit)
+
+def _run_analyze_pipeline(user_q: str, raw_image: Optional[Union[bytes, BinaryIO]], resolved: Optional[Tuple[float, float, str]],
+                          emit) -> Dict[str, Any]:
+    t = StageTimings()
+    out: Dict[str, Any] = {"info": None, "query": user_q or "", "thumb": None, "policy_msg": None,
+                           "extra_shops": None, "provider": "", "routes": [], "timings": None}
+
+    dropped = set()   # eventos de etapas abandonadas por prazo (ou tudo, depois do done)
+
+    def send(event: str, data: Any):
+        if emit is None or event in dropped or "*" in dropped: return
+        try: emit(event, data)
+        except Exception as e: log_error("EMIT", e)
+
+    def finish() -> Dict[str, Any]:
+        out["timings"] = t.as_dict()
+        if PIPELINE_LOG_TIMINGS:
+            print("PIPELINE_TIMINGS:", json.dumps(out["timings"]))
+        send("done", {"timings": out["timings"]})
+        dropped.add("*")
+        return out
+
+    def result(fut: Future):
+        """Resultado da etapa dentro do prazo (FutureTimeout se o orçamento acabar antes)."""
+        left = deadline_remaining()
+        return fut.result(timeout=None if left is None else max(0.0, left) + PIPELINE_DEADLINE_GRACE_S)
+
+    # Texto digitado já proibido: nada é disparado
+    if user_q and is_prohibited(user_q):
+        out["policy_msg"] = BLOCKED_MSG
+        send("policy", {"message": BLOCKED_MSG})
+        return finish()
+
+    u_lat = u_lng = None
+    if resolved:
+        u_lat, u_lng = float(resolved[0]), float(resolved[1])
+
+    def blocked(query: str) -> bool:
+        return not user_q and is_prohibited(query)
+
+    def maps_stage(intent: str):
+        send("intent", {"intent": intent, "anchor": INTENT_ANCHOR[intent]})
+        osm = speculate_nominatim(intent, u_lat, u_lng)
+        res = maps_search_for_intent(intent, u_lat, u_lng)
+        send("stores", [{"title": p["title"], "address": p.get("address") or "", "lat": p["lat"], "lng": p["lng"],
+                         "website": p.get("website") or "", "maps_url": p.get("maps_url") or "",
+                         "distance_km": p["distance_km"]} for p in rank_candidates(u_lat, u_lng, res, limit=9)])
+        return intent, res, osm
+
+    text_intent = match_intent(user_q, None) if user_q else None
+    maps_fut: Optional[Future] = None
+    if resolved and (text_intent or not raw_image):
+        maps_fut = _submit(t, "maps", maps_stage, text_intent or "grocery")
+
+    if raw_image:
+        image_fut = _submit(t, "image", compress_upload, raw_image)
+        def vision(imgs):
+            info = identify_product_cached(imgs[0], imgs[2], user_locale="pt-BR", user_hint=user_q, low=imgs[3])
+            send("product", info)
+            return info
+        vision_fut = _then(image_fut, t, "vision", vision)
+        query_fut = _then(vision_fut, t, "query", lambda info: build_query(user_q, info))
+    else:
+        image_fut = vision_fut = None
+        query_fut = Future(); query_fut.set_result(user_q or "")
+
+    def shops_stage(q: str):
+        if blocked(q): return None
+        shops, provider = find_shops(q or "produto", user_locale="pt-BR")
+        if detect_intent(q, vision_fut.result() if vision_fut else None) in {"auto_service","beauty"}:
+            shops = None  # para serviços locais, não faz sentido listar shopping
+        send("shops", {"shops": shops, "provider": provider, "query": q})
+        return shops, provider
+    shops_fut = _then(query_fut, t, "shops", shops_stage)
+
+    if resolved and maps_fut is None:
+        def maps_after_vision(q):
+            if blocked(q): return None, [], None
+            return maps_stage(detect_intent(q, vision_fut.result()))
+        maps_fut = _then(query_fut, t, "maps", maps_after_vision)
+    routes_fut = None
+    if maps_fut is not None:
+        def routes_stage(found):
+            intent, res, osm = found
+            if intent is None: return []
+            left = deadline_remaining()
+            if left is not None and left < ROUTES_MIN_BUDGET_S:
+                FALLBACKS_TOTAL.inc("routes_skipped"); discard_speculation(osm)
+                send("routes", {"routes": [], "stores": []})
+                return []
+            routes = routes_from_places(u_lat, u_lng, INTENT_ANCHOR[intent], res, topn=3, osm=osm)
+            send("routes", {"routes": routes, "stores": stores_from_routes(routes)})
+            return routes
+        routes_fut = _then(maps_fut, t, "routes", routes_stage)
+
+    if image_fut is not None:
+        try:
+            out["thumb"] = result(image_fut)[1]
+        except Exception as e:
+            log_error("IMAGE", e)
+    if vision_fut is not None:
+        try:
+            out["info"] = result(vision_fut)
+        except Exception as e:
+            log_error("VISION", e)
+    query = user_q or ""
+    if vision_fut is None or out["info"] is not None:
+        try:
+            query = result(query_fut)
         except Exception as e:
-            print("FALLBACK_OSM_ERROR:", e)
+            log_error("QUERY", e)
+    out["query"] = query
 
-    routes.sort(key=lambda x: x["distance_km"])
-    return routes[:topn]
+    if blocked(query):
+        out["policy_msg"] = BLOCKED_MSG
+        send("policy", {"message": BLOCKED_MSG})
+        return finish()
+
+    try:
+        out["extra_shops"], out["provider"] = result(shops_fut)
+    except Exception as e:
+        log_error("SHOPS", e); FALLBACKS_TOTAL.inc("store_links")
+        out["extra_shops"], out["provider"] = build_store_links(query or "produto"), "links"
+        send("shops", {"shops": out["extra_shops"], "provider": "links", "query": query})
+        dropped.add("shops")
+
+    if routes_fut is not None:
+        try:
+            out["routes"] = result(routes_fut)
+        except Exception as e:
+            log_error("ROUTES", e)
+            if isinstance(e, FutureTimeout): FALLBACKS_TOTAL.inc("routes_skipped")
+            send("routes", {"routes": [], "stores": []})
+            dropped.add("routes")
+
+    return finish()
+
+# =============== Página e arquivos estáticos ===============
+
+# CSS/JS da página ficam em static/ e são servidos com o hash do conteúdo no nome (/assets/app.<hash>.css):
+# cache de um ano + immutable, ETag p/ revalidação; mudar o arquivo muda a URL que o template gera.
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STATIC_ASSETS = ("app.css", "app.js")
+ASSET_MAX_AGE_S = int(os.getenv("ASSET_MAX_AGE_S", str(365*24*3600)))
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))   # menores que isso vão sem compressão
+HTML_GZIP_LEVEL = int(os.getenv("HTML_GZIP_LEVEL", "6"))
+HTML_BROTLI_QUALITY = int(os.getenv("HTML_BROTLI_QUALITY", "5"))
+
+def compress_bytes(body: bytes, encoding: str, best: bool = False) -> bytes:
+    """br ou gzip; best=True (assets, comprimidos uma vez só) usa o nível máximo."""
+    if encoding == "br": return brotli.compress(body, quality=11 if best else HTML_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=9 if best else HTML_GZIP_LEVEL, mtime=0)
+
+def pick_encoding(size: int) -> str:
+    """br > gzip > identidade, conforme o Accept-Encoding da requisição atual."""
+    if size < COMPRESS_MIN_BYTES: return ""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted.quality("br") > 0: return "br"
+    if accepted.quality("gzip") > 0: return "gzip"
+    return ""
+
+class Asset:
+    """Arquivo de static/ lido uma vez: hash do conteúdo e versões pré-comprimidas."""
+    def __init__(self, name: str):
+        with open(os.path.join(STATIC_DIR, name), "rb") as fh: self.body = fh.read()
+        self.name = name
+        self.digest = hashlib.sha256(self.body).hexdigest()[:12]
+        stem, ext = os.path.splitext(name)
+        self.url_name = f"{stem}.{self.digest}{ext}"
+        self.mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.encoded = {"": self.body, "gzip": compress_bytes(self.body, "gzip", best=True)}
+        if brotli is not None: self.encoded["br"] = compress_bytes(self.body, "br", best=True)
+
+ASSETS: Dict[str, Asset] = {name: Asset(name) for name in STATIC_ASSETS}
+ASSETS_BY_URL: Dict[str, Asset] = {a.url_name: a for a in ASSETS.values()}
+_ASSET_HASH_RE = re.compile(r"^(.+)\.[0-9a-f]{12}(\.[a-z0-9]+)$")
+
+def asset_url(name: str) -> str:
+    return "/assets/" + ASSETS[name].url_name
+
+app.jinja_env.globals["asset_url"] = asset_url
+
+def compress_response(resp: Response, kind: str) -> Response:
+    """Comprime o corpo já pronto (br/gzip) se o cliente aceitar; não serve p/ respostas em streaming."""
+    body = resp.get_data()
+    enc = pick_encoding(len(body))
+    resp.vary.add("Accept-Encoding")
+    if enc:
+        body = compress_bytes(body, enc)
+        resp.set_data(body); resp.headers["Content-Encoding"] = enc
+    RESPONSE_BYTES_TOTAL.inc(kind, enc or "identity", n=len(body))
+    return resp
+
+@app.route("/assets/<path:fname>", methods=["GET"])
+def assets(fname: str):
+    a = ASSETS_BY_URL.get(fname)
+    versioned = a is not None
+    if a is None:
+        # nome sem hash ou de uma versão anterior: conteúdo atual, mas sem cache longo
+        m = _ASSET_HASH_RE.match(fname)
+        a = ASSETS.get(m.group(1) + m.group(2) if m else fname)
+        if a is None: abort(404)
+    enc = pick_encoding(len(a.body))
+    if enc not in a.encoded: enc = ""
+    resp = Response(a.encoded[enc], mimetype=a.mimetype)
+    if enc: resp.headers["Content-Encoding"] = enc
+    resp.vary.add("Accept-Encoding")
+    resp.set_etag(f"{a.digest}-{enc}" if enc else a.digest)
+    if versioned:
+        resp.cache_control.public = True; resp.cache_control.max_age = ASSET_MAX_AGE_S; resp.cache_control.immutable = True
+    else:
+        resp.cache_control.no_cache = True
+    resp = resp.make_conditional(request)
+    RESPONSE_BYTES_TOTAL.inc("asset", enc or "identity", n=len(resp.get_data()))
+    return resp
 
 # =============== Flask ===============
 
+def read_analyze_inputs() -> Tuple[str, Optional[Union[bytes, BinaryIO]], str, Optional[Tuple[float, float, str]]]:
+    """Campos do /analyze (formulário multipart) ou do /api/analyze (formulário ou JSON)."""
+    src = request.get_json(silent=True) if request.is_json else None
+    src = src if isinstance(src, dict) else request.form
+    user_q = str(src.get("q") or "").strip()
+    img_b64 = str(src.get("image_base64") or "").strip()
+    thumb_b64 = str(src.get("thumb_base64") or "").strip()
+    f = request.files.get("image")
+    lat_str = src.get("lat"); lng_str = src.get("lng")
+
+    # localização do usuário (geolocalização automática)
+    resolved = None
+    if lat_str not in (None, "") and lng_str not in (None, ""):
+        try: resolved = (float(lat_str), float(lng_str), "Minha localização")
+        except: resolved = None
+
+    raw = None
+    if img_b64:
+        raw = b64_to_bytes(img_b64)
+        UPLOADS_TOTAL.inc("base64"); UPLOAD_BYTES_TOTAL.inc("base64", n=len(img_b64))
+    elif f: raw = take_upload(f)
+    return user_q, raw, thumb_b64, resolved
+
+@app.before_request
+def _start_request_timer():
+    g.t0 = time.perf_counter()
+
+@app.after_request
+def _observe_request(resp: Response) -> Response:
+    t0 = getattr(g, "t0", None)
+    if t0 is None: return resp
+    dt = time.perf_counter() - t0
+    endpoint = request.endpoint or "other"
+    REQUEST_SECONDS.observe(dt, endpoint)
+    REQUESTS_TOTAL.inc(endpoint, str(resp.status_code))
+    st = resp.headers.get("Server-Timing")
+    resp.headers["Server-Timing"] = (st + ", " if st else "") + f"total;dur={dt*1000:.1f}"
+    return resp
+
+def render_page(timings: Optional[Dict[str, Any]] = None, **ctx) -> Response:
+    """Renderiza templates/page.html (compilado uma vez pelo loader do Jinja) medindo o tempo do template;
+    com timings, anexa o Server-Timing do pipeline. O HTML sai comprimido se o cliente aceitar."""
+    t0 = time.perf_counter()
+    html = render_template("page.html", **ctx)
+    dt = time.perf_counter() - t0
+    STAGE_SECONDS.observe(dt, "render")
+    resp = Response(html, mimetype="text/html")
+    resp.headers["Server-Timing"] = server_timing(timings, render=dt*1000)
+    return compress_response(resp, "html")
+
 @app.route("/", methods=["GET"])
 def index():
-    return render_template_string(PAGE,
+    return render_page(None,
         model_name="gpt-4o-mini",
         provider="serpapi" if SERPAPI_API_KEY else ("bing" if BING_SEARCH_KEY else "links"),
         last_query=None, me_thumb=None, result=None,
         shops=None, extra_shops=None, routes=[], policy_msg=None
     )
 
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify(collect_stats())
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/analyze", methods=["POST"])
 def analyze():
-    user_q = (request.form.get("q") or "").strip()
-    img_b64 = (request.form.get("image_base64") or "").strip()
-    thumb_b64 = (request.form.get("thumb_base64") or "").strip()
-    f = request.files.get("image")
-    lat_str = request.form.get("lat"); lng_str = request.form.get("lng")
-
-    # localização do usuário (geolocalização automática)
-    resolved = None
-    if lat_str and lng_str:
-        try: resolved = (float(lat_str), float(lng_str), "Minha localização")
-        except: resolved = None
+    user_q, raw, thumb_b64, resolved = read_analyze_inputs()
+    try:
+        out = run_analyze_pipeline(user_q, raw, resolved)
+    finally:
+        release_upload(raw)
+    info, query = out["info"], out["query"]
 
-    info = None
-    query = ""
     me_thumb_dataurl = None
-
-    if img_b64 or f:
-        if img_b64:
-            raw = b64_to_bytes(img_b64)
-            jpeg = pil_compress_to_jpeg(io.BytesIO(raw), max_side=1280, quality=82)
-            thumb = pil_compress_to_jpeg(io.BytesIO(raw), max_side=360, quality=70)
-        else:
-            raw_file = f.read()
-            jpeg = pil_compress_to_jpeg(io.BytesIO(raw_file), max_side=1280, quality=82)
-            thumb = pil_compress_to_jpeg(io.BytesIO(raw_file), max_side=360, quality=70)
-
-        data_uri = "data:image/jpeg;base64," + base64.b64encode(jpeg).decode("ascii")
-        me_thumb_dataurl = "data:image/jpeg;base64," + base64.b64encode(thumb).decode("ascii")
-        if thumb_b64.startswith("data:image/"): me_thumb_dataurl = thumb_b64
-
-        info = identify_product_with_gpt4omini(data_uri, user_locale="pt-BR", user_hint=user_q)
-
-        q_parts = []
-        for k in ("product_name","brand","model","category","suggested_query"):
-            v = (info or {}).get(k)
-            if v and isinstance(v, str): q_parts.append(v)
-        if (info or {}).get("keywords"): q_parts.extend(info["keywords"][:5])
-        if user_q: q_parts.insert(0, user_q)
-        query = " ".join(dict.fromkeys([p for p in q_parts if p])) or ("comprar " + datetime.now().strftime("produto %Y"))
-    else:
-        query = user_q or ""
+    if out["thumb"]: me_thumb_dataurl = "data:image/jpeg;base64," + base64.b64encode(out["thumb"]).decode("ascii")
+    if raw and thumb_b64.startswith("data:image/"): me_thumb_dataurl = thumb_b64
 
     # Bloqueio para itens proibidos
-    if is_prohibited(user_q or query):
-        return render_template_string(PAGE,
+    if out["policy_msg"]:
+        return render_page(out["timings"],
             model_name="gpt-4o-mini",
             provider="",
             last_query=user_q if user_q else query,
             me_thumb=me_thumb_dataurl,
             result=info,
-            shops=None, extra_shops=None, routes=[], policy_msg="Não posso ajudar a localizar, comprar ou traçar rotas para itens ilegais ou perigosos."
+            shops=None, extra_shops=None, routes=[], policy_msg=out["policy_msg"]
         )
 
-    # lojas online gerais (ficam em "Outras opções online")
-    extra_shops, provider_used = find_shops(query or "produto", user_locale="pt-BR")
-    intent_now = detect_intent(query, info)
-    if intent_now in {"auto_service","beauty"}:
-        extra_shops = None  # para serviços locais, não faz sentido listar shopping
-
     # rotas + lojas do mapa
-    routes = []
-    shops_from_routes = []
-    try:
-        if resolved:
-            u_lat, u_lng, _ = resolved
-            routes = compute_top_routes(float(u_lat), float(u_lng), user_query=query, info=info, topn=3)
-            for r in routes:
-                r["user_lat"] = float(u_lat)
-                r["user_lng"] = float(u_lng)
-                # "Onde comprar" a partir das lojas do mapa (garante correspondência)
-                url = (r.get("website") or "").strip() or (r.get("maps_url") or "").strip()
-                shops_from_routes.append({
-                    "title": r["store_name"],
-                    "url": url,
-                    "right": f"~{r['distance_km']} km",
-                    "domain": parse_domain(url),
-                    "snippet": f"~{r['duration_min']} min (rota)"
-                })
-    except Exception as e:
-        print("ROUTES_ERROR:", e); routes = []
+    routes = out["routes"] if resolved else []
 
-    return render_template_string(PAGE,
+    return render_page(out["timings"],
         model_name="gpt-4o-mini",
-        provider=provider_used,
+        provider=out["provider"],
         last_query=user_q if user_q else query,
         me_thumb=me_thumb_dataurl,
         result=info,
-        shops=shops_from_routes,
-        extra_shops=extra_shops,
+        shops=stores_from_routes(routes),
+        extra_shops=out["extra_shops"],
         routes=routes,
         policy_msg=None
     )
 
+@app.route("/api/route", methods=["GET"])
+def api_route():
+    """
+    Geometria de uma rota do carrossel (só URLs geradas por route_url, assinadas):
+    ?from=<geohash da origem>&to=<lat>,<lng>&sig=<hmac>.
+    Responde {"distance_km", "duration_min", "polyline"} com cache privado (só o navegador) de ROUTE_HTTP_MAX_AGE_S.
+    Rotas fora do cache passam pelo balde ROUTE_RATE_BUCKET do limitador de taxa (prioridade "background").
+    """
+    cell = (request.args.get("from") or "").strip()
+    to = (request.args.get("to") or "").strip()
+    try:
+        slat, slng = (float(v) for v in to.split(","))
+    except ValueError:
+        slat = slng = float("nan")
+    if not _GEOHASH_RE.match(cell) or not (-90 <= slat <= 90 and -180 <= slng <= 180):
+        return jsonify({"error": "parâmetros inválidos: use from=<geohash>&to=<lat>,<lng>"}), 400
+    if not hmac.compare_digest(request.args.get("sig") or "", _route_sig(cell, to)):
+        return jsonify({"error": "assinatura inválida: use a route_url devolvida pelo /analyze"}), 403
+
+    with request_deadline(ROUTE_BUDGET_S), request_priority("background"):
+        r = route_geometry(cell, slat, slng)
+    if r is None:
+        resp = jsonify({"error": "rota indisponível"}); resp.status_code = 502
+        resp.cache_control.no_store = True
+        return resp
+    resp = jsonify(r)
+    resp.cache_control.private = True; resp.cache_control.max_age = ROUTE_HTTP_MAX_AGE_S
+    return compress_response(resp, "route")
+
+def _wants_stream() -> bool:
+    v = (request.args.get("stream") or "").lower()
+    return v in ("1", "true", "ndjson") or "application/x-ndjson" in (request.headers.get("Accept") or "")
+
+@app.route("/api/analyze", methods=["POST"])
+def api_analyze():
+    """
+    Mesmo pipeline do /analyze, em JSON. Com ?stream=1 (ou Accept: application/x-ndjson) responde
+    NDJSON: uma linha {"event": ..., "data": ...} por resultado, na ordem em que ficam prontos.
+    """
+    user_q, raw, _thumb_b64, resolved = read_analyze_inputs()
+
+    if not _wants_stream():
+        try:
+            out = run_analyze_pipeline(user_q, raw, resolved)
+        finally:
+            release_upload(raw)
+        resp = jsonify({
+            "query": out["query"], "product": out["info"], "policy_msg": out["policy_msg"],
+            "stores": stores_from_routes(out["routes"]), "routes": out["routes"],
+            "online_shops": out["extra_shops"], "provider": out["provider"],
+            "timings": out["timings"], "model": "gpt-4o-mini",
+        })
+        resp.headers["Server-Timing"] = server_timing(out["timings"])
+        return resp
+
+    events: "queue.Queue[Optional[Tuple[str, Any]]]" = queue.Queue()
+    def worker():
+        try:
+            run_analyze_pipeline(user_q, raw, resolved, emit=lambda ev, data: events.put((ev, data)))
+        except Exception as e:
+            log_error("PIPELINE", e); events.put(("error", {"message": "falha ao processar a busca"}))
+        finally:
+            release_upload(raw)
+            events.put(None)
+    threading.Thread(target=worker, name="analyze-stream", daemon=True).start()
+
+    def generate():
+        yield json.dumps({"event": "start", "data": {"query": user_q, "model": "gpt-4o-mini"}}, ensure_ascii=False) + "\n"
+        while True:
+            item = events.get()
+            if item is None: break
+            yield json.dumps({"event": item[0], "data": item[1]}, ensure_ascii=False) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# =============== Execução ===============
+
+def warm_up() -> None:
+    """Compila o template da página (matchers de termos e assets já são preparados na importação).
+    Com gunicorn (preload_app) roda uma vez no processo mestre e os workers herdam tudo no fork;
+    não abre conexões nem threads, que não sobrevivem ao fork."""
+    app.jinja_env.get_template("page.html")
+
+def shutdown() -> None:
+    """Encerramento do worker: descarta etapas ainda na fila (as em andamento terminam pelo prazo) e guarda as métricas."""
+    for pool in (PIPELINE_POOL, IO_POOL):
+        pool.shutdown(wait=False, cancel_futures=True)
+    METRICS_STORE.retire()
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=PORT, debug=True)
+    # desenvolvimento; em produção: gunicorn -c gunicorn.conf.py compras:app
+    # o reloader também observa static/ e templates/ (o hash dos assets é calculado na importação)
+    watch = [os.path.join(STATIC_DIR, n) for n in STATIC_ASSETS] + [os.path.join(app.root_path, "templates", "page.html")]
+    app.run(host="0.0.0.0", port=PORT, debug=True, extra_files=watch)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Produção:
+    gunicorn -c gunicorn.conf.py compras:app
+
+WEB_WORKERS processos × WEB_THREADS threads (gthread). O app é carregado uma vez no mestre
+(preload_app) e herdado pelos workers; caches e limites de taxa ficam nos SQLite de data/
+(MAPS_CACHE_DB, SHOP_CACHE_DB, VISION_CACHE_DB, POI_DB, RATE_LIMIT_DB), compartilhados por todos.
+SIGTERM: para de aceitar conexões e espera até WEB_GRACEFUL_TIMEOUT s pelas requisições em andamento.
+/metrics soma contadores e histogramas de todos os workers via METRICS_DB (zerado a cada início do mestre).
+"""
+
+import os, random
+
+os.environ.setdefault("METRICS_DB", "data/metrics.sqlite")   # antes do preload do app
+
+bind = f"0.0.0.0:{os.getenv('PORT', '11001')}"
+workers = int(os.getenv("WEB_WORKERS", str(min(4, os.cpu_count() or 1))))
+threads = int(os.getenv("WEB_THREADS", "16"))
+worker_class = "gthread"
+preload_app = True
+timeout = int(os.getenv("WEB_TIMEOUT", "60"))                  # > ANALYZE_BUDGET_S
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("WEB_KEEPALIVE", "5"))
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "0"))          # 0 = workers não reciclam
+max_requests_jitter = max_requests // 10
+accesslog = os.getenv("WEB_ACCESS_LOG", "-") or None
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+def on_starting(server):
+    import compras
+    compras.METRICS_STORE.clear()
+
+def when_ready(server):
+    import compras
+    compras.warm_up()
+
+def post_fork(server, worker):
+    random.seed()   # jitter dos retries diferente em cada worker
+    import compras
+    compras.METRICS_STORE.start()
+
+def worker_exit(server, worker):
+    import compras
+    compras.shutdown()
@@ -0,0 +1,374 @@
+// Dados da página renderizados pelo servidor (<script id="page-data">); o resto do arquivo é estático e fica em cache
+const PAGE_DATA = JSON.parse(document.getElementById('page-data').textContent);
+const form = document.getElementById('form');
+const q = document.getElementById('q');
+const fileInput = document.getElementById('file');
+const imgB64 = document.getElementById('image_base64');
+const latInput = document.getElementById('lat');
+const lngInput = document.getElementById('lng');
+const chip = document.getElementById('thumbChip');
+const chipImg = document.getElementById('thumbImg');
+const toast = document.getElementById('toast');
+
+// Geo automática ao carregar
+document.addEventListener('DOMContentLoaded', () => {
+  if (navigator.geolocation) {
+    navigator.geolocation.getCurrentPosition(
+      (pos) => {
+        latInput.value = String(pos.coords.latitude);
+        lngInput.value = String(pos.coords.longitude);
+        toast.classList.add('show');
+        setTimeout(()=>toast.classList.remove('show'), 3000);
+      },
+      (err) => { console.warn("Geo erro:", err); },
+      { enableHighAccuracy: true, timeout: 12000, maximumAge: 0 }
+    );
+  }
+});
+
+// Câmera
+const camModal = document.getElementById('camModal');
+const openCam = document.getElementById('openCam');
+const btnClose = document.getElementById('btnClose');
+const btnCapture = document.getElementById('btnCapture');
+const video = document.getElementById('video');
+let stream = null;
+
+openCam.addEventListener('click', async () => {
+  camModal.classList.add('show'); camModal.setAttribute('aria-hidden','false');
+  try{
+    stream = await navigator.mediaDevices.getUserMedia({ video: { facingMode: { ideal: 'environment' } }, audio: false });
+    video.srcObject = stream;
+  }catch(e){ camModal.classList.remove('show'); camModal.setAttribute('aria-hidden','true'); fileInput.click(); }
+});
+function closeCam(){ camModal.classList.remove('show'); camModal.setAttribute('aria-hidden','true'); if(stream){ stream.getTracks().forEach(t=>t.stop()); stream=null; } }
+btnClose.addEventListener('click', closeCam);
+
+// Foto: reduzida aqui ao lado máximo usado no servidor e enviada como JPEG binário no campo "image"
+const MAX_SIDE = PAGE_DATA.upload_max_side;
+let chipUrl = null;
+function showChip(blob){
+  if (chipUrl) URL.revokeObjectURL(chipUrl);
+  chipUrl = URL.createObjectURL(blob); chipImg.src = chipUrl; chip.style.display = 'block';
+}
+function drawScaled(src, w, h){
+  const k = Math.min(1, MAX_SIDE / Math.max(w, h));
+  const c = document.createElement('canvas'); c.width = Math.round(w*k); c.height = Math.round(h*k);
+  c.getContext('2d').drawImage(src, 0, 0, c.width, c.height);
+  return c;
+}
+const toJpeg = (c) => new Promise(res => c.toBlob(res, 'image/jpeg', 0.85));
+function attachPhoto(blob){
+  showChip(blob);
+  try {
+    const dt = new DataTransfer();
+    dt.items.add(new File([blob], 'foto.jpg', { type: 'image/jpeg' }));
+    fileInput.files = dt.files; imgB64.value = '';
+  } catch (e) {  // sem DataTransfer: vai como data URL no campo antigo
+    const r = new FileReader(); r.onload = (ev) => { imgB64.value = String(ev.target.result); }; r.readAsDataURL(blob);
+  }
+}
+
+btnCapture.addEventListener('click', () => {
+  if(!stream) return;
+  const track = stream.getVideoTracks()[0];
+  const s = track.getSettings ? track.getSettings() : {};
+  const w = video.videoWidth || s.width || 1280;
+  const h = video.videoHeight || s.height || 720;
+  const c = drawScaled(video, w, h);
+  closeCam();
+  toJpeg(c).then(blob => { if (blob) attachPhoto(blob); });
+});
+
+// Upload manual: reduz se for maior que o alvo (ou não for JPEG); senão envia o original
+fileInput.addEventListener('change', async () => {
+  imgB64.value = '';
+  const f = fileInput.files && fileInput.files[0];
+  if(!f) { chip.style.display='none'; return; }
+  showChip(f);
+  try {
+    const bmp = await createImageBitmap(f, { imageOrientation: 'from-image' });
+    const small = Math.max(bmp.width, bmp.height) <= MAX_SIDE && f.type === 'image/jpeg';
+    const blob = small ? null : await toJpeg(drawScaled(bmp, bmp.width, bmp.height));
+    bmp.close();
+    if (blob && blob.size < f.size) attachPhoto(blob);
+  } catch (e) { /* formato que o navegador não decodifica (ex.: HEIC): o servidor recebe o original */ }
+});
+
+// Enviar com Enter
+q.addEventListener('keydown', (e) => { if(e.key === 'Enter'){ e.preventDefault(); if (form.requestSubmit) form.requestSubmit(); else form.submit(); } });
+
+// ===== Renderização dos resultados (página pronta ou streaming do /api/analyze) =====
+const esc = (s) => String(s ?? '').replace(/[&<>"']/g, c => ({'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;',"'":'&#39;'}[c]));
+const safeUrl = (u) => /^https?:\/\//i.test(String(u || '')) ? String(u) : '#';
+const slot = (id) => document.getElementById(id);
+const pending = (text) => `<div class="card" data-pending="1"><div class="mut">${esc(text)}</div></div>`;
+
+function shopHTML(s, right){
+  return `<div class="shop">
+    <div style="display:flex;justify-content:space-between;gap:10px;align-items:center">
+      <div style="min-width:0">
+        <b><a href="${esc(safeUrl(s.url))}" target="_blank" rel="noopener">${esc(s.title)}</a></b>
+        <div class="tiny">${esc(s.domain)}</div>
+      </div>
+      <div style="white-space:nowrap">${esc(right || '')}</div>
+    </div>
+    ${s.snippet ? `<div class="mut" style="margin-top:6px">${esc(s.snippet)}</div>` : ''}
+  </div>`;
+}
+
+function renderMe(text, thumb){
+  if (!text && !thumb) { slot('slotMe').innerHTML = ''; return; }
+  slot('slotMe').innerHTML = `<div class="card me"><div class="mut tiny">Você</div>
+    <div class="me-row" style="margin-top:4px">
+      ${thumb ? `<img class="me-thumb" src="${esc(thumb)}" alt="sua foto"/>` : ''}
+      ${text ? `<div>${esc(text)}</div>` : ''}
+    </div></div>`;
+}
+
+function renderProduct(r, model){
+  if (!r) { slot('slotProduct').innerHTML = ''; return; }
+  const title = [r.product_name || 'Produto', r.brand, r.model].filter(Boolean).map(esc).join(' • ');
+  slot('slotProduct').innerHTML = `<div class="card"><div class="mut tiny">Assistente</div>
+    <div style="font-size:18px;font-weight:700;margin:4px 0 6px">${title}</div>
+    ${r.category ? `<div class="mut">Categoria: ${esc(r.category)}</div>` : ''}
+    ${r.confidence_pct ? `<div style="margin-top:6px"><span class="pill">confiança ${esc(r.confidence_pct)}%</span></div>` : ''}
+    ${(r.keywords || []).length ? `<div style="margin-top:6px">${r.keywords.map(k => `<span class="pill">${esc(k)}</span>`).join('')}</div>` : ''}
+    ${r.suggested_query ? `<div class="mut" style="margin-top:8px">Consulta sugerida: <code>${esc(r.suggested_query)}</code></div>` : ''}
+    <div class="tiny" style="margin-top:10px">Modelo: <b>${esc(model)}</b></div></div>`;
+}
+
+function renderPolicy(msg){
+  slot('slotPolicy').innerHTML = `<div class="card" style="border-color:#ffd2d2;background:#fff7f7">
+    <div style="font-weight:700">⚠️ Solicitação não suportada</div>
+    <div class="mut" style="margin-top:6px">${esc(msg)}</div></div>`;
+}
+
+function renderStores(list, note){
+  slot('slotStores').innerHTML = `<div class="card"><div style="font-weight:700">🛒 Onde comprar — Lojas do mapa</div>
+    ${list.length ? `<div class="shops">${list.map(s => shopHTML(s, s.right)).join('')}</div>`
+                  : `<div class="mut">Não encontrei lojas próximas desta categoria.</div>`}
+    ${note ? `<div class="tiny" style="margin-top:10px">${esc(note)}</div>` : ''}</div>`;
+}
+
+function renderOnline(shops, provider){
+  if (!shops || !shops.length) { slot('slotShops').innerHTML = ''; return; }
+  slot('slotShops').innerHTML = `<div class="card"><div style="font-weight:700">🌐 Outras opções online</div>
+    <div class="shops">${shops.map(s => shopHTML(s, s.price)).join('')}</div>
+    <div class="tiny" style="margin-top:10px">Busca: <b>${esc(provider)}</b></div></div>`;
+}
+
+// ===== Carrossel de rotas (um único mapa) =====
+let routes = [], current = 0, map = null, userMarker = null, storeMarker = null, poly = null;
+
+// Encoded Polyline (precisão 5) → [[lat, lng], ...]
+function decodePolyline(str){
+  const out = []; let i = 0, lat = 0, lng = 0;
+  while (i < str.length){
+    for (let k = 0; k < 2; k++){
+      let b, shift = 0, res = 0;
+      do { b = str.charCodeAt(i++) - 63; res |= (b & 0x1f) << shift; shift += 5; } while (b >= 0x20);
+      const d = (res & 1) ? ~(res >> 1) : (res >> 1);
+      if (k === 0) lat += d; else lng += d;
+    }
+    out.push([lat / 1e5, lng / 1e5]);
+  }
+  return out;
+}
+
+// Geometria sob demanda (/api/route): a rota exibida é buscada na hora e a seguinte em segundo plano
+const routeGeo = new Map();   // route_url → Promise<{distance_km, duration_min, polyline} | null>
+function loadRoute(r){
+  if (!r.route_url) return Promise.resolve(r.polyline ? r : null);
+  if (!routeGeo.has(r.route_url)) {
+    routeGeo.set(r.route_url, fetch(r.route_url).then(resp => resp.ok ? resp.json() : null).catch(() => null)
+      .then(geo => { if (!geo) routeGeo.delete(r.route_url); return geo; }));   // falhou: tenta de novo na próxima vez
+  }
+  return routeGeo.get(r.route_url);
+}
+function prefetchRoute(r){
+  if (!r) return;
+  if (window.requestIdleCallback) requestIdleCallback(() => loadRoute(r), { timeout: 1500 });
+  else setTimeout(() => loadRoute(r), 200);
+}
+function estimateText(r){
+  return r.duration_min != null ? `~${esc(r.distance_km)} km · ~${esc(r.duration_min)} min (estimativa)`
+                                : `~${esc(r.distance_km)} km em linha reta`;
+}
+
+function ensureRoutesCard(){
+  if (map) return;
+  slot('colSide').innerHTML = `<div class="card">
+      <div class="car-head">
+        <div style="font-weight:700" id="routesTitle"></div>
+        <div class="car-ctrl">
+          <button class="car-btn attn" id="prevBtn" title="Mostrar rota da loja anterior" aria-label="Mostrar rota da loja anterior">◀ Loja anterior</button>
+          <div id="dots" class="dots" aria-label="Seleção de loja"></div>
+          <button class="car-btn attn" id="nextBtn" title="Mostrar rota da próxima loja" aria-label="Mostrar rota da próxima loja">Próxima loja ▶</button>
+        </div>
+      </div>
+      <div id="routeInfo" class="mut" style="margin:6px 0 8px"></div>
+      <div id="map" class="mapbox"></div>
+      <div id="openLinks" class="car-hint"></div>
+      <div class="car-hint">Dica: use os botões acima ou as teclas ← → para alternar entre as lojas.</div>
+    </div>`;
+  map = L.map('map');
+  L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
+    maxZoom: 19, attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OSM</a>'
+  }).addTo(map);
+  slot('prevBtn').addEventListener('click', () => { if (current > 0) { current--; renderRoute(true); } });
+  slot('nextBtn').addEventListener('click', () => { if (current < routes.length-1) { current++; renderRoute(true); } });
+  setTimeout(()=>{ const p = slot('prevBtn'), n = slot('nextBtn'); if (p) p.classList.remove('attn'); if (n) n.classList.remove('attn'); }, 6000);
+}
+
+function resetRoutes(){
+  if (map) { map.remove(); map = null; }
+  userMarker = storeMarker = poly = null; routes = []; current = 0;
+  slot('colSide').innerHTML = '';
+}
+
+function renderDots(){
+  const dotsEl = slot('dots');
+  dotsEl.innerHTML = '';
+  routes.forEach((_, i) => {
+    const d = document.createElement('div');
+    d.className = 'dot' + (i===current?' active':'');
+    d.title = 'Ir para a loja ' + String(i+1);
+    d.style.cursor = 'pointer';
+    d.addEventListener('click', () => { current = i; renderRoute(true); });
+    dotsEl.appendChild(d);
+  });
+}
+
+function renderRoute(userAction=false){
+  const r = routes[current];
+  const prevBtn = slot('prevBtn'), nextBtn = slot('nextBtn');
+  slot('routesTitle').textContent = `📍 Rotas — ${routes.length} lojas próximas`;
+  slot('routeInfo').innerHTML = `<b>${current+1}/${routes.length}) ${esc(r.store_name)}</b><br/>${esc(r.store_address)}<br/>${estimateText(r)}`;
+
+  if (poly) { map.removeLayer(poly); poly = null; }
+  if (userMarker) { map.removeLayer(userMarker); userMarker = null; }
+  if (storeMarker) { map.removeLayer(storeMarker); storeMarker = null; }
+
+  const user = [r.user_lat, r.user_lng];
+  const store = [r.store_lat, r.store_lng];
+
+  userMarker = L.marker(user).addTo(map).bindPopup("Você");
+  storeMarker = L.marker(store).addTo(map).bindPopup(r.store_name);
+  map.fitBounds(L.latLngBounds([user, store]), { padding: [40,40] });
+
+  loadRoute(r).then(geo => {
+    if (!geo || !map || routes[current] !== r) return;   // trocou de loja (ou de busca) enquanto carregava
+    if (poly) map.removeLayer(poly);
+    poly = L.polyline(decodePolyline(geo.polyline || ''), { weight: 5, color:'#2F6BFF' }).addTo(map);
+    map.fitBounds(L.latLngBounds([user, store, ...poly.getLatLngs()]), { padding: [40,40] });
+  });
+  prefetchRoute(routes[current + 1]);
+
+  prevBtn.disabled = (current === 0);
+  nextBtn.disabled = (current === routes.length - 1);
+
+  // Links rápidos
+  const site = r.website ? `<a href="${esc(safeUrl(r.website))}" target="_blank" rel="noopener">Abrir site da loja</a>` : '';
+  const maps = r.maps_url ? `<a href="${esc(safeUrl(r.maps_url))}" target="_blank" rel="noopener">Abrir no Google Maps</a>` : '';
+  slot('openLinks').innerHTML = [site, maps].filter(Boolean).join(" · ");
+
+  if (userAction){
+    prevBtn.classList.remove('attn');
+    nextBtn.classList.remove('attn');
+  }
+
+  renderDots();
+  setTimeout(()=>map.invalidateSize(), 50);
+}
+
+function showRoutes(list){
+  if (!list || !list.length) { resetRoutes(); return; }
+  const shown = routes[current];
+  routes = list.slice().sort((a, b) => a.distance_km - b.distance_km);
+  ensureRoutesCard();
+  const keep = shown ? routes.findIndex(r => r.store_lat === shown.store_lat && r.store_lng === shown.store_lng) : -1;
+  current = keep >= 0 ? keep : Math.min(current, routes.length - 1);
+  renderRoute();
+}
+
+// Atalhos de teclado ← →
+window.addEventListener('keydown', (e) => {
+  if (!routes.length || e.target === q) return;
+  if (e.key === 'ArrowLeft' && current > 0){ current--; renderRoute(true); }
+  if (e.key === 'ArrowRight' && current < routes.length-1){ current++; renderRoute(true); }
+});
+
+// ===== Envio com streaming: cada resultado aparece assim que fica pronto =====
+const sendBtn = document.getElementById('sendBtn');
+
+function handleEvent(ev, st){
+  const d = ev.data;
+  switch (ev.event){
+    case 'start': st.model = d.model; break;
+    case 'product': renderProduct(d, st.model); break;
+    case 'stores':
+      if (!st.routed)
+        renderStores(d.slice(0, 3).map(p => ({ title: p.title, url: p.website || p.maps_url, right: `~${p.distance_km} km`,
+                                               domain: (p.website || p.maps_url || '').replace(/^https?:\/\//, '').replace(/^www\./, '').split('/')[0],
+                                               snippet: p.address })), 'Calculando rotas…');
+      break;
+    case 'routes': st.routed = true; showRoutes(d.routes); renderStores(d.stores); break;
+    case 'shops':
+      renderOnline(d.shops, d.provider);
+      if (!st.typed && d.query) renderMe(d.query, st.thumb);
+      break;
+    case 'policy':
+      st.blocked = true; renderPolicy(d.message);
+      slot('slotStores').innerHTML = ''; slot('slotShops').innerHTML = ''; resetRoutes();
+      break;
+    case 'done':
+      if (!st.blocked && !st.routed) renderStores([]);
+      document.querySelectorAll('[data-pending]').forEach(el => el.remove());
+      break;
+    case 'error':
+      document.querySelectorAll('[data-pending]').forEach(el => el.remove());
+      break;
+  }
+}
+
+form.addEventListener('submit', async (e) => {
+  if (!window.fetch || !window.TextDecoder || !window.ReadableStream) return;  // envio tradicional
+  e.preventDefault();
+  const body = new FormData(form);
+  const st = { typed: q.value.trim(), thumb: chip.style.display === 'block' ? chipImg.src : null,
+               hasImage: !!(imgB64.value || (fileInput.files && fileInput.files.length)),
+               model: '', routed: false, blocked: false };
+
+  renderMe(st.typed, st.thumb);
+  slot('slotProduct').innerHTML = st.hasImage ? pending('Identificando o produto…') : '';
+  slot('slotPolicy').innerHTML = '';
+  slot('slotStores').innerHTML = pending('Procurando lojas próximas…');
+  slot('slotShops').innerHTML = pending('Buscando opções online…');
+  resetRoutes();
+  q.value = ''; imgB64.value = ''; fileInput.value = ''; chip.style.display = 'none';
+  sendBtn.disabled = true;
+
+  try {
+    const resp = await fetch(form.dataset.api, { method: 'POST', body, headers: { 'Accept': 'application/x-ndjson' } });
+    if (!resp.ok || !resp.body) throw new Error('HTTP ' + resp.status);
+    const reader = resp.body.getReader(); const dec = new TextDecoder(); let buf = '';
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buf += dec.decode(value, { stream: true });
+      let nl;
+      while ((nl = buf.indexOf('\n')) >= 0) {
+        const line = buf.slice(0, nl).trim(); buf = buf.slice(nl + 1);
+        if (line) handleEvent(JSON.parse(line), st);
+      }
+    }
+  } catch (err) {
+    console.warn('Streaming falhou:', err);
+    handleEvent({ event: 'error', data: {} }, st);
+  } finally {
+    sendBtn.disabled = false;
+  }
+});
+
+if (PAGE_DATA.routes.length > 0) showRoutes(PAGE_DATA.routes);
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+# Antes de importar o compras: bancos SQLite num diretório temporário e sem log de tempos no stdout
+import os, sys, tempfile
+
+_tmp = tempfile.mkdtemp(prefix="compras-test-")
+for _name in ("POI_DB", "VISION_CACHE_DB", "MAPS_CACHE_DB", "SHOP_CACHE_DB", "RATE_LIMIT_DB"):
+    os.environ.setdefault(_name, os.path.join(_tmp, _name.lower() + ".sqlite"))
+os.environ.setdefault("PIPELINE_LOG_TIMINGS", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
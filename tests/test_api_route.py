@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import pytest
+
+import compras
+
+ROUTE = {"distance_km": 1.2, "duration_min": 4, "polyline": "_p~iF~ps|U"}
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    seen = []
+    monkeypatch.setattr(compras, "route_geometry", lambda cell, lat, lng: seen.append((cell, lat, lng)) or dict(ROUTE))
+    return seen
+
+
+def _params(url):
+    return {k: v[0] for k, v in parse_qs(urlsplit(url).query).items()}
+
+
+def test_signed_route_url_is_served_with_private_cache(calls):
+    url = compras.route_url(-23.5505, -46.6333, -23.56, -46.64)
+    r = compras.app.test_client().get(url)
+    assert r.status_code == 200 and r.get_json() == ROUTE
+    assert r.cache_control.private and r.cache_control.max_age == compras.ROUTE_HTTP_MAX_AGE_S
+    assert calls == [(_params(url)["from"], -23.56, -46.64)]
+
+
+@pytest.mark.parametrize("change", [
+    {"to": "-23.57000,-46.64000"},                   # outro destino com a assinatura original
+    {"from": "6gycf0p"},                             # outra origem
+    {"sig": "0" * 20},
+    {"sig": ""},
+])
+def test_tampered_route_url_is_rejected(calls, change):
+    p = _params(compras.route_url(-23.5505, -46.6333, -23.56, -46.64))
+    p.update(change)
+    r = compras.app.test_client().get("/api/route?" + urlencode(p))
+    assert r.status_code == 403
+    assert calls == []
+
+
+def test_origin_must_have_route_precision(calls):
+    p = _params(compras.route_url(-23.5505, -46.6333, -23.56, -46.64))
+    p["from"] = p["from"][:-1]
+    p["sig"] = compras._route_sig(p["from"], p["to"])
+    assert compras.app.test_client().get("/api/route?" + urlencode(p)).status_code == 400
+    assert calls == []
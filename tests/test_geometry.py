@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import math, random
+
+import compras
+
+
+def _decode(s, precision=5):
+    """Decodificador de referência (o mesmo algoritmo do static/app.js): [[lng, lat], ...]."""
+    out, i, lat, lng, f = [], 0, 0, 0, 10 ** precision
+    while i < len(s):
+        vals = []
+        for _ in range(2):
+            shift = res = 0
+            while True:
+                b = ord(s[i]) - 63; i += 1
+                res |= (b & 0x1f) << shift; shift += 5
+                if b < 0x20: break
+            vals.append(~(res >> 1) if res & 1 else res >> 1)
+        lat += vals[0]; lng += vals[1]
+        out.append([lng / f, lat / f])
+    return out
+
+
+def test_polyline_round_trip():
+    rnd = random.Random(7)
+    coords = [[-46.63 + rnd.uniform(-0.2, 0.2), -23.55 + rnd.uniform(-0.2, 0.2)] for _ in range(200)]
+    coords += [[0.0, 0.0], [-179.99999, 89.99999], [179.99999, -89.99999]]
+    back = _decode(compras.polyline_encode(coords))
+    assert len(back) == len(coords)
+    for (x, y), (bx, by) in zip(coords, back):
+        assert abs(x - bx) <= 0.5e-5 + 1e-12 and abs(y - by) <= 0.5e-5 + 1e-12
+
+
+def test_polyline_known_value():
+    # exemplo da documentação do formato: (38.5, -120.2), (40.7, -120.95), (43.252, -126.453)
+    assert compras.polyline_encode([[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]]) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+
+def _dist_to_polyline_m(p, line, lat0):
+    kx, ky = 111320.0 * math.cos(math.radians(lat0)), 110540.0
+    px, py = p[0] * kx, p[1] * ky
+    best = math.inf
+    for a, b in zip(line, line[1:]):
+        ax, ay, bx, by = a[0] * kx, a[1] * ky, b[0] * kx, b[1] * ky
+        dx, dy = bx - ax, by - ay
+        L2 = dx * dx + dy * dy
+        t = 0.0 if L2 == 0 else max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / L2))
+        best = min(best, math.hypot(px - ax - t * dx, py - ay - t * dy))
+    return best
+
+
+def test_simplify_route_stays_within_tolerance():
+    rnd = random.Random(3)
+    coords, lng, lat = [], -46.63, -23.55
+    for _ in range(500):   # rua sinuosa, passos de ~10 m
+        lng += rnd.uniform(-1, 1) * 1e-4; lat += rnd.uniform(0, 1) * 1e-4
+        coords.append([lng, lat])
+    for tol in (1.0, 5.0, 25.0):
+        out = compras.simplify_route(coords, tol)
+        assert out[0] == coords[0] and out[-1] == coords[-1]
+        assert len(out) < len(coords)
+        assert all(p in coords for p in out)
+        assert max(_dist_to_polyline_m(p, out, coords[0][1]) for p in coords) <= tol + 1e-6
+
+
+def test_simplify_route_keeps_short_or_untolerated_lines():
+    line = [[0.0, 0.0], [0.0001, 0.0001]]
+    assert compras.simplify_route(line, 10) == line
+    zig = [[0.0, 0.0], [0.0005, 0.0005], [0.001, 0.0]]
+    assert compras.simplify_route(zig, 0) == zig
+    assert compras.simplify_route(zig, 1000) == [zig[0], zig[-1]]
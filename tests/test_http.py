@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import threading, time
+
+import pytest
+import requests
+
+import compras
+
+HOST = "127.0.0.1:9"   # porta fechada: conexão recusada na hora
+
+
+def _client(rate, **kw):
+    limiter = compras.RateLimiter({HOST: (rate, 1.0)}, compras.LocalBuckets(), max_wait_s=0.1)
+    return compras.HttpClient(limiter=limiter, retries=0, breaker_failures=1, **kw), limiter
+
+
+def test_open_circuit_rejects_without_spending_tokens():
+    http, limiter = _client(0.01, breaker_cooldown_s=60)
+    with pytest.raises(requests.ConnectionError):
+        http.get(f"http://{HOST}/x", timeout=1)
+    for _ in range(3):
+        with pytest.raises(compras.CircuitOpen):
+            http.get(f"http://{HOST}/x", timeout=1)
+    assert limiter.stats()[HOST]["acquired"] == 1 and limiter.stats()[HOST]["shed"] == 0
+
+
+def test_half_open_probe_shed_by_limiter_is_given_back():
+    http, _ = _client(0.01, breaker_cooldown_s=0.05)
+    with pytest.raises(requests.ConnectionError):
+        http.get(f"http://{HOST}/x", timeout=1)
+    time.sleep(0.1)
+    with pytest.raises(compras.RateLimited):   # a vaga de teste do half_open não fica presa
+        http.get(f"http://{HOST}/x", timeout=1)
+    breaker = http.host(f"http://{HOST}/x").breaker
+    assert breaker.state == "half_open" and breaker.allow()
+
+
+def test_limiter_serves_all_waiters_at_the_bucket_rate():
+    limiter = compras.RateLimiter({"h": (20.0, 1.0)}, compras.LocalBuckets(), max_wait_s=5)
+    done = []
+    def go():
+        limiter.acquire("h"); done.append(time.monotonic())
+    t0 = time.monotonic()
+    ts = [threading.Thread(target=go) for _ in range(10)]
+    for t in ts: t.start()
+    for t in ts: t.join(5)
+    assert len(done) == 10
+    assert 0.35 <= max(done) - t0 < 2.0      # 1 da rajada + 9 a 20/s ≈ 0,45 s
+    assert limiter.stats()["h"]["queue_depth"] == 0
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+import compras
+
+
+def test_metrics_store_sums_workers_and_keeps_exited_totals(tmp_path, monkeypatch):
+    path = str(tmp_path / "metrics.sqlite")
+    other = compras.MetricsStore(path, 60)
+    other.db, other.worker = other._open(), "other"
+    me = compras.MetricsStore(path, 60)
+    me.db, me.worker = me._open(), "me"
+    monkeypatch.setattr(compras, "METRICS_STORE", me)
+    c = compras.Counter("compras_test_total", "teste", ("kind",))
+    h = compras._histogram("compras_test_seconds", "teste")
+    try:
+        c.inc("a", n=2); h.observe(0.02)
+        other.flush()                      # retrato do "outro worker": a=2, 1 observação
+        other.retire()                     # e ele sai: vira a linha "exited"
+        c.inc("a"); c.inc("b"); h.observe(3.0)
+        text = compras.render_metrics()
+        assert 'compras_test_total{kind="a"} 5' in text    # 2 (exited) + 3 (este processo)
+        assert 'compras_test_total{kind="b"} 1' in text
+        assert "compras_test_seconds_count 3" in text
+        assert 'compras_stats{section=' not in text or ',pid="' in text
+    finally:
+        compras.METRICS.remove(c); compras.METRICS.remove(h)
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+import compras
+
+
+def test_prune_drops_expired_stores_rtree_entries_and_coverage(tmp_path):
+    ix = compras.PoiIndex(str(tmp_path / "pois.sqlite"))
+    ix.add("grocery", [{"title": "Mercado Velho", "lat": -23.55, "lng": -46.63, "place_id": "old"}], "serpapi")
+    ix.mark_covered("grocery", -23.55, -46.63)
+    c = ix.db.conn()
+    c.execute("UPDATE pois SET updated = 0"); c.execute("UPDATE poi_coverage SET updated = 0")
+    ix.add("grocery", [{"title": "Mercado Novo", "lat": -23.551, "lng": -46.63, "place_id": "new"}], "serpapi")
+    ix.prune(1.0)
+    assert c.execute("SELECT place_id FROM pois").fetchall() == [("new",)]
+    assert c.execute("SELECT COUNT(*) FROM pois_rtree").fetchone()[0] == 1
+    assert c.execute("SELECT COUNT(*) FROM poi_coverage").fetchone()[0] == 0
+    assert ix.stats()["pruned"] == 1
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import compras
+
+LAT, LNG = -23.55, -46.63
+M = 1 / 110540.0   # graus de latitude por metro
+
+
+def _at(north_m, **kw):
+    return dict(kw, lat=LAT + 0.01 + north_m * M, lng=LNG)
+
+
+def _rank(cands, **kw):
+    return compras.rank_candidates(LAT, LNG, cands, **kw)
+
+
+def test_same_place_id_merges_even_far_apart_and_fills_fields():
+    a = _at(0, title="Drogaria Sul", place_id="p1", address="")
+    b = _at(500, title="Drogaria Sul Centro", place_id="p1", address="Rua A, 10", website="https://sul.example")
+    out = _rank([a, b])
+    assert len(out) == 1
+    assert out[0]["address"] == "Rua A, 10" and out[0]["website"] == "https://sul.example"
+    assert out[0]["sources"] == frozenset({"p1"})
+
+
+def test_equivalent_names_merge_only_within_dedupe_radius():
+    assert compras.RANK_DEDUPE_M == 120
+    near = [_at(0, title="Supermercado Dia"), _at(80, title="Dia, Rua Augusta, São Paulo")]
+    far = [_at(0, title="Supermercado Dia"), _at(300, title="Dia, Rua Augusta, São Paulo")]
+    other = [_at(0, title="Supermercado Dia"), _at(50, title="Padaria Estrela")]
+    assert len(_rank(near)) == 1
+    assert len(_rank(far)) == 2
+    assert len(_rank(other)) == 2
+
+
+def test_unnamed_candidates_merge_only_when_very_close():
+    assert len(_rank([_at(0, title="Mercado Bom"), _at(20, title="Supermercado")])) == 1
+    assert len(_rank([_at(0, title="Mercado Bom"), _at(80, title="Supermercado")])) == 2
+
+
+def test_merged_candidate_prefers_most_complete_and_keeps_all_sources():
+    maps = _at(0, title="Loja A")
+    osm = _at(10, title="Loja A", website="https://a.example", address="Rua X")
+    out = _rank([maps, osm])
+    assert len(out) == 1
+    assert (out[0]["lat"], out[0]["lng"]) == (osm["lat"], osm["lng"])     # a do OSM é a mais completa
+    assert out[0]["sources"] == frozenset({(maps["lat"], maps["lng"]), (osm["lat"], osm["lng"])})
+    # reranquear com a fundida não perde a identidade da loja do mapa
+    again = _rank(_rank([maps]) + [osm])
+    assert not again[0]["sources"].isdisjoint({(maps["lat"], maps["lng"])})
+
+
+def test_nearest_first_with_limit():
+    cands = [_at(d, title=f"Loja {n}") for n, d in (("C", 3000), ("A", 0), ("B", 1500))]
+    out = _rank(cands, limit=2)
+    assert [c["title"] for c in out] == ["Loja A", "Loja B"]
+    assert out[0]["distance_km"] <= out[1]["distance_km"]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+import time
+
+import compras
+
+
+def _pair(tmp_path, ttl=0.2):
+    path = str(tmp_path / "shops.sqlite")
+    return (compras.ShopCache(10, {"serpapi": ttl}, 10, path), compras.ShopCache(10, {"serpapi": ttl}, 10, path))
+
+
+def test_stale_memory_entry_picks_up_row_written_by_another_worker(tmp_path):
+    a, b = _pair(tmp_path)
+    a.put("k", [{"n": 1}], "serpapi")
+    assert b.get("k")[0] == [{"n": 1}]
+    time.sleep(0.25)
+    assert b.get("k")[2] == "stale"
+    a.put("k", [{"n": 2}], "serpapi")
+    assert b.get("k") == ([{"n": 2}], "serpapi", "fresh")
+
+
+def test_revalidation_skips_provider_when_another_worker_refreshed(tmp_path):
+    a, b = _pair(tmp_path)
+    a.put("k", [{"n": 1}], "serpapi"); b.get("k")
+    time.sleep(0.25)
+    a.put("k", [{"n": 2}], "serpapi")
+    calls = []
+    b.revalidate("k", lambda: calls.append(1) or ([{"n": 9}], "serpapi"))
+    b._pool.shutdown(wait=True)
+    assert calls == [] and b.get("k")[0] == [{"n": 2}]
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import threading, time
+
+import compras
+
+
+def test_follower_retakes_after_leader_deadline():
+    sf = compras.SingleFlight("test-deadline")
+    calls = []
+    started = threading.Event()
+
+    def fetch():
+        calls.append(threading.current_thread().name)
+        started.set()
+        time.sleep(0.2)
+        compras.clamp_timeout(5)          # sobe DeadlineExceeded se o prazo de quem chama acabou
+        return "ok"
+
+    out = {}
+
+    def leader():
+        with compras.request_deadline(0.05):
+            try:
+                out["leader"] = sf.do("k", fetch)
+            except Exception as e:
+                out["leader"] = e
+
+    def follower():
+        started.wait(1)
+        with compras.request_deadline(5):
+            out["follower"] = sf.do("k", fetch)
+
+    ts = [threading.Thread(target=leader, name="leader"), threading.Thread(target=follower, name="follower")]
+    for t in ts: t.start()
+    for t in ts: t.join(5)
+
+    assert isinstance(out["leader"], compras.DeadlineExceeded)
+    assert out["follower"] == "ok"
+    assert calls == ["leader", "follower"]
+    assert sf.stats()["retaken"] == 1 and sf.stats()["in_flight"] == 0
+
+
+def test_follower_shares_result_and_real_errors():
+    sf = compras.SingleFlight("test-share")
+    gate = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1); gate.wait(1)
+        raise ValueError("upstream")
+
+    errs = []
+    def run():
+        try: sf.do("k", fetch)
+        except Exception as e: errs.append(e)
+
+    ts = [threading.Thread(target=run) for _ in range(3)]
+    ts[0].start(); time.sleep(0.05)
+    for t in ts[1:]: t.start()
+    time.sleep(0.05); gate.set()
+    for t in ts: t.join(5)
+
+    assert len(calls) == 1
+    assert len(errs) == 3 and all(isinstance(e, ValueError) for e in errs)
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import compras
+
+
+@pytest.mark.parametrize("text", ["met", "quero MET", "ÊXTASE", "êxtase barato", "comprar crack", "cocaína", "Maconha?"])
+def test_prohibited_blocks_whole_terms_with_any_case_and_accent(text):
+    assert compras.is_prohibited(text)
+
+
+@pytest.mark.parametrize("text", ["metal", "parafuso de metal", "crackers", "cream crackers", "metade", "ecstasyland", ""])
+def test_prohibited_ignores_terms_inside_words(text):
+    assert not compras.is_prohibited(text)
+
+
+def test_term_matcher_accepts_plurals_but_not_other_suffixes():
+    m = compras.term_matcher(frozenset({"caderno", "papel"}))
+    assert m.matches("Cadernos escolares") and not m.matches("papeis")
+    assert m.matches("PAPEL A4") and not m.matches("papelaria")
+    assert m.matches("caderno-brochura") and not m.matches("supercaderno")
+
+
+def test_intent_priority_follows_table_order():
+    # auto_service vem antes de grocery na tabela: "óleo" também é termo de mercado
+    assert compras.match_intent("troca de óleo na oficina", None) == "auto_service"
+    assert compras.match_intent("Dipirona 500mg", None) == "pharmacy"
+    assert compras.match_intent("xyz", None) is None
+    assert compras.detect_intent("xyz", None) == "grocery"
+    assert compras.match_intent("", {"product_name": "Alicate universal", "keywords": []}) == "tools"
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import io
+
+import pytest
+from PIL import Image
+
+import compras
+
+
+def _jpeg(w, h):
+    out = io.BytesIO()
+    Image.new("RGB", (w, h), (120, 80, 40)).save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+def test_prepare_upload_rejects_images_over_pixel_budget(monkeypatch):
+    monkeypatch.setattr(compras, "IMAGE_MAX_PIXELS", 1000 * 1000)
+    with pytest.raises(ValueError, match="limite de pixels"):
+        compras.prepare_upload(io.BytesIO(_jpeg(1200, 1000)))
+
+
+def test_prepare_upload_within_budget_outputs_resized_jpeg_thumb_and_low():
+    out = compras.prepare_upload(io.BytesIO(_jpeg(2000, 1500)), max_side=1280, thumb_side=360, low_side=512)
+    assert out["size"] == (1280, 960)
+    assert Image.open(io.BytesIO(out["thumb"])).size == (360, 270)
+    assert Image.open(io.BytesIO(out["low"])).size == (512, 384)
+    assert isinstance(out["phash"], int)
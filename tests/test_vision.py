@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import compras
+
+GOOD = {"product_name": "Arroz Tipo 1 5kg", "suggested_query": "arroz 5kg", "confidence_pct": 92}
+
+
+@pytest.mark.parametrize("info, reason", [
+    (GOOD, None),
+    (dict(GOOD, confidence_pct=40), "low_confidence"),
+    (dict(GOOD, confidence_pct="alta"), "missing_fields"),
+    (dict(GOOD, product_name=""), "missing_fields"),
+    ({k: v for k, v in GOOD.items() if k != "suggested_query"}, "missing_fields"),
+    ({"error": "timeout"}, "missing_fields"),
+    (None, "missing_fields"),
+])
+def test_escalation_reason(info, reason):
+    assert compras.vision_escalation_reason(info) == reason
+
+
+@pytest.fixture
+def vision(monkeypatch):
+    """Réplica da visão: responde conforme o detail pedido e registra as chamadas."""
+    answers, calls = {}, []
+    def fake(uri, user_locale="pt-BR", user_hint="", detail=None):
+        d = detail or "full"; calls.append(d)
+        return dict(answers[d])
+    monkeypatch.setattr(compras, "identify_product_with_gpt4omini", fake)
+    monkeypatch.setattr(compras, "VISION_MODE", "adaptive")
+    monkeypatch.setattr(compras, "VISION_FULL_SAMPLE", 0.0)
+    return answers, calls
+
+
+def test_confident_low_detail_answer_is_used(vision):
+    answers, calls = vision
+    answers["low"] = GOOD
+    assert compras.identify_product(b"full", b"low") == GOOD
+    assert calls == ["low"]
+
+
+def test_unsure_low_detail_answer_escalates_to_full(vision):
+    answers, calls = vision
+    answers["low"] = dict(GOOD, confidence_pct=35)
+    answers["full"] = dict(GOOD, product_name="Arroz Tio João 5kg")
+    before = compras.VISION_ESCALATIONS_TOTAL._values.get(("low_confidence",), 0)
+    assert compras.identify_product(b"full", b"low")["product_name"] == "Arroz Tio João 5kg"
+    assert calls == ["low", "full"]
+    assert compras.VISION_ESCALATIONS_TOTAL._values.get(("low_confidence",), 0) == before + 1
+
+
+def test_failed_full_keeps_named_low_detail_answer(vision):
+    answers, calls = vision
+    answers["low"] = dict(GOOD, confidence_pct=35)
+    answers["full"] = {"error": "timeout"}
+    assert compras.identify_product(b"full", b"low")["product_name"] == GOOD["product_name"]
+    assert calls == ["low", "full"]
+
+
+def test_full_mode_sends_only_the_full_image(vision, monkeypatch):
+    answers, calls = vision
+    monkeypatch.setattr(compras, "VISION_MODE", "full")
+    answers["full"] = GOOD
+    compras.identify_product(b"full", b"low")
+    assert calls == ["full"]